@@ -0,0 +1,235 @@
+#Batch replay of PGN archives: every move is checked against the legal moves of a GameState in worker processes,
+#and the statistics are merged in the parent. Games are streamed in fixed-size chunks with a bounded number in
+#flight, and a state file records finished chunks so an interrupted run can --resume and separate runs can be --merge'd.
+#Run: python ChessBatch.py archive.pgn.gz [more.pgn] --workers 8 --state nightly.json [--resume]
+#     python ChessBatch.py --merge a.json b.json --state all.json
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import ChessEngine
+import ChessPGN
+
+MAX_REPORTS = 1000 #illegal move reports kept in full, the rest are only counted
+LABEL_TAGS = ("Event", "Round", "White", "Black")
+
+
+class BatchStats():
+    def __init__(self):
+        self.games = 0
+        self.plies = 0
+        self.legalMoves = 0 #sum over every replayed position of its number of legal moves
+        self.results = {}
+        self.openings = {} #first few SAN moves -> games
+        self.illegalGames = 0
+        self.illegalReports = []
+        self.chunks = [] #"source:chunk" ids already counted, for resuming and merging
+        self.chunkSize = None #games per chunk of those ids; runs with another size number their chunks differently
+
+    def branchingFactor(self):
+        return self.legalMoves / self.plies if self.plies else 0.0
+
+    def merge(self, other):
+        if other.chunkSize is not None:
+            if self.chunkSize is not None and other.chunkSize != self.chunkSize:
+                raise ValueError("counted in chunks of %d games, not %d" % (other.chunkSize, self.chunkSize))
+            self.chunkSize = other.chunkSize
+        overlap = set(self.chunks) & set(other.chunks)
+        if overlap:
+            raise ValueError("chunks counted twice: %s" % ", ".join(sorted(overlap)[:5]))
+        self.games += other.games
+        self.plies += other.plies
+        self.legalMoves += other.legalMoves
+        for result, count in other.results.items():
+            self.results[result] = self.results.get(result, 0) + count
+        for opening, count in other.openings.items():
+            self.openings[opening] = self.openings.get(opening, 0) + count
+        self.illegalGames += other.illegalGames
+        self.illegalReports.extend(other.illegalReports[:max(0, MAX_REPORTS - len(self.illegalReports))])
+        self.chunks.extend(other.chunks)
+
+    def toDict(self, topOpenings=None):
+        openings = sorted(self.openings.items(), key=lambda item: -item[1])
+        if topOpenings is not None:
+            openings = openings[:topOpenings]
+        return {"games": self.games, "plies": self.plies, "legalMoves": self.legalMoves,
+                "branchingFactor": round(self.branchingFactor(), 3), "results": self.results,
+                "openings": dict(openings), "illegalGames": self.illegalGames,
+                "illegalReports": self.illegalReports, "chunks": self.chunks, "chunkSize": self.chunkSize}
+
+    @classmethod
+    def fromDict(cls, data):
+        stats = cls()
+        for name in ("games", "plies", "legalMoves", "results", "openings", "illegalGames", "illegalReports", "chunks"):
+            setattr(stats, name, data[name])
+        stats.chunkSize = data.get("chunkSize")
+        return stats
+
+
+def loadStats(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return BatchStats.fromDict(json.load(f))
+
+def saveStats(stats, path):
+    #Write a temporary file and rename it over the old one, so a crash never leaves half a state file
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(stats.toDict(), f)
+    os.replace(temporary, path)
+
+
+def replayChunk(chunkId, firstGame, games, openingPlies, stateClass):
+    #Worker: games are (FEN or None, result, SAN moves, label) tuples, numbered from firstGame
+    stats = BatchStats()
+    stats.chunks.append(chunkId)
+    source = chunkId.rsplit(":", 1)[0]
+    for number, (fen, result, moves, label) in enumerate(games, firstGame):
+        stats.games += 1
+        stats.results[result] = stats.results.get(result, 0) + 1
+        try:
+            gs = stateClass.fromFEN(fen) if fen else stateClass()
+        except ValueError as e:
+            stats.illegalGames += 1
+            if len(stats.illegalReports) < MAX_REPORTS:
+                stats.illegalReports.append({"source": source, "game": number, "label": label, "ply": 0,
+                                             "move": None, "fen": fen, "error": str(e)})
+            continue
+        for ply, san in enumerate(moves, 1):
+            legalMoves = gs.getValidMoves()
+            try:
+                move = gs.parseSAN(san)
+            except ValueError as e:
+                stats.illegalGames += 1
+                if len(stats.illegalReports) < MAX_REPORTS:
+                    stats.illegalReports.append({"source": source, "game": number, "label": label, "ply": ply,
+                                                 "move": san, "fen": gs.toFEN(), "error": str(e)})
+                break
+            stats.plies += 1 #only plies that were actually replayed
+            stats.legalMoves += len(legalMoves)
+            gs.makeMove(move, checkForGameEnd=False)
+        if not fen and moves:
+            opening = " ".join(moves[:openingPlies])
+            stats.openings[opening] = stats.openings.get(opening, 0) + 1
+    return stats
+
+def gameChunks(paths, chunkSize):
+    #(chunk id, number of the first game, games) for every chunk of every file, read lazily
+    for path in paths:
+        chunk = []
+        chunkIndex = 0
+        for game in ChessPGN.readGames(path):
+            label = " ".join(game.tags[name] for name in LABEL_TAGS if game.tags.get(name, "?") != "?")
+            chunk.append((game.tags.get("FEN"), game.result, game.moves, label))
+            if len(chunk) == chunkSize:
+                yield "%s:%d" % (path, chunkIndex), chunkIndex * chunkSize + 1, chunk
+                chunk = []
+                chunkIndex += 1
+        if chunk:
+            yield "%s:%d" % (path, chunkIndex), chunkIndex * chunkSize + 1, chunk
+
+def runBatch(paths, workers=None, chunkSize=200, openingPlies=4, stateClass=ChessEngine.GameState,
+             stats=None, statePath=None, checkpointSeconds=30.0, progress=None):
+    #Replay every game in paths and return the merged BatchStats. Chunks already in stats are skipped (resume).
+    #progress(stats, seconds) is called after each finished chunk. ValueError if stats was counted with another
+    #chunk size: chunk ids are numbered by chunk, so its ids would name different games
+    stats = stats or BatchStats()
+    if stats.chunks and stats.chunkSize is None:
+        raise ValueError("the state does not record its chunk size, it can't be resumed")
+    if stats.chunkSize is not None and stats.chunkSize != chunkSize:
+        raise ValueError("the state was counted in chunks of %d games, resume with --chunk %d" %
+                         (stats.chunkSize, stats.chunkSize))
+    stats.chunkSize = chunkSize
+    done = set(stats.chunks)
+    workers = workers or os.cpu_count() or 1
+    maxPending = workers * 2 #bounds memory: only this many chunks are parsed ahead of the workers
+    start = time.perf_counter()
+    lastCheckpoint = start
+    pending = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def collect(finished):
+            nonlocal lastCheckpoint
+            for future in finished:
+                stats.merge(future.result())
+            if progress is not None:
+                progress(stats, time.perf_counter() - start)
+            if statePath is not None and time.perf_counter() - lastCheckpoint >= checkpointSeconds:
+                saveStats(stats, statePath)
+                lastCheckpoint = time.perf_counter()
+
+        for chunkId, firstGame, games in gameChunks(paths, chunkSize):
+            if chunkId in done:
+                continue
+            pending.add(executor.submit(replayChunk, chunkId, firstGame, games, openingPlies, stateClass))
+            if len(pending) >= maxPending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    if statePath is not None:
+        saveStats(stats, statePath)
+    return stats
+
+def printProgress(out, alreadyCounted=0):
+    #alreadyCounted: games in the state a resumed run started from, left out of the rate
+    def report(stats, seconds):
+        out.write("\r%d games  %d plies  %.0f games/s  illegal %d" % (
+            stats.games, stats.plies, (stats.games - alreadyCounted) / seconds if seconds > 0 else 0.0,
+            stats.illegalGames))
+        out.flush()
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay PGN archives in parallel and collect statistics")
+    parser.add_argument("pgn", nargs="*", help="PGN files, .gz allowed")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunk", type=int, default=200, help="games per task (default 200)")
+    parser.add_argument("--opening-plies", type=int, default=4, help="moves counted as the opening (default 4)")
+    parser.add_argument("--bitboard", action="store_true", help="use the ChessBitboard backend")
+    parser.add_argument("--state", help="JSON file for results; written during the run as a checkpoint")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the chunks already in --state (give the PGN paths the same way as before)")
+    parser.add_argument("--merge", nargs="+", metavar="STATE", help="merge state files from separate runs into --state")
+    parser.add_argument("--top", type=int, default=20, help="openings to print (default 20)")
+    args = parser.parse_args(argv)
+
+    if args.merge:
+        stats = BatchStats()
+        for path in args.merge:
+            try:
+                stats.merge(loadStats(path))
+            except ValueError as e:
+                parser.error("%s: %s" % (path, e))
+        if args.state:
+            saveStats(stats, args.state)
+    else:
+        if not args.pgn:
+            parser.error("no PGN files given")
+        stateClass = ChessEngine.GameState
+        if args.bitboard:
+            import ChessBitboard
+            stateClass = ChessBitboard.BitboardGameState
+        stats = loadStats(args.state) if args.resume and args.state and os.path.exists(args.state) else None
+        startPlies = stats.plies if stats is not None else 0
+        start = time.perf_counter()
+        try:
+            stats = runBatch(args.pgn, args.workers or None, args.chunk, args.opening_plies, stateClass, stats,
+                             args.state, progress=printProgress(sys.stderr, stats.games if stats is not None else 0))
+        except ValueError as e:
+            parser.error("%s: %s" % (args.state, e))
+        seconds = time.perf_counter() - start
+        plies = stats.plies - startPlies
+        sys.stderr.write("\n%.1fs, %.0f plies/s\n" % (seconds, plies / seconds if seconds > 0 else 0.0))
+
+    summary = stats.toDict(args.top)
+    del summary["chunks"], summary["chunkSize"]
+    summary["illegalReports"] = summary["illegalReports"][:args.top]
+    json.dump(summary, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if stats.illegalGames else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
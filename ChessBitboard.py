@@ -0,0 +1,559 @@
+#Bitboard backend for GameState. Twelve 64-bit piece bitboards plus occupancy masks and a flat list of the piece on
+#every square are the position; makeMove/undoMove and move generation work on those alone, and the 8x8 string board
+#GameState code reads (FEN, SAN, the UI ...) is only rebuilt from the square list when something asks for it.
+#Square index = row * 8 + col, so a8 = 0 and h1 = 63 (same orientation as GameState.board)
+import ChessEngine
+from ChessEngine import Move, ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE, ZOBRIST_CASTLING, ZOBRIST_ENPASSANT, \
+    PROMOTION_CODES, PROMOTION_FLAG, castleRightsIndex
+from ChessEvaluation import MG_SQUARE_SCORES, EG_SQUARE_SCORES, PHASE_WEIGHTS
+from ChessTables import SQUARE_COORDS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS, RAYS, KNIGHT_MASKS, KING_MASKS, \
+    PAWN_CAPTURE_MASKS, RAY_MASKS, POSITIVE_DIRECTIONS
+
+PIECES = ('wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+BLACK_OFFSET = 6
+
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (r * 8) for r in range(8))
+FILE_H = FILE_A << 7
+ROW_2 = 0xFF << 16 #row index 2 (rank 6), black double push passes through here
+ROW_5 = 0xFF << 40 #row index 5 (rank 3), white double push passes through here
+
+#Castling rights as in ChessEngine.castleRightsIndex (1 = wK, 2 = wQ, 4 = bK, 8 = bQ). A move from or to a king
+#or rook home square keeps only the rights in CASTLE_KEEP of that square
+CASTLE_KEEP = [15] * 64
+CASTLE_KEEP[63], CASTLE_KEEP[56], CASTLE_KEEP[60] = 15 & ~1, 15 & ~2, 15 & ~3
+CASTLE_KEEP[7], CASTLE_KEEP[0], CASTLE_KEEP[4] = 15 & ~4, 15 & ~8, 15 & ~12
+CASTLE_RIGHTS = tuple((bool(i & 1), bool(i & 2), bool(i & 4), bool(i & 8)) for i in range(16))
+
+#Moves never change once built, so generated Moves are shared: one object per squares, promotion and the two
+#pieces involved, looked up by MOVE_KEY_OF_PIECE / CAPTURE_KEY_OF_PIECE | Move.code instead of built per position
+MOVE_KEY_OF_PIECE = {piece: i << 15 for i, piece in enumerate(PIECES)}
+CAPTURE_KEY_OF_PIECE = {piece: i << 19 for i, piece in enumerate(PIECES + ("--",))}
+CASTLE_KEY = 13 << 19 #in place of the captured piece, castling never captures
+_moveCache = {}
+
+def cachedMove(startSq, endSq, pieceMoved, pieceCaptured, promotionChoice=None):
+    code = startSq | endSq << 6
+    if promotionChoice is not None:
+        code |= PROMOTION_CODES[promotionChoice] << 12 | PROMOTION_FLAG
+    key = code | MOVE_KEY_OF_PIECE[pieceMoved] | CAPTURE_KEY_OF_PIECE[pieceCaptured]
+    move = _moveCache.get(key)
+    if move is None:
+        startRow, startCol = SQUARE_COORDS[startSq]
+        endRow, endCol = SQUARE_COORDS[endSq]
+        move = _moveCache[key] = Move.build(startRow, startCol, endRow, endCol, pieceMoved, pieceCaptured,
+                                            promotionChoice is not None, promotionChoice or 'Q')
+    return move
+
+#Empty board rook and bishop lines, a cheap test before doing the blocker scan
+ROOK_LINES = tuple(RAY_MASKS[0][sq] | RAY_MASKS[1][sq] | RAY_MASKS[2][sq] | RAY_MASKS[3][sq] for sq in range(64))
+BISHOP_LINES = tuple(RAY_MASKS[4][sq] | RAY_MASKS[5][sq] | RAY_MASKS[6][sq] | RAY_MASKS[7][sq] for sq in range(64))
+
+def _betweenTable():
+    #BETWEEN[a][b] = squares strictly between a and b when they share a line, otherwise 0
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for ray in RAYS[sq]:
+            mask = 0
+            for endRow, endCol in ray:
+                table[sq][endRow * 8 + endCol] = mask
+                mask |= 1 << (endRow * 8 + endCol)
+    return tuple(tuple(row) for row in table)
+
+BETWEEN = _betweenTable()
+
+
+#Per square and direction: (ray from the square, the same direction's rays of every square, nearest blocker is
+#the lowest bit), so the blocker scan indexes nothing but the ray it cuts
+def _slidingRays(directions):
+    return tuple(tuple((RAY_MASKS[d][sq], RAY_MASKS[d], POSITIVE_DIRECTIONS[d]) for d in directions
+                       if RAY_MASKS[d][sq]) for sq in range(64))
+
+ROOK_RAYS = _slidingRays(ROOK_DIRECTIONS)
+BISHOP_RAYS = _slidingRays(BISHOP_DIRECTIONS)
+QUEEN_RAYS = _slidingRays(range(8))
+
+def slidingRayAttacks(rays, occupied):
+    attacks = 0
+    for ray, rayMasks, positive in rays:
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                blocker = (blockers & -blockers).bit_length() - 1 #nearest blocker is the lowest bit
+            else:
+                blocker = blockers.bit_length() - 1 #nearest blocker is the highest bit
+            ray ^= rayMasks[blocker] #cut the ray off behind the blocker
+        attacks |= ray
+    return attacks
+
+def rookAttacks(sq, occupied):
+    return slidingRayAttacks(ROOK_RAYS[sq], occupied)
+
+def bishopAttacks(sq, occupied):
+    return slidingRayAttacks(BISHOP_RAYS[sq], occupied)
+
+def queenAttacks(sq, occupied):
+    return slidingRayAttacks(QUEEN_RAYS[sq], occupied)
+
+def squaresOf(bb):
+    squares = []
+    while bb:
+        low = bb & -bb
+        squares.append(low.bit_length() - 1)
+        bb ^= low
+    return squares
+
+
+class BitboardGameState(ChessEngine.GameState):
+    def __init__(self):
+        self._board = None
+        ChessEngine.GameState.__init__(self) #its board assignment loads the bitboards
+
+    @property
+    def board(self):
+        #8x8 piece codes like GameState.board, rebuilt from the square list after a move the first time it is read.
+        #It is a copy: change the position through makeMove/undoMove/setPosition, not by writing to it
+        board = self._board
+        if board is None:
+            squares = self.squares
+            board = self._board = [squares[i:i + 8] for i in range(0, 64, 8)]
+        return board
+
+    @board.setter
+    def board(self, board):
+        self.squares = [piece for row in board for piece in row]
+        self._board = None
+        self.loadBitboards()
+
+    def loadBitboards(self):
+        #Rebuild every bitboard from the square list (used after setting up a position by hand)
+        self.pieceBitboards = [0] * 12
+        for sq, piece in enumerate(self.squares):
+            if piece != "--":
+                self.pieceBitboards[PIECE_INDEX[piece]] |= 1 << sq
+        self.updateOccupancy()
+
+    def updateOccupancy(self):
+        bbs = self.pieceBitboards
+        self.whiteOccupancy = bbs[0] | bbs[1] | bbs[2] | bbs[3] | bbs[4] | bbs[5]
+        self.blackOccupancy = bbs[6] | bbs[7] | bbs[8] | bbs[9] | bbs[10] | bbs[11]
+        self.occupied = self.whiteOccupancy | self.blackOccupancy
+
+    def toggleMoveBits(self, move):
+        #XOR is its own inverse, so the same toggles apply a move and take it back
+        bbs = self.pieceBitboards
+        startBit = 1 << (move.code & 63)
+        endBit = 1 << (move.code >> 6 & 63)
+        moved = PIECE_INDEX[move.pieceMoved]
+        ownChange = startBit | endBit
+        enemyChange = 0
+        if move.isEnpassantMove:
+            enemyChange = 1 << (move.startRow * 8 + move.endCol)
+            bbs[PIECE_INDEX[move.pieceCaptured]] ^= enemyChange
+        elif move.pieceCaptured != "--":
+            enemyChange = endBit
+            bbs[PIECE_INDEX[move.pieceCaptured]] ^= endBit
+        bbs[moved] ^= startBit
+        if move.isPawnPromotion:
+            bbs[PIECE_INDEX[move.pieceMoved[0] + move.promotionChoice]] ^= endBit
+        else:
+            bbs[moved] ^= endBit
+        if move.isCastleMove:
+            rook = moved - KING + ROOK
+            row = move.endRow * 8
+            if move.endCol - move.startCol == 2: #kingside, rook h -> f
+                rookChange = (1 << (row + 7)) | (1 << (row + 5))
+            else: #queenside, rook a -> d
+                rookChange = (1 << row) | (1 << (row + 3))
+            bbs[rook] ^= rookChange
+            ownChange ^= rookChange
+        if moved < BLACK_OFFSET:
+            self.whiteOccupancy ^= ownChange
+            self.blackOccupancy ^= enemyChange
+        else:
+            self.blackOccupancy ^= ownChange
+            self.whiteOccupancy ^= enemyChange
+        self.occupied = self.whiteOccupancy | self.blackOccupancy
+
+    def makeMove(self, move, checkForGameEnd=True):
+        #Same bookkeeping as GameState.makeMove (logs, Zobrist key, evaluation, castling rights) with every piece
+        #read from the move and the square list instead of the string board
+        self.validMovesCacheLog.append((self.validMovesCache, self.gameEndStatus))
+        self.validMovesCache = None
+        self.attackMaps = {}
+        self._board = None
+        oldEnpassantFile = self.getEnpassantHashFile()
+        self.toggleMoveBits(move)
+        squares = self.squares
+        code = move.code
+        startSq = code & 63
+        endSq = code >> 6 & 63
+        moved = move.pieceMoved
+        captured = move.pieceCaptured
+        arrived = moved[0] + move.promotionChoice if move.isPawnPromotion else moved
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        if oldEnpassantFile is not None:
+            key ^= ZOBRIST_ENPASSANT[oldEnpassantFile]
+        mgScore, egScore, phase = self.mgScore, self.egScore, self.phase
+
+        squares[startSq] = "--"
+        if captured != "--":
+            capturedSq = startSq - startSq % 8 + endSq % 8 if move.isEnpassantMove else endSq
+            squares[capturedSq] = "--"
+            key ^= ZOBRIST_PIECES[captured][capturedSq]
+            mgScore -= MG_SQUARE_SCORES[captured][capturedSq]
+            egScore -= EG_SQUARE_SCORES[captured][capturedSq]
+            phase -= PHASE_WEIGHTS[captured[1]]
+        squares[endSq] = arrived
+        key ^= ZOBRIST_PIECES[moved][startSq] ^ ZOBRIST_PIECES[arrived][endSq]
+        mgScore += MG_SQUARE_SCORES[arrived][endSq] - MG_SQUARE_SCORES[moved][startSq]
+        egScore += EG_SQUARE_SCORES[arrived][endSq] - EG_SQUARE_SCORES[moved][startSq]
+        if move.isPawnPromotion:
+            phase += PHASE_WEIGHTS[move.promotionChoice]
+            self.pawnPromotion = False
+        if move.isCastleMove:
+            rook = moved[0] + 'R'
+            row = endSq - endSq % 8
+            rookFrom, rookTo = (row + 7, row + 5) if endSq > startSq else (row, row + 3)
+            squares[rookFrom] = "--"
+            squares[rookTo] = rook
+            key ^= ZOBRIST_PIECES[rook][rookFrom] ^ ZOBRIST_PIECES[rook][rookTo]
+            mgScore += MG_SQUARE_SCORES[rook][rookTo] - MG_SQUARE_SCORES[rook][rookFrom]
+            egScore += EG_SQUARE_SCORES[rook][rookTo] - EG_SQUARE_SCORES[rook][rookFrom]
+        if moved[1] == 'K':
+            if moved[0] == 'w':
+                self.whiteKingLocation = SQUARE_COORDS[endSq]
+            else:
+                self.blackKingLocation = SQUARE_COORDS[endSq]
+        self.moveLog.append(move)
+
+        oldRights = castleRightsIndex(self.castleRightsLog[-1])
+        rights = oldRights & CASTLE_KEEP[startSq] & CASTLE_KEEP[endSq]
+        if rights != oldRights:
+            key ^= ZOBRIST_CASTLING[oldRights] ^ ZOBRIST_CASTLING[rights]
+            self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, \
+                self.blackCastleQueenside = CASTLE_RIGHTS[rights]
+        self.castleRightsLog.append(CASTLE_RIGHTS[rights])
+
+        if moved[1] == 'P' and abs(endSq - startSq) == 16:
+            self.enpassantPossible = SQUARE_COORDS[(startSq + endSq) // 2]
+        else:
+            self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        if moved[1] == 'P' or captured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if not self.whiteToMove:
+            self.fullmoveNumber += 1
+        self.whiteToMove = not self.whiteToMove
+
+        newEnpassantFile = self.getEnpassantHashFile()
+        if newEnpassantFile is not None:
+            key ^= ZOBRIST_ENPASSANT[newEnpassantFile]
+        self.zobristKey = key
+        self.zobristKeyLog.append(key)
+        self.repetitionCounts[key] = self.repetitionCounts.get(key, 0) + 1
+        self.mgScore, self.egScore, self.phase = mgScore, egScore, phase
+        self.evaluationLog.append((mgScore, egScore, phase))
+        if checkForGameEnd:
+            self.getValidMoves()
+
+    def undoMove(self):
+        if len(self.moveLog) == 0:
+            return
+        move = self.moveLog.pop()
+        self.validMovesCache, self.gameEndStatus = self.validMovesCacheLog.pop()
+        self.attackMaps = {}
+        self._board = None
+        self.toggleMoveBits(move)
+        squares = self.squares
+        startSq = move.code & 63
+        endSq = move.code >> 6 & 63
+        moved = move.pieceMoved
+        squares[startSq] = moved
+        if move.isEnpassantMove:
+            squares[endSq] = "--"
+            squares[startSq - startSq % 8 + endSq % 8] = move.pieceCaptured
+        else:
+            squares[endSq] = move.pieceCaptured
+        if move.isCastleMove:
+            row = endSq - endSq % 8
+            rookFrom, rookTo = (row + 7, row + 5) if endSq > startSq else (row, row + 3)
+            squares[rookFrom] = squares[rookTo]
+            squares[rookTo] = "--"
+        if moved[1] == 'K':
+            if moved[0] == 'w':
+                self.whiteKingLocation = SQUARE_COORDS[startSq]
+            else:
+                self.blackKingLocation = SQUARE_COORDS[startSq]
+
+        self.castleRightsLog.pop()
+        self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, \
+            self.blackCastleQueenside = self.castleRightsLog[-1]
+        self.enpassantPossibleLog.pop()
+        self.enpassantPossible = self.enpassantPossibleLog[-1]
+        self.halfmoveClockLog.pop()
+        self.halfmoveClock = self.halfmoveClockLog[-1]
+        if self.whiteToMove: #taking back black's move
+            self.fullmoveNumber -= 1
+        self.checkmate = False
+        self.stalemate = False
+        count = self.repetitionCounts[self.zobristKey] - 1
+        if count:
+            self.repetitionCounts[self.zobristKey] = count
+        else:
+            del self.repetitionCounts[self.zobristKey]
+        self.zobristKeyLog.pop()
+        self.zobristKey = self.zobristKeyLog[-1]
+        self.evaluationLog.pop()
+        self.mgScore, self.egScore, self.phase = self.evaluationLog[-1]
+        self.whiteToMove = not self.whiteToMove
+
+    def getEnpassantHashFile(self):
+        #As GameState.getEnpassantHashFile: the file only counts if a pawn of the side to move can capture there
+        if self.enpassantPossible == ():
+            return None
+        epRow, epCol = self.enpassantPossible
+        if self.whiteToMove: #white pawns stand where a black pawn on the en passant square would capture
+            capturers = PAWN_CAPTURE_MASKS[1][epRow * 8 + epCol] & self.pieceBitboards[PAWN]
+        else:
+            capturers = PAWN_CAPTURE_MASKS[0][epRow * 8 + epCol] & self.pieceBitboards[BLACK_OFFSET + PAWN]
+        return epCol if capturers else None
+
+    def generateValidMoves(self):
+        #Checkers and pins are found once; every other piece's targets are then masked so only legal moves come out
+        bbs = self.pieceBitboards
+        if self.whiteToMove:
+            offset, enemyOffset, own = 0, BLACK_OFFSET, self.whiteOccupancy
+        else:
+            offset, enemyOffset, own = BLACK_OFFSET, 0, self.blackOccupancy
+        kingBit = bbs[offset + KING]
+        kingSq = kingBit.bit_length() - 1
+        occupied = self.occupied
+        checkers = self.attackersOf(kingSq, occupied)
+
+        #A pinned piece may only move between the king and its pinner (capturing the pinner included)
+        pinLines = {}
+        enemyQueens = bbs[enemyOffset + QUEEN]
+        snipers = (ROOK_LINES[kingSq] & (bbs[enemyOffset + ROOK] | enemyQueens)) | \
+                  (BISHOP_LINES[kingSq] & (bbs[enemyOffset + BISHOP] | enemyQueens))
+        for sq in squaresOf(snipers):
+            between = BETWEEN[kingSq][sq]
+            blockers = between & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinLines[blockers.bit_length() - 1] = between | (1 << sq)
+
+        moves = []
+        if not checkers & (checkers - 1): #not double check, so other pieces can still move
+            if checkers:
+                checkMask = BETWEEN[kingSq][checkers.bit_length() - 1] | checkers
+            else:
+                checkMask = FULL
+            self.generatePieceMoves(checkMask, pinLines, True, moves)
+
+        #King moves: every target the enemy attack map leaves free (its sliders already see through our king)
+        kingSquare = SQUARE_COORDS[kingSq]
+        self.addMoves(kingSq, KING_MASKS[kingSq] & ~own & ~self.attackMap("b" if self.whiteToMove else "w"), moves)
+        if not checkers:
+            self.getCastleMoves(kingSquare[0], kingSquare[1], moves, "w" if self.whiteToMove else "b")
+
+        # Check for checkmate or stalemate
+        if len(moves) == 0:
+            if checkers:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        else:
+            self.checkmate = False
+            self.stalemate = False
+
+        return moves
+
+    def getAllPossibleMoves(self):
+        moves = []
+        self.generatePieceMoves(FULL, {}, False, moves)
+        for sq in squaresOf(self.pieceBitboards[KING if self.whiteToMove else BLACK_OFFSET + KING]):
+            self.addMoves(sq, KING_MASKS[sq] & ~(self.whiteOccupancy if self.whiteToMove else self.blackOccupancy), moves)
+            r, c = SQUARE_COORDS[sq]
+            self.getCastleMoves(r, c, moves, "w" if self.whiteToMove else "b")
+        return moves
+
+    def getCastleMoves(self, r, c, moves, allyColor):
+        #Path and attack tests on the occupancy and the enemy attack map instead of the string board
+        if allyColor == "w":
+            kingside, queenside, enemyColor = self.whiteCastleKingside, self.whiteCastleQueenside, "b"
+        else:
+            kingside, queenside, enemyColor = self.blackCastleKingside, self.blackCastleQueenside, "w"
+        if not (kingside or queenside):
+            return
+        kingSq = r * 8 + c
+        enemyAttacks = self.attackMap(enemyColor)
+        if enemyAttacks >> kingSq & 1:
+            return
+        occupied = self.occupied
+        if kingside and not occupied >> (kingSq + 1) & 3 and not enemyAttacks >> (kingSq + 1) & 3:
+            moves.append(self.castleMove(kingSq, kingSq + 2))
+        if queenside and not occupied >> (kingSq - 3) & 7 and not enemyAttacks >> (kingSq - 2) & 3:
+            moves.append(self.castleMove(kingSq, kingSq - 2))
+
+    def castleMove(self, kingSq, endSq):
+        key = kingSq | endSq << 6 | MOVE_KEY_OF_PIECE[self.squares[kingSq]] | CASTLE_KEY
+        move = _moveCache.get(key)
+        if move is None:
+            move = _moveCache[key] = Move.__new__(Move)
+            move.setFields(kingSq // 8, kingSq % 8, endSq // 8, endSq % 8, self.squares[kingSq], "--",
+                           False, 'Q', False, True)
+        return move
+
+    def generatePieceMoves(self, targetMask, pinLines, legal, moves):
+        #Everything except the king. targetMask limits destinations (check evasion), pinLines limits pinned pieces
+        bbs = self.pieceBitboards
+        if self.whiteToMove:
+            offset, own, enemy = 0, self.whiteOccupancy, self.blackOccupancy
+        else:
+            offset, own, enemy = BLACK_OFFSET, self.blackOccupancy, self.whiteOccupancy
+        self.getPawnBitboardMoves(bbs[offset + PAWN], enemy, targetMask, pinLines, legal, moves)
+        occupied = self.occupied
+        allowed = ~own & targetMask
+        for sq in squaresOf(bbs[offset + KNIGHT]):
+            if sq not in pinLines: #a pinned knight can never move
+                self.addMoves(sq, KNIGHT_MASKS[sq] & allowed, moves)
+        for sq in squaresOf(bbs[offset + BISHOP]):
+            self.addMoves(sq, bishopAttacks(sq, occupied) & allowed & pinLines.get(sq, FULL), moves)
+        for sq in squaresOf(bbs[offset + ROOK]):
+            self.addMoves(sq, rookAttacks(sq, occupied) & allowed & pinLines.get(sq, FULL), moves)
+        for sq in squaresOf(bbs[offset + QUEEN]):
+            self.addMoves(sq, queenAttacks(sq, occupied) & allowed & pinLines.get(sq, FULL), moves)
+
+    def addMoves(self, startSq, targets, moves):
+        squares = self.squares
+        piece = squares[startSq]
+        startKey = startSq | MOVE_KEY_OF_PIECE[piece]
+        cache = _moveCache
+        while targets:
+            low = targets & -targets
+            endSq = low.bit_length() - 1
+            captured = squares[endSq]
+            move = cache.get(startKey | endSq << 6 | CAPTURE_KEY_OF_PIECE[captured])
+            if move is None:
+                move = cachedMove(startSq, endSq, piece, captured)
+            moves.append(move)
+            targets ^= low
+
+    def getPawnBitboardMoves(self, pawns, enemy, targetMask, pinLines, legal, moves):
+        empty = ~self.occupied & FULL
+        #Shift the whole pawn set at once, then walk the resulting target squares back to their origin
+        if self.whiteToMove:
+            single = (pawns >> 8) & empty
+            double = ((single & ROW_5) >> 8) & empty
+            targetSets = ((single, 8), (double, 16),
+                          (((pawns & ~FILE_A) >> 9) & enemy, 9), (((pawns & ~FILE_H) >> 7) & enemy, 7))
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROW_2) << 8) & empty
+            targetSets = ((single, -8), (double, -16),
+                          (((pawns & ~FILE_A) << 7) & enemy, -7), (((pawns & ~FILE_H) << 9) & enemy, -9))
+        squares = self.squares
+        pawn = "wP" if self.whiteToMove else "bP"
+        for targets, back in targetSets:
+            targets &= targetMask
+            while targets:
+                low = targets & -targets
+                endSq = low.bit_length() - 1
+                targets ^= low
+                startSq = endSq + back
+                if startSq in pinLines and not low & pinLines[startSq]:
+                    continue
+                captured = squares[endSq]
+                if endSq < 8 or endSq >= 56: #last rank, one move per promotion piece
+                    for piece in ChessEngine.PROMOTION_PIECES:
+                        moves.append(cachedMove(startSq, endSq, pawn, captured, piece))
+                else:
+                    moves.append(cachedMove(startSq, endSq, pawn, captured))
+        if self.enpassantPossible != ():
+            epRow, epCol = self.enpassantPossible
+            epSq = epRow * 8 + epCol
+            #A pawn of the other colour standing on the en passant square attacks exactly our capturing squares
+            attackers = PAWN_CAPTURE_MASKS[1 if self.whiteToMove else 0][epSq] & pawns
+            for sq in squaresOf(attackers):
+                if not legal or self._isLegalEnpassantSq(sq, epSq):
+                    startRow, startCol = SQUARE_COORDS[sq]
+                    move = Move.__new__(Move)
+                    move.setFields(startRow, startCol, epRow, epCol, pawn, squares[sq - sq % 8 + epCol],
+                                   False, 'Q', True, False)
+                    moves.append(move)
+
+    def _isLegalEnpassantSq(self, startSq, epSq):
+        #Two pawns leave the same rank at once, which can uncover a check that no pin covers. Test the result directly
+        kingBit = self.pieceBitboards[KING if self.whiteToMove else BLACK_OFFSET + KING]
+        capturedBit = 1 << (startSq - startSq % 8 + epSq % 8)
+        trialOccupied = (self.occupied ^ (1 << startSq) ^ capturedBit) | (1 << epSq)
+        return not self.attackedWith(kingBit.bit_length() - 1, trialOccupied, capturedBit)
+
+    def attackersOf(self, sq, occupied):
+        #Bitboard of pieces of the side not to move that attack sq
+        bbs = self.pieceBitboards
+        if self.whiteToMove:
+            enemy, ownSide = BLACK_OFFSET, 0
+        else:
+            enemy, ownSide = 0, 1
+        queens = bbs[enemy + QUEEN]
+        return (PAWN_CAPTURE_MASKS[ownSide][sq] & bbs[enemy + PAWN]) | (KNIGHT_MASKS[sq] & bbs[enemy + KNIGHT]) | \
+               (KING_MASKS[sq] & bbs[enemy + KING]) | \
+               (rookAttacks(sq, occupied) & (bbs[enemy + ROOK] | queens)) | \
+               (bishopAttacks(sq, occupied) & (bbs[enemy + BISHOP] | queens))
+
+    def computeAttackMap(self, color, seeThroughKing=True):
+        #Same map as GameState.computeAttackMap, built from the piece bitboards: pawns shifted as a set, sliders
+        #cut off by the occupancy without the other side's king (with it when seeThroughKing is False)
+        bbs = self.pieceBitboards
+        if color == "w":
+            side, enemyKing = 0, bbs[BLACK_OFFSET + KING]
+            pawns = bbs[PAWN]
+            attacks = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        else:
+            side, enemyKing = BLACK_OFFSET, bbs[KING]
+            pawns = bbs[BLACK_OFFSET + PAWN]
+            attacks = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL
+        occupied = self.occupied ^ enemyKing if seeThroughKing else self.occupied
+        for sq in squaresOf(bbs[side + KNIGHT]):
+            attacks |= KNIGHT_MASKS[sq]
+        for sq in squaresOf(bbs[side + KING]):
+            attacks |= KING_MASKS[sq]
+        queens = bbs[side + QUEEN]
+        for sq in squaresOf(bbs[side + BISHOP] | queens):
+            attacks |= bishopAttacks(sq, occupied)
+        for sq in squaresOf(bbs[side + ROOK] | queens):
+            attacks |= rookAttacks(sq, occupied)
+        return attacks
+
+    def squareUnderAttack(self, r, c):
+        #Attacked by the side not to move. Unlike the board scan this never flips whiteToMove
+        return self.attackedWith(r * 8 + c, self.occupied, 0)
+
+    def attackedWith(self, sq, occupied, removed):
+        #Is sq attacked by the side not to move, given an occupancy and a mask of enemy pieces taken off the board
+        bbs = self.pieceBitboards
+        if self.whiteToMove:
+            enemy, ownSide = BLACK_OFFSET, 0
+        else:
+            enemy, ownSide = 0, 1
+        keep = ~removed
+        if PAWN_CAPTURE_MASKS[ownSide][sq] & bbs[enemy + PAWN] & keep:
+            return True
+        if KNIGHT_MASKS[sq] & bbs[enemy + KNIGHT] & keep:
+            return True
+        if KING_MASKS[sq] & bbs[enemy + KING]:
+            return True
+        queens = bbs[enemy + QUEEN]
+        rooks = (bbs[enemy + ROOK] | queens) & keep
+        if ROOK_LINES[sq] & rooks and rookAttacks(sq, occupied) & rooks:
+            return True
+        bishops = (bbs[enemy + BISHOP] | queens) & keep
+        if BISHOP_LINES[sq] & bishops and bishopAttacks(sq, occupied) & bishops:
+            return True
+        return False
@@ -0,0 +1,201 @@
+#Headless command line engine: no pygame, only ChessEngine is imported up front (search, perft and the bitboard
+#backend load on first use). Commands come from -c arguments or one per line on stdin, a line holding a FEN sets that position.
+#  echo "perft 4" | python ChessCLI.py
+#  python ChessCLI.py --fen "<FEN>" -c "search depth 5" -c legal
+#Commands:
+#  <FEN> | fen <FEN>           set up a position          startpos           back to the initial position
+#  fen                         print the current FEN      board              print the board
+#  move <move> ...             play moves (SAN or e2e4)   undo [n]           take back n moves (default 1)
+#  legal                       legal moves in SAN         status             ongoing / checkmate / stalemate / draw
+#  eval                        static evaluation, centipawns for white
+#  perft <depth> | divide <depth>
+#  search [depth N] [movetime S] [nodes N]                best move with score, depth, nodes and PV
+#  book                        legal moves of the --book for this position, with their weights
+#  tablebase                   win / draw / loss and mate distance from the --tablebases, with the best move
+#  profile [on|off|reset|json]  engine call counts and times (ChessProfile), shown when no argument is given
+#  quit
+import argparse
+import sys
+
+import ChessEngine
+
+
+class CommandLine():
+    def __init__(self, stateClass=ChessEngine.GameState, hashMB=16, out=sys.stdout, book=None, tablebases=None):
+        self.stateClass = stateClass
+        self.hashMB = hashMB
+        self.out = out
+        self.gs = stateClass()
+        self.searcher = None #created on the first search, keeps its transposition table afterwards
+        self.book = book
+        self.tablebases = tablebases #also used by the search
+        self.commands = {"fen": self.fen, "startpos": self.startpos, "board": self.board, "move": self.move,
+                         "undo": self.undo, "legal": self.legal, "status": self.status, "eval": self.evaluate,
+                         "perft": self.perft, "divide": self.divide, "search": self.search,
+                         "book": self.bookMoves, "tablebase": self.tablebase, "profile": self.profile}
+
+    def write(self, text):
+        self.out.write(text + "\n")
+        self.out.flush() #answers go out as soon as they are ready when driven through a pipe
+
+    def execute(self, line):
+        #Run one command line. False once the input asks to quit
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return True
+        if '/' in line.split()[0]:
+            line = "fen " + line
+        name, _, rest = line.partition(' ')
+        if name == "quit":
+            return False
+        command = self.commands.get(name)
+        if command is None:
+            self.write("error: unknown command %r" % name)
+            return True
+        try:
+            command(rest.split())
+        except ValueError as e:
+            self.write("error: %s" % e)
+        return True
+
+    def fen(self, args):
+        if args:
+            self.gs = self.stateClass.fromFEN(" ".join(args))
+        else:
+            self.write(self.gs.toFEN())
+
+    def startpos(self, args):
+        self.gs = self.stateClass()
+
+    def board(self, args):
+        for r, row in enumerate(self.gs.board):
+            self.write("%d  %s" % (8 - r, " ".join('.' if piece == "--" else
+                                                     (piece[1] if piece[0] == 'w' else piece[1].lower()) for piece in row)))
+        self.write("   a b c d e f g h")
+
+    def move(self, args):
+        for text in args:
+            self.gs.makeMove(self.gs.parseMove(text), checkForGameEnd=False)
+
+    def undo(self, args):
+        for _ in range(int(args[0]) if args else 1):
+            self.gs.undoMove()
+
+    def legal(self, args):
+        self.write(" ".join(sorted(self.gs.getSAN(move) for move in self.gs.getValidMoves())))
+
+    def status(self, args):
+        if self.gs.isCheckmate():
+            self.write("checkmate")
+        elif self.gs.isStalemate():
+            self.write("stalemate")
+        elif self.gs.isDraw():
+            self.write("draw")
+        else:
+            self.write("ongoing")
+
+    def evaluate(self, args):
+        self.write(str(self.gs.evaluate()))
+
+    def perft(self, args):
+        import ChessPerft
+        self.write(str(ChessPerft.perft(self.gs, int(args[0]) if args else 1)))
+
+    def divide(self, args):
+        import ChessPerft
+        split = ChessPerft.divide(self.gs, int(args[0]) if args else 1)
+        for notation, nodes in sorted(split):
+            self.write("%s %d" % (notation, nodes))
+        self.write("total %d" % sum(nodes for _, nodes in split))
+
+    def bookMoves(self, args):
+        if self.book is None:
+            raise ValueError("no book, start with --book")
+        moves = self.book.findMoves(self.gs)
+        for move, weight in moves:
+            self.write("%s %s %d" % (self.gs.getSAN(move), move.getLongNotation(), weight))
+        if not moves:
+            self.write("none")
+
+    def tablebase(self, args):
+        import ChessTablebase
+        if self.tablebases is None:
+            raise ValueError("no tablebases, start with --tablebases")
+        move = self.tablebases.bestMove(self.gs)
+        self.write(ChessTablebase.formatResult(self.tablebases.probe(self.gs)) +
+                   (" best %s %s" % (self.gs.getSAN(move), move.getLongNotation()) if move is not None else ""))
+
+    def profile(self, args):
+        import ChessProfile
+        action = args[0] if args else "show"
+        if action == "on":
+            ChessProfile.enable()
+        elif action == "off":
+            ChessProfile.disable()
+        elif action == "reset":
+            ChessProfile.reset()
+        elif action == "json":
+            self.write(ChessProfile.toJSON())
+        elif action == "show":
+            for line in ChessProfile.formatTable():
+                self.write(line)
+        else:
+            raise ValueError("profile takes on, off, reset or json, not %r" % action)
+
+    def search(self, args):
+        import ChessSearch
+        options = {}
+        for name, value in zip(args[::2], args[1::2]):
+            if name not in ("depth", "movetime", "nodes"):
+                raise ValueError("unknown search limit %r" % name)
+            options[name] = float(value) if name == "movetime" else int(value)
+        if not options:
+            options["depth"] = 4
+        if self.searcher is None:
+            self.searcher = ChessSearch.Searcher(self.hashMB, self.tablebases)
+        result = self.searcher.search(self.gs, ChessSearch.SearchLimits(**options))
+        if result.bestMove is None:
+            self.write("bestmove none")
+        else:
+            self.write("bestmove %s %s %s" % (self.gs.getSAN(result.bestMove), result.bestMove.getLongNotation(),
+                                              result.getInfoString()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless chess engine commands")
+    parser.add_argument("-c", "--command", action="append", help="command to run instead of reading stdin, can be repeated")
+    parser.add_argument("--fen", help="start from this position")
+    parser.add_argument("--bitboard", action="store_true", help="use the ChessBitboard backend")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB (default 16)")
+    parser.add_argument("--book", help="Polyglot opening book (.bin) for the book command")
+    parser.add_argument("--tablebases", help="directory of ChessTablebase files for search and the tablebase command")
+    args = parser.parse_args(argv)
+
+    stateClass = ChessEngine.GameState
+    if args.bitboard:
+        import ChessBitboard
+        stateClass = ChessBitboard.BitboardGameState
+    book = None
+    if args.book:
+        import ChessBook
+        try:
+            book = ChessBook.PolyglotBook(args.book)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    tablebases = None
+    if args.tablebases:
+        import ChessTablebase
+        tablebases = ChessTablebase.Tablebases(args.tablebases)
+    cli = CommandLine(stateClass, args.hash, book=book, tablebases=tablebases)
+    if args.fen:
+        try:
+            cli.gs = stateClass.fromFEN(args.fen)
+        except ValueError as e:
+            parser.error(str(e))
+    for line in args.command if args.command else sys.stdin:
+        if not cli.execute(line):
+            break
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
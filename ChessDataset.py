@@ -0,0 +1,343 @@
+#Positions as NumPy arrays, for building datasets and tuning the evaluation over millions of positions at a time.
+#A position is 12 planes of 64 squares, one plane per piece in PIECES order with square = row * 8 + col as in
+#GameState.board, so a batch is an N x 12 x 64 int8 array (packPlanes() stores it as bits, N x 12 x 8 uint8).
+#Boards are turned into one character per square and decoded with a single table lookup for the whole batch,
+#evaluate() scores a batch exactly like GameState.evaluate(), and tune() fits the middlegame / endgame
+#piece-square tables to game results (Texel tuning) with minibatch gradient steps.
+#  python ChessDataset.py encode quiet-labeled.epd --out quiet.npz
+#  python ChessDataset.py tune quiet.npz --epochs 20 --out weights.json
+import argparse
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+import ChessEngine
+import ChessEPD
+import ChessPGN
+from ChessEvaluation import MG_SQUARE_SCORES, EG_SQUARE_SCORES, PHASE_WEIGHTS, MAX_PHASE
+
+PIECES = ('wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK') #plane order, as in ChessBitboard
+KINDS = "PNBRQK"
+EMPTY = len(PIECES) #square code of an empty square
+CHUNK = 1 << 14 #positions converted at once, bounds the temporary arrays of evaluate() and tune()
+RESULT_SCORES = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5} #from white's side; unknown results are NaN
+
+#One character per square, FEN letters and "." for empty; a byte lookup turns a batch of them into square codes
+_CHAR_OF_PIECE = {piece: piece[1] if piece[0] == 'w' else piece[1].lower() for piece in PIECES}
+_CHAR_OF_PIECE["--"] = "."
+_CODE_OF_BYTE = np.full(256, -1, dtype=np.int8)
+_CODE_OF_BYTE[ord(".")] = EMPTY
+for _code, _piece in enumerate(PIECES):
+    _CODE_OF_BYTE[ord(_CHAR_OF_PIECE[_piece])] = _code
+#FEN placements are expanded for a whole batch at once: every byte is repeated by the squares it stands for
+#(a digit n empty squares, "/" none) and the digits decode as empty squares
+_FEN_WIDTH = np.ones(256, dtype=np.int64)
+_FEN_WIDTH[ord("/")] = 0
+_FEN_CODE_OF_BYTE = _CODE_OF_BYTE.copy()
+for _n in range(1, 9):
+    _FEN_WIDTH[ord(str(_n))] = _n
+    _FEN_CODE_OF_BYTE[ord(str(_n))] = EMPTY
+PHASE_OF_PLANE = np.array([PHASE_WEIGHTS[piece[1]] for piece in PIECES], dtype=np.int64)
+
+def boardText(board):
+    return "".join([_CHAR_OF_PIECE[piece] for row in board for piece in row])
+
+def _checkCodes(codes):
+    if (codes < 0).any():
+        raise ValueError("unknown piece letter in position %d" % int(np.argmax((codes < 0).any(axis=1))))
+    return codes
+
+def codesFromTexts(texts):
+    #N x 64 int8 square codes (plane index, EMPTY for an empty square) from 64 character square texts
+    texts = list(texts)
+    data = "".join(texts).encode("ascii", "replace")
+    if len(data) != 64 * len(texts) or any(len(text) != 64 for text in texts):
+        raise ValueError("square texts must be 64 characters each")
+    return _checkCodes(_CODE_OF_BYTE[np.frombuffer(data, dtype=np.uint8)].reshape(len(texts), 64))
+
+def codesFromStates(states):
+    return codesFromTexts(boardText(gs.board) for gs in states)
+
+def codesFromFENs(fens):
+    #Square codes of FEN (or EPD) strings; only the placement field is read
+    placements = [fen.partition(" ")[0] for fen in fens]
+    if not placements:
+        return np.empty((0, 64), dtype=np.int8)
+    lengths = np.fromiter(map(len, placements), dtype=np.int64, count=len(placements))
+    chars = np.frombuffer("".join(placements).encode("ascii", "replace"), dtype=np.uint8)
+    widths = _FEN_WIDTH[chars]
+    starts = np.cumsum(lengths) - lengths
+    squares = np.add.reduceat(widths, np.minimum(starts, len(chars) - 1)) if len(chars) else np.zeros(len(lengths))
+    bad = (squares != 64) | (lengths == 0)
+    if bad.any():
+        raise ValueError("FEN placement is not 64 squares: %r" % fens[int(np.argmax(bad))])
+    return _checkCodes(_FEN_CODE_OF_BYTE[np.repeat(chars, widths)].reshape(len(placements), 64))
+
+def planesFromCodes(codes):
+    return (codes[:, None, :] == np.arange(len(PIECES), dtype=np.int8)[None, :, None]).astype(np.int8)
+
+def codesFromPlanes(planes):
+    return np.where(planes.any(axis=1), planes.argmax(axis=1), EMPTY).astype(np.int8)
+
+def encodeStates(states):
+    #N x 12 x 64 int8 planes of GameStates (or anything with a .board)
+    return planesFromCodes(codesFromStates(states))
+
+def encodeFENs(fens):
+    #N x 12 x 64 int8 planes of FEN (or EPD) strings
+    return planesFromCodes(codesFromFENs(fens))
+
+def packPlanes(planes):
+    #N x 12 x 8 uint8, one bit per square, 8x smaller for files and memory
+    return np.packbits(planes, axis=2)
+
+def unpackPlanes(packed):
+    return np.unpackbits(packed, axis=2).view(np.int8)
+
+def defaultWeights():
+    #(mg, eg): 6 x 64 material + piece-square scores of the white pieces from ChessEvaluation, KINDS order
+    mg = np.array([MG_SQUARE_SCORES['w' + kind] for kind in KINDS], dtype=np.float64)
+    eg = np.array([EG_SQUARE_SCORES['w' + kind] for kind in KINDS], dtype=np.float64)
+    return mg, eg
+
+def features(planes):
+    #N x 384 int8: white pieces minus black pieces on the mirrored square, per kind and square. The evaluation
+    #is linear in these, middlegame score = features @ mg.ravel()
+    blackMirrored = planes[:, 6:, :].reshape(len(planes), 6, 8, 8)[:, :, ::-1, :].reshape(len(planes), 6, 64)
+    return (planes[:, :6, :] - blackMirrored).reshape(len(planes), 6 * 64)
+
+def phases(planes):
+    #Game phase of every position, capped at MAX_PHASE like taperedScore()
+    return np.minimum(planes.sum(axis=2, dtype=np.int64) @ PHASE_OF_PLANE, MAX_PHASE)
+
+def _chunks(count):
+    for start in range(0, count, CHUNK):
+        yield slice(start, min(start + CHUNK, count))
+
+def evaluate(planes, weights=None):
+    #Tapered score in centipawns from white's side for every position, the same integers GameState.evaluate()
+    #gives with the default weights. weights: (mg, eg) 6 x 64 arrays as from defaultWeights() or tune()
+    mg, eg = weights if weights is not None else defaultWeights()
+    scores = np.empty(len(planes), dtype=np.int64)
+    for part in _chunks(len(planes)):
+        chunk = planes[part]
+        featureRows = features(chunk).astype(np.float64)
+        phase = phases(chunk)
+        mgScores = np.rint(featureRows @ mg.ravel()).astype(np.int64)
+        egScores = np.rint(featureRows @ eg.ravel()).astype(np.int64)
+        scores[part] = (mgScores * phase + egScores * (MAX_PHASE - phase)) // MAX_PHASE
+    return scores
+
+def _prepare(planes):
+    #Features and middlegame fraction of every position, all the tuner needs from the planes
+    featureRows = np.empty((len(planes), 6 * 64), dtype=np.int8)
+    blend = np.empty(len(planes), dtype=np.float32)
+    for part in _chunks(len(planes)):
+        featureRows[part] = features(planes[part])
+        blend[part] = phases(planes[part]) / MAX_PHASE
+    return featureRows, blend
+
+def _predict(featureRows, blend, mg, eg, scale):
+    #Expected score for white, 1 / (1 + 10^(-scale * eval / 400)), and the float eval it came from
+    rows = featureRows.astype(np.float32)
+    evals = (rows @ mg) * blend + (rows @ eg) * (1 - blend)
+    return 1 / (1 + np.power(10, -scale * evals / 400)), rows
+
+def _loss(featureRows, blend, results, mg, eg, scale):
+    total = 0.0
+    for part in _chunks(len(results)):
+        expected, _ = _predict(featureRows[part], blend[part], mg, eg, scale)
+        total += float(((results[part] - expected) ** 2).sum())
+    return total / max(len(results), 1)
+
+def meanSquaredError(planes, results, weights=None, scale=1.0):
+    #Texel loss: mean of (result - expected score)^2, results 1 / 0.5 / 0 from white's side
+    mg, eg = weights if weights is not None else defaultWeights()
+    featureRows, blend = _prepare(planes)
+    return _loss(featureRows, blend, np.asarray(results, dtype=np.float32), mg.ravel().astype(np.float32),
+                 eg.ravel().astype(np.float32), scale)
+
+def _fitScale(featureRows, blend, results, mg, eg, low=0.1, high=4.0, steps=30):
+    #Golden section search for the sigmoid scale that best fits the current weights
+    ratio = (math.sqrt(5) - 1) / 2
+    a, b = low, high
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    lossC, lossD = _loss(featureRows, blend, results, mg, eg, c), _loss(featureRows, blend, results, mg, eg, d)
+    for _ in range(steps):
+        if lossC < lossD:
+            b, d, lossD = d, c, lossC
+            c = b - ratio * (b - a)
+            lossC = _loss(featureRows, blend, results, mg, eg, c)
+        else:
+            a, c, lossC = c, d, lossD
+            d = a + ratio * (b - a)
+            lossD = _loss(featureRows, blend, results, mg, eg, d)
+    return (a + b) / 2
+
+def fitScale(planes, results, weights=None):
+    mg, eg = weights if weights is not None else defaultWeights()
+    featureRows, blend = _prepare(planes)
+    return _fitScale(featureRows, blend, np.asarray(results, dtype=np.float32), mg.ravel().astype(np.float32),
+                     eg.ravel().astype(np.float32))
+
+def tune(planes, results, weights=None, scale=None, epochs=10, batchSize=16384, learningRate=1.0, seed=0, log=None):
+    #Texel tuning: fit the middlegame and endgame tables to game results by minibatch gradient descent (Adam)
+    #on the mean squared error between result and expected score. The sigmoid scale is fitted to the starting
+    #weights first unless given, then held fixed. Positions with an unknown (NaN) result are left out.
+    #Returns ((mg, eg), scale); log(epoch, loss) is called after every epoch (epoch 0 = before tuning)
+    results = np.asarray(results, dtype=np.float32)
+    known = ~np.isnan(results)
+    if not known.all():
+        planes, results = planes[known], results[known]
+    if len(results) == 0:
+        raise ValueError("no positions with a known result")
+    mg, eg = weights if weights is not None else defaultWeights()
+    params = np.concatenate([mg.ravel(), eg.ravel()]).astype(np.float32)
+    featureRows, blend = _prepare(planes)
+    if scale is None:
+        scale = _fitScale(featureRows, blend, results, params[:384], params[384:])
+    if log is not None:
+        log(0, _loss(featureRows, blend, results, params[:384], params[384:], scale))
+    #Adam moments; the step is learningRate centipawns at most per parameter, whatever the gradient's size
+    first = np.zeros_like(params)
+    second = np.zeros_like(params)
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    slope = scale * math.log(10) / 400
+    rng = np.random.default_rng(seed)
+    step = 0
+    for epoch in range(1, epochs + 1):
+        order = rng.permutation(len(results))
+        for start in range(0, len(order), batchSize):
+            batch = order[start:start + batchSize]
+            batchBlend = blend[batch]
+            expected, rows = _predict(featureRows[batch], batchBlend, params[:384], params[384:], scale)
+            #d loss / d eval for each position, then through the linear eval to the table entries
+            perEval = 2 * (expected - results[batch]) * expected * (1 - expected) * slope / len(batch)
+            gradient = np.concatenate([rows.T @ (perEval * batchBlend), rows.T @ (perEval * (1 - batchBlend))])
+            step += 1
+            first = beta1 * first + (1 - beta1) * gradient
+            second = beta2 * second + (1 - beta2) * gradient * gradient
+            params -= learningRate * (first / (1 - beta1 ** step)) / (np.sqrt(second / (1 - beta2 ** step)) + epsilon)
+        if log is not None:
+            log(epoch, _loss(featureRows, blend, results, params[:384], params[384:], scale))
+    params = params.astype(np.float64)
+    return (params[:384].reshape(6, 64), params[384:].reshape(6, 64)), scale
+
+def weightsToDict(weights, scale=None):
+    #{"mg": {"P": 8 x 8 ...}, "eg": {...}} in centipawns, material included, white's side with row 0 = rank 8
+    mg, eg = weights
+    tables = {}
+    for name, values in (("mg", mg), ("eg", eg)):
+        tables[name] = {kind: np.rint(values[i]).astype(int).reshape(8, 8).tolist() for i, kind in enumerate(KINDS)}
+    if scale is not None:
+        tables["scale"] = scale
+    return tables
+
+def weightsFromDict(data):
+    return tuple(np.array([data[name][kind] for kind in KINDS], dtype=np.float64).reshape(6, 64)
+                 for name in ("mg", "eg"))
+
+def loadEPD(source):
+    #(codes, whiteToMove, results) of an EPD file; the result comes from a c9 operation ("1-0", "0-1", "1/2-1/2")
+    #as in the usual quiet-labeled Texel sets, NaN without one
+    fens, whiteToMove, results = [], [], []
+    for fen, operations in ChessEPD.readEPD(source):
+        fens.append(fen)
+        whiteToMove.append(fen.split()[1] == 'w')
+        result = operations.get("c9") or operations.get("result")
+        results.append(RESULT_SCORES.get(result[0], math.nan) if result else math.nan)
+    return codesFromFENs(fens), np.array(whiteToMove, dtype=bool), np.array(results, dtype=np.float32)
+
+def loadPGN(source, skipPlies=8):
+    #(codes, whiteToMove, results) of every position after the first skipPlies plies of each decided or drawn
+    #game, labelled with the game's result. Games with an illegal move are skipped from that move on
+    texts, whiteToMove, results = [], [], []
+    for game in ChessPGN.readGames(source):
+        result = RESULT_SCORES.get(game.result)
+        if result is None:
+            continue
+        gs = ChessEngine.GameState.fromFEN(game.tags["FEN"]) if "FEN" in game.tags else ChessEngine.GameState()
+        for ply, san in enumerate(game.moves):
+            try:
+                gs.makeMove(gs.parseSAN(san), checkForGameEnd=False)
+            except ValueError:
+                break
+            if ply + 1 >= skipPlies:
+                texts.append(boardText(gs.board))
+                whiteToMove.append(gs.whiteToMove)
+                results.append(result)
+    return codesFromTexts(texts), np.array(whiteToMove, dtype=bool), np.array(results, dtype=np.float32)
+
+def loadPositions(path, skipPlies=8):
+    #(planes, whiteToMove, results) of a .npz written by saveDataset, an EPD file or a PGN file (.gz allowed)
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return unpackPlanes(data["planes"]), data["whiteToMove"], data["results"]
+    if path.endswith((".pgn", ".pgn.gz")):
+        codes, whiteToMove, results = loadPGN(path, skipPlies)
+    else:
+        codes, whiteToMove, results = loadEPD(path)
+    return planesFromCodes(codes), whiteToMove, results
+
+def saveDataset(path, planes, whiteToMove, results):
+    np.savez_compressed(path, planes=packPlanes(planes), whiteToMove=whiteToMove, results=results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encode positions as NumPy planes, evaluate them in bulk and tune the evaluation")
+    parser.add_argument("command", choices=("encode", "eval", "tune"))
+    parser.add_argument("source", help="EPD or PGN file (.gz allowed), or a .npz written by encode")
+    parser.add_argument("--out", help="encode: .npz to write; tune: JSON file for the tuned tables")
+    parser.add_argument("--skip-plies", type=int, default=8, help="PGN: opening plies left out of every game (default 8)")
+    parser.add_argument("--weights", help="JSON tables from an earlier tune to start from / evaluate with")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=16384, help="positions per gradient step (default 16384)")
+    parser.add_argument("--lr", type=float, default=1.0, help="largest change per step in centipawns (default 1)")
+    parser.add_argument("--scale", type=float, help="sigmoid scale (default: fitted to the starting weights)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.command == "encode" and not args.out:
+        parser.error("encode needs --out")
+    weights = None
+    if args.weights:
+        with open(args.weights) as f:
+            weights = weightsFromDict(json.load(f))
+
+    start = time.perf_counter()
+    try:
+        planes, whiteToMove, results = loadPositions(args.source, args.skip_plies)
+    except (OSError, ValueError) as e:
+        sys.stderr.write("%s: %s\n" % (args.source, e))
+        return 1
+    sys.stderr.write("%d positions in %.1fs\n" % (len(planes), time.perf_counter() - start))
+
+    if args.command == "encode":
+        saveDataset(args.out, planes, whiteToMove, results)
+    elif args.command == "eval":
+        start = time.perf_counter()
+        scores = evaluate(planes, weights)
+        seconds = time.perf_counter() - start
+        sys.stdout.write("".join("%d\n" % score for score in scores.tolist()))
+        sys.stderr.write("evaluated in %.3fs (%.0f positions/s)\n" % (seconds, len(planes) / seconds if seconds > 0 else 0.0))
+    else:
+        def report(epoch, loss):
+            sys.stderr.write("epoch %d: loss %.6f\n" % (epoch, loss))
+        try:
+            weights, scale = tune(planes, results, weights, args.scale, args.epochs, args.batch, args.lr, args.seed,
+                                  log=report)
+        except ValueError as e:
+            sys.stderr.write("%s\n" % e)
+            return 1
+        sys.stderr.write("scale %.4f\n" % scale)
+        text = json.dumps(weightsToDict(weights, scale))
+        if args.out:
+            with open(args.out, "w") as f:
+                f.write(text + "\n")
+        else:
+            sys.stdout.write(text + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#EPD reader: one position per line, the first four FEN fields followed by operations such as
+#  r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - bm Bb5; id "Ruy Lopez";
+#Lines are read lazily, so files with millions of positions stream in constant memory. Files ending in .gz are decompressed on the fly
+import gzip
+
+import ChessEngine
+
+def openSource(source):
+    #A path (plain or .gz) is opened here, anything else is taken to be an iterable of lines (an open file, a list ...)
+    if isinstance(source, str):
+        if source.endswith(".gz"):
+            return gzip.open(source, "rt", encoding="utf-8")
+        return open(source, "r", encoding="utf-8")
+    return None
+
+def splitOperations(text):
+    #'bm Nf3; id "a; b";' -> [['bm', 'Nf3'], ['id', 'a; b']]. Semicolons inside quotes don't end an operation
+    operations = []
+    tokens = []
+    token = ""
+    inQuotes = False
+    hasToken = False
+    for ch in text:
+        if inQuotes:
+            if ch == '"':
+                inQuotes = False
+            else:
+                token += ch
+        elif ch == '"':
+            inQuotes = True
+            hasToken = True
+        elif ch == ';' or ch.isspace():
+            if hasToken:
+                tokens.append(token)
+                token = ""
+                hasToken = False
+            if ch == ';' and tokens:
+                operations.append(tokens)
+                tokens = []
+        else:
+            token += ch
+            hasToken = True
+    if hasToken:
+        tokens.append(token)
+    if tokens:
+        operations.append(tokens)
+    return operations
+
+def parseEPDLine(line):
+    #-> (FEN with move counters, {opcode: [operands]}). hmvc / fmvn operations, or two bare numbers after the
+    #position as some perft suites write them, become the FEN counters
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD line needs at least 4 fields: %r" % line)
+    rest = fields[4] if len(fields) > 4 else ""
+    counters = ["0", "1"]
+    restFields = rest.split(None, 2)
+    if len(restFields) >= 2 and restFields[0].isdigit() and restFields[1].isdigit():
+        counters = restFields[:2]
+        rest = restFields[2] if len(restFields) > 2 else ""
+    operations = {}
+    for operation in splitOperations(rest):
+        operations[operation[0]] = operation[1:]
+    if operations.get("hmvc"):
+        counters[0] = operations["hmvc"][0]
+    if operations.get("fmvn"):
+        counters[1] = operations["fmvn"][0]
+    return " ".join(fields[:4] + counters), operations
+
+def readEPD(source):
+    #Generator of (FEN, operations) for each position line; blank lines and # comments are skipped
+    handle = openSource(source)
+    lines = handle if handle is not None else source
+    try:
+        for lineNumber, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                yield parseEPDLine(line)
+            except ValueError as e:
+                raise ValueError("line %d: %s" % (lineNumber, e))
+    finally:
+        if handle is not None:
+            handle.close()
+
+def readPositions(source, stateClass=ChessEngine.GameState):
+    #Generator of (GameState, operations), built one line at a time
+    for fen, operations in readEPD(source):
+        yield stateClass.fromFEN(fen), operations
@@ -1,3 +1,63 @@
+import random
+import re
+import struct
+import sys
+from array import array
+
+from ChessTables import DIRECTIONS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS, QUEEN_DIRECTIONS, \
+    KNIGHT_TARGETS, KING_TARGETS, PAWN_CAPTURES, RAYS, KNIGHT_MASKS, KING_MASKS, PAWN_CAPTURE_MASKS, RAY_MASKS, POSITIVE_DIRECTIONS
+from ChessEvaluation import MG_SQUARE_SCORES, EG_SQUARE_SCORES, PHASE_WEIGHTS, taperedScore
+
+# Zobrist keys: one random 64-bit number per (piece, square), side to move, castling rights combination and
+# en passant file. A position's key is the XOR of the numbers for everything in it, so a move updates it with a few XORs.
+# Fixed seed so keys are the same in every process
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = {color + piece: [_zobristRandom.getrandbits(64) for _ in range(64)]
+                  for color in 'wb' for piece in 'PNBRQK'}
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for _ in range(16)]  # indexed by castleRightsIndex()
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for _ in range(8)]  # indexed by file
+
+# Moves pack into 15 bits: start square | end square << 6 | promotion piece << 12 | promotion flag << 14,
+# squares as row * 8 + col. 0 never is a move, so it can stand for "no move" (e.g. in the transposition table)
+PROMOTION_CODES = {'Q': 0, 'R': 1, 'B': 2, 'N': 3}
+PROMOTION_PIECES = 'QRBN'
+PROMOTION_FLAG = 1 << 14
+
+def encodeMove(startSq, endSq, promotionChoice=None):
+    code = startSq | endSq << 6
+    if promotionChoice is not None:
+        code |= PROMOTION_CODES[promotionChoice] << 12 | PROMOTION_FLAG
+    return code
+
+def decodeMove(code):
+    # -> (start square, end square, promotion piece letter or None)
+    promotionChoice = PROMOTION_PIECES[(code >> 12) & 3] if code & PROMOTION_FLAG else None
+    return code & 63, (code >> 6) & 63, promotionChoice
+
+# Piece codes of one colour, so attack tests compare whole strings: pawn, knight, bishop, rook, queen, king
+COLOR_PIECES = {color: tuple(color + kind for kind in 'PNBRQK') for color in 'wb'}
+
+# Piece, origin file / rank hints, destination and promotion of a SAN move (castling is handled separately)
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$")
+# Start and end square plus promotion piece, as Move.getLongNotation writes it (and UCI uses)
+LONG_NOTATION_PATTERN = re.compile(r"^[a-h][1-8][a-h][1-8][qrbn]?$")
+
+# Binary snapshots (toBytes / fromBytes): a fixed 54 byte record - magic, the board as 4-bit piece codes, a flags
+# byte (side to move, castling rights), en passant square (255 for none), halfmove clock, move number, number of
+# moves and the Zobrist key the game ends on - followed by one little-endian 16-bit Move.code per move.
+# The record holds the position before those moves, so the undo history comes back with them
+SNAPSHOT_MAGIC = b"CGS\x01"
+SNAPSHOT_HEADER = struct.Struct("<4s32sBBHHIQ")
+PIECE_NIBBLES = {"--": 0, "wP": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6,
+                 "bP": 9, "bN": 10, "bB": 11, "bR": 12, "bQ": 13, "bK": 14}
+NIBBLE_PIECES = [{nibble: piece for piece, nibble in PIECE_NIBBLES.items()}.get(i) for i in range(16)]
+NO_SQUARE = 255
+
+def castleRightsIndex(rights):
+    # (wK, wQ, bK, bQ) tuple as in castleRightsLog -> 0..15
+    return rights[0] | rights[1] << 1 | rights[2] << 2 | rights[3] << 3
+
 #Store Game Information and current State. Decide if moves are legal. Keep a log of moves.
 class GameState():
     def __init__(self):
@@ -26,14 +86,37 @@ class GameState():
         self.castleRightsLog = [(True, True, True, True)]  # Log to track castling rights history
         # En passant possibility
         self.enpassantPossible = () # coordinates for the square where en passant capture is possible
+        self.enpassantPossibleLog = [()]  # Log to restore the en passant square on undo
+        # Half moves since the last capture or pawn move (fifty-move rule) and the FEN move number
+        self.halfmoveClock = 0
+        self.halfmoveClockLog = [0]
+        self.fullmoveNumber = 1
         # Pawn promotion
         self.pawnPromotion = False
-        self.promotionChoice = 'Q' # Default promotion to queen
+        self.promotionChoice = 'Q' # Default promotion to queen (the piece actually chosen is stored on the Move)
         # Game state tracking
         self.checkmate = False
         self.stalemate = False
+        # Pinned pieces while generating legal moves, (row, col) -> pin direction
+        self.pins = {}
+        # Legal moves and (checkmate, stalemate) of the current position, generated once per position.
+        # makeMove saves them in the log and undoMove brings them back, so going back to a position costs nothing
+        self.validMovesCache = None
+        self.gameEndStatus = (False, False)
+        self.validMovesCacheLog = []
+        # Squares each color attacks in the current position, color -> bitmask, filled in by attackMap() when asked
+        self.attackMaps = {}
+        # Zobrist key of the current position and how often each key has occurred in this game
+        self.resetZobrist()
+        # Material + piece-square score from white's side (middlegame and endgame) and game phase, kept up to date by makeMove
+        self.resetEvaluation()
 
     def makeMove(self, move, checkForGameEnd=True):
+        self.validMovesCacheLog.append((self.validMovesCache, self.gameEndStatus))
+        self.validMovesCache = None
+        self.attackMaps = {}
+        oldCastleRights = self.castleRightsLog[-1]
+        oldEnpassantFile = self.getEnpassantHashFile()
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move) #log the move
@@ -46,7 +129,7 @@ class GameState():
             
         # Handle pawn promotion
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + self.promotionChoice
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionChoice
             self.pawnPromotion = False
             
         # Handle en passant captures
@@ -58,6 +141,16 @@ class GameState():
             self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
         else:
             self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        
+        # Fifty-move counter restarts on captures and pawn moves, the move number goes up after black's move
+        if move.pieceMoved[1] == "P" or move.pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if not self.whiteToMove:
+            self.fullmoveNumber += 1
             
         # Handle castling move
         if move.isCastleMove:
@@ -76,16 +169,20 @@ class GameState():
         self.updateCastleRights(move)
         
         self.whiteToMove = not self.whiteToMove #swap turns
+        self.updateZobristKey(move, oldCastleRights, oldEnpassantFile)
+        self.updateEvaluation(move)
         
         # Check for checkmate or stalemate only when actually making a real move
         # not when validating potential moves
+        # (one legal move generation sets both flags, and the list is kept for the next getValidMoves)
         if checkForGameEnd:
-            self.checkmate = self.isCheckmate()
-            self.stalemate = self.isStalemate()
+            self.getValidMoves()
         
     def undoMove(self):
         if len(self.moveLog) != 0: #check that a move has been made
             move = self.moveLog.pop() # function to remove one from the list
+            self.validMovesCache, self.gameEndStatus = self.validMovesCacheLog.pop()
+            self.attackMaps = {}
             self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             
@@ -99,11 +196,14 @@ class GameState():
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = "--"  # Empty the end square
                 self.board[move.startRow][move.endCol] = move.pieceCaptured  # Put captured pawn back
-                self.enpassantPossible = (move.endRow, move.endCol)
                 
-            # Undo a 2 square pawn advance
-            if move.pieceMoved[1] == "P" and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
+            # Restore the en passant square from before the move
+            self.enpassantPossibleLog.pop()
+            self.enpassantPossible = self.enpassantPossibleLog[-1]
+            self.halfmoveClockLog.pop()
+            self.halfmoveClock = self.halfmoveClockLog[-1]
+            if self.whiteToMove:  # Taking back black's move (the side is switched back below)
+                self.fullmoveNumber -= 1
                 
             # Undo castling rights
             if move.isCastleMove:
@@ -130,13 +230,446 @@ class GameState():
             self.checkmate = False
             self.stalemate = False
             
+            # Forget this occurrence of the position and go back to the previous key
+            count = self.repetitionCounts[self.zobristKey] - 1
+            if count:
+                self.repetitionCounts[self.zobristKey] = count
+            else:
+                del self.repetitionCounts[self.zobristKey]
+            self.zobristKeyLog.pop()
+            self.zobristKey = self.zobristKeyLog[-1]
+            
+            # Go back to the score before the move
+            self.evaluationLog.pop()
+            self.mgScore, self.egScore, self.phase = self.evaluationLog[-1]
+            
             self.whiteToMove = not self.whiteToMove #Other players turn
+
+    def setPosition(self, board, whiteToMove, castleRights, enpassantPossible=(), halfmoveClock=0, fullmoveNumber=1):
+        # Start from an arbitrary position (FEN, a worker process ...) with an empty move history.
+        # board is 8 rows of 8 piece codes, castleRights a (wK, wQ, bK, bQ) tuple as in castleRightsLog
+        self.board = [list(row) for row in board]
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == "wK":
+                    self.whiteKingLocation = (r, c)
+                elif self.board[r][c] == "bK":
+                    self.blackKingLocation = (r, c)
+        self.whiteToMove = whiteToMove
+        self.moveLog = []
+        castleRights = tuple(castleRights)
+        self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, self.blackCastleQueenside = castleRights
+        self.castleRightsLog = [castleRights]
+        self.enpassantPossible = enpassantPossible
+        self.enpassantPossibleLog = [enpassantPossible]
+        self.halfmoveClock = halfmoveClock
+        self.halfmoveClockLog = [halfmoveClock]
+        self.fullmoveNumber = fullmoveNumber
+        self.pawnPromotion = False
+        self.checkmate = False
+        self.stalemate = False
+        self.validMovesCache = None
+        self.validMovesCacheLog = []
+        self.attackMaps = {}
+        self.resetZobrist()
+        self.resetEvaluation()
+
+    @classmethod
+    def fromFEN(cls, fen):
+        # GameState (or subclass) for a FEN string. The counters are optional, as in EPD
+        fields = fen.split()
+        if len(fields) < 4 or len(fields) > 6:
+            raise ValueError("FEN needs 4 to 6 fields: %r" % fen)
+        rankTexts = fields[0].split('/')
+        if len(rankTexts) != 8:
+            raise ValueError("FEN placement needs 8 ranks: %r" % fen)
+        board = []
+        for rankText in rankTexts:
+            row = []
+            for ch in rankText:
+                if ch in "12345678":
+                    row.extend(["--"] * int(ch))
+                elif ch in "PNBRQKpnbrqk":
+                    row.append(('w' if ch.isupper() else 'b') + ch.upper())
+                else:
+                    raise ValueError("bad piece %r in FEN: %r" % (ch, fen))
+            if len(row) != 8:
+                raise ValueError("FEN rank %r is not 8 squares: %r" % (rankText, fen))
+            board.append(row)
+        pieces = [piece for row in board for piece in row]
+        if pieces.count("wK") != 1 or pieces.count("bK") != 1:
+            raise ValueError("FEN needs one king of each colour: %r" % fen)
+        if any(piece[1] == 'P' for piece in board[0] + board[7]):
+            raise ValueError("FEN has a pawn on the first or eighth rank: %r" % fen)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("FEN side to move must be w or b: %r" % fen)
+        castling = fields[2]
+        if castling != '-' and (not castling or any(ch not in "KQkq" for ch in castling)):
+            raise ValueError("bad FEN castling field: %r" % fen)
+        castleRights = ('K' in castling, 'Q' in castling, 'k' in castling, 'q' in castling)
+        # A right needs its king and rook on their home squares, the move generators take that for granted
+        for right, (row, rookCol, color) in zip(castleRights, ((7, 7, 'w'), (7, 0, 'w'), (0, 7, 'b'), (0, 0, 'b'))):
+            if right and (board[row][4] != color + 'K' or board[row][rookCol] != color + 'R'):
+                raise ValueError("FEN castling rights without the king and rook on their squares: %r" % fen)
+        enpassantPossible = ()
+        if fields[3] != '-':
+            if len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols or fields[3][1] not in "36":
+                raise ValueError("bad FEN en passant square: %r" % fen)
+            enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("bad FEN move counters: %r" % fen)
+        gs = cls()
+        gs.setPosition(board, fields[1] == 'w', castleRights, enpassantPossible, halfmoveClock, fullmoveNumber)
+        return gs
+
+    def toFEN(self):
+        ranks = []
+        for row in self.board:
+            rankText = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rankText += str(empty)
+                    empty = 0
+                rankText += piece[1] if piece[0] == 'w' else piece[1].lower()
+            if empty:
+                rankText += str(empty)
+            ranks.append(rankText)
+        castling = ''.join(letter for letter, right in zip("KQkq", self.castleRightsLog[-1]) if right) or '-'
+        enpassant = '-'
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        return "%s %s %s %s %d %d" % ('/'.join(ranks), 'w' if self.whiteToMove else 'b', castling, enpassant,
+                                      self.halfmoveClock, self.fullmoveNumber)
+
+    def toBytes(self, withHistory=True):
+        # Binary snapshot, see SNAPSHOT_HEADER. Without history only the current position is stored
+        moves = list(self.moveLog) if withHistory else []
+        finalKey = self.zobristKey
+        current = (self.validMovesCache, self.gameEndStatus, self.checkmate, self.stalemate)
+        for _ in moves: #back to the start of the history, then forward again so the logs are as they were
+            self.undoMove()
+        board = [PIECE_NIBBLES[piece] for row in self.board for piece in row]
+        flags = (self.whiteToMove | self.castleRightsLog[-1][0] << 1 | self.castleRightsLog[-1][1] << 2 |
+                 self.castleRightsLog[-1][2] << 3 | self.castleRightsLog[-1][3] << 4)
+        enpassant = self.enpassantPossible[0] * 8 + self.enpassantPossible[1] if self.enpassantPossible else NO_SQUARE
+        record = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, bytes(board[i] | board[i + 1] << 4 for i in range(0, 64, 2)),
+                                      flags, enpassant, self.halfmoveClock, self.fullmoveNumber, len(moves), finalKey)
+        for move in moves:
+            self.makeMove(move, checkForGameEnd=False)
+        self.validMovesCache, self.gameEndStatus, self.checkmate, self.stalemate = current
+        codes = array('H', [move.code for move in moves])
+        if sys.byteorder != "little":
+            codes.byteswap()
+        return record + codes.tobytes()
+
+    @classmethod
+    def fromBytes(cls, data):
+        # GameState (or subclass) from toBytes() output in any bytes-like object. The header and move codes are read
+        # straight out of the buffer; the moves are replayed so undoMove works as it did before
+        view = memoryview(data).cast('B')
+        if len(view) < SNAPSHOT_HEADER.size:
+            raise ValueError("snapshot is %d bytes, the header alone is %d" % (len(view), SNAPSHOT_HEADER.size))
+        magic, board, flags, enpassant, halfmoveClock, fullmoveNumber, moveCount, finalKey = \
+            SNAPSHOT_HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("not a GameState snapshot")
+        end = SNAPSHOT_HEADER.size + 2 * moveCount
+        if len(view) != end:
+            raise ValueError("snapshot of %d moves should be %d bytes, not %d" % (moveCount, end, len(view)))
+        pieces = [NIBBLE_PIECES[byte >> shift & 15] for byte in board for shift in (0, 4)]
+        if None in pieces or pieces.count("wK") != 1 or pieces.count("bK") != 1:
+            raise ValueError("bad board in snapshot")
+        gs = cls()
+        gs.setPosition([pieces[r * 8:r * 8 + 8] for r in range(8)], bool(flags & 1),
+                       (bool(flags & 2), bool(flags & 4), bool(flags & 8), bool(flags & 16)),
+                       divmod(enpassant, 8) if enpassant != NO_SQUARE else (), halfmoveClock, fullmoveNumber)
+        codes = view[SNAPSHOT_HEADER.size:end]
+        if sys.byteorder == "little":
+            codes = codes.cast('H')
+        else:
+            codes = array('H', codes)
+            codes.byteswap()
+        for code in codes:
+            gs.makeMove(gs.moveFromCode(code), checkForGameEnd=False)
+        if gs.zobristKey != finalKey:
+            raise ValueError("snapshot moves don't lead to the recorded position")
+        return gs
+
+    def moveFromCode(self, code):
+        # Move for a Move.code in the current position. Legality is not checked, this is for replaying moves that were legal
+        startSq, endSq, promotionChoice = decodeMove(code)
+        startRow, startCol = divmod(startSq, 8)
+        endRow, endCol = divmod(endSq, 8)
+        pieceMoved = self.board[startRow][startCol]
+        if pieceMoved == "--":
+            raise ValueError("no piece to move for move code %d" % code)
+        pieceCaptured = self.board[endRow][endCol]
+        move = Move.build(startRow, startCol, endRow, endCol, pieceMoved, pieceCaptured,
+                          promotionChoice is not None, promotionChoice or 'Q')
+        if pieceMoved[1] == 'K' and abs(endCol - startCol) == 2:
+            move.isCastleMove = True
+        elif pieceMoved[1] == 'P' and startCol != endCol and pieceCaptured == "--":
+            move.isEnpassantMove = True
+            move.pieceCaptured = 'wP' if pieceMoved[0] == 'b' else 'bP'
+        return move
+
+    def isLegalMove(self, move):
+        # Legality of one move (from moveFromCode, a book, a hash table ...) without generating every legal move:
+        # the piece has to be able to get there, and its own king must not be attacked afterwards
+        if self.validMovesCache is not None:
+            return move in self.validMovesCache
+        board = self.board
+        allyColor = 'w' if self.whiteToMove else 'b'
+        r, c, endRow, endCol = move.startRow, move.startCol, move.endRow, move.endCol
+        piece = move.pieceMoved
+        if piece[0] != allyColor or board[r][c] != piece or board[endRow][endCol][0] == allyColor:
+            return False
+        kind = piece[1]
+        if move.isCastleMove:
+            castleMoves = []
+            if kind == 'K':
+                self.getCastleMoves(r, c, castleMoves, allyColor)
+            return move in castleMoves
+        if move.isEnpassantMove:
+            if kind != 'P' or (endRow, endCol) != self.enpassantPossible:
+                return False
+        elif move.pieceCaptured != board[endRow][endCol]:
+            return False
+        if kind == 'P':
+            forward = -1 if allyColor == 'w' else 1
+            if move.isPawnPromotion != (endRow == (0 if allyColor == 'w' else 7)):
+                return False
+            if endCol == c:
+                if board[endRow][endCol] != "--":
+                    return False
+                if endRow - r != forward and not (endRow - r == 2 * forward and r == (6 if allyColor == 'w' else 1)
+                                                   and board[r + forward][c] == "--"):
+                    return False
+            elif abs(endCol - c) != 1 or endRow - r != forward or (board[endRow][endCol] == "--" and not move.isEnpassantMove):
+                return False
+        elif move.isPawnPromotion:
+            return False
+        elif kind == 'N':
+            if (endRow, endCol) not in KNIGHT_TARGETS[r * 8 + c]:
+                return False
+        elif kind == 'K':
+            if (endRow, endCol) not in KING_TARGETS[r * 8 + c]:
+                return False
+        else:
+            directions = ROOK_DIRECTIONS if kind == 'R' else BISHOP_DIRECTIONS if kind == 'B' else QUEEN_DIRECTIONS
+            if not any(self.rayReaches(r, c, d, endRow, endCol) for d in directions):
+                return False
+        # Play it to see whether it leaves the king in check
+        self.makeMove(move, checkForGameEnd=False)
+        kingRow, kingCol = self.whiteKingLocation if allyColor == 'w' else self.blackKingLocation
+        legal = not self.squareAttackedBy(kingRow, kingCol, 'b' if allyColor == 'w' else 'w')
+        self.undoMove()
+        return legal
+
+    def rayReaches(self, r, c, d, endRow, endCol):
+        # Whether (endRow, endCol) is on the ray from (r, c) in direction d with nothing in between
+        for square in RAYS[r * 8 + c][d]:
+            if square == (endRow, endCol):
+                return True
+            if self.board[square[0]][square[1]] != "--":
+                return False
+        return False
+
+    def getSAN(self, move):
+        # Standard algebraic notation for a legal move in the current position: disambiguated when another piece
+        # of the same kind can reach the same square, with + or # for check and mate
+        if move.isCastleMove:
+            san = "O-O" if move.endCol - move.startCol == 2 else "O-O-O"
+        else:
+            destination = move.getRankFile(move.endRow, move.endCol)
+            capture = "x" if move.pieceCaptured != "--" else ""
+            if move.pieceMoved[1] == 'P':
+                san = (move.colsToFiles[move.startCol] + capture if capture else "") + destination
+                if move.isPawnPromotion:
+                    san += "=" + move.promotionChoice
+            else:
+                san = move.pieceMoved[1]
+                rivals = [other for other in self.getValidMoves() if other.pieceMoved == move.pieceMoved and
+                          other.endRow == move.endRow and other.endCol == move.endCol and
+                          (other.startRow != move.startRow or other.startCol != move.startCol)]
+                if rivals:
+                    if all(other.startCol != move.startCol for other in rivals):
+                        san += move.colsToFiles[move.startCol]
+                    elif all(other.startRow != move.startRow for other in rivals):
+                        san += move.rowsToRanks[move.startRow]
+                    else:
+                        san += move.getRankFile(move.startRow, move.startCol)
+                san += capture + destination
+        self.makeMove(move, checkForGameEnd=False)
+        if self.inCheck():
+            san += "#" if len(self.getValidMoves()) == 0 else "+"
+        self.undoMove()
+        return san
+
+    def parseSAN(self, san):
+        # The legal move written as san in the current position. Check marks and annotations (!, ?) are ignored,
+        # "0-0" is accepted for castling and a promotion without a piece is taken as a queen
+        text = san.rstrip("+#!?")
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            kingside = len(text) == 3
+            for move in self.getValidMoves():
+                if move.isCastleMove and (move.endCol > move.startCol) == kingside:
+                    return move
+            raise ValueError("illegal move %r in %s" % (san, self.toFEN()))
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            raise ValueError("not a SAN move: %r" % san)
+        kind, fromFile, fromRank, destination, promotion = match.groups()
+        kind = kind or 'P'
+        endRow, endCol = Move.ranksToRows[destination[1]], Move.filesToCols[destination[0]]
+        if kind == 'P' and promotion is None and endRow in (0, 7):
+            promotion = 'Q'
+        candidates = []
+        for move in self.getValidMoves():
+            if move.endRow != endRow or move.endCol != endCol or move.pieceMoved[1] != kind or move.isCastleMove:
+                continue
+            if fromFile is not None and move.startCol != Move.filesToCols[fromFile]:
+                continue
+            if fromRank is not None and move.startRow != Move.ranksToRows[fromRank]:
+                continue
+            if move.isPawnPromotion and move.promotionChoice != promotion:
+                continue
+            candidates.append(move)
+        if len(candidates) != 1:
+            raise ValueError("%s move %r in %s" % ("ambiguous" if candidates else "illegal", san, self.toFEN()))
+        return candidates[0]
+
+    def parseMove(self, text):
+        # A legal move from long notation (e2e4, e7e8q) or SAN
+        if LONG_NOTATION_PATTERN.match(text):
+            for move in self.getValidMoves():
+                if move.getLongNotation() == text:
+                    return move
+            raise ValueError("illegal move %r in %s" % (text, self.toFEN()))
+        return self.parseSAN(text)
+
+    def resetZobrist(self):
+        # Hash the position from scratch and start a new repetition history (after setting up a position by hand)
+        self.zobristKey = self.computeZobristKey()
+        self.zobristKeyLog = [self.zobristKey]
+        self.repetitionCounts = {self.zobristKey: 1}
+
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][r * 8 + c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[castleRightsIndex((self.whiteCastleKingside, self.whiteCastleQueenside,
+                                                   self.blackCastleKingside, self.blackCastleQueenside))]
+        enpassantFile = self.getEnpassantHashFile()
+        if enpassantFile is not None:
+            key ^= ZOBRIST_ENPASSANT[enpassantFile]
+        return key
+
+    def getEnpassantHashFile(self):
+        # The en passant file only counts when a pawn of the side to move could actually capture there,
+        # otherwise the position is the same as one reached without the double push
+        if self.enpassantPossible == ():
+            return None
+        epRow, epCol = self.enpassantPossible
+        if self.whiteToMove:
+            pawnRow, capturer = epRow + 1, "wP"
+        else:
+            pawnRow, capturer = epRow - 1, "bP"
+        if (epCol > 0 and self.board[pawnRow][epCol - 1] == capturer) or \
+                (epCol < 7 and self.board[pawnRow][epCol + 1] == capturer):
+            return epCol
+        return None
+
+    def updateZobristKey(self, move, oldCastleRights, oldEnpassantFile):
+        # Called at the end of makeMove: XOR out what left each square and XOR in what arrived
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        startSq = move.startRow * 8 + move.startCol
+        endSq = move.endRow * 8 + move.endCol
+        key ^= ZOBRIST_PIECES[move.pieceMoved][startSq]
+        key ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][endSq]  # the promoted piece for promotions
+        if move.isEnpassantMove:
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.startRow * 8 + move.endCol]
+        elif move.pieceCaptured != "--":
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][endSq]
+        if move.isCastleMove:
+            rook = ZOBRIST_PIECES[move.pieceMoved[0] + 'R']
+            row = move.endRow * 8
+            if move.endCol - move.startCol == 2:
+                key ^= rook[row + 7] ^ rook[row + 5]
+            else:
+                key ^= rook[row] ^ rook[row + 3]
+        newCastleRights = self.castleRightsLog[-1]
+        if newCastleRights != oldCastleRights:
+            key ^= ZOBRIST_CASTLING[castleRightsIndex(oldCastleRights)] ^ ZOBRIST_CASTLING[castleRightsIndex(newCastleRights)]
+        if oldEnpassantFile is not None:
+            key ^= ZOBRIST_ENPASSANT[oldEnpassantFile]
+        newEnpassantFile = self.getEnpassantHashFile()
+        if newEnpassantFile is not None:
+            key ^= ZOBRIST_ENPASSANT[newEnpassantFile]
+        self.zobristKey = key
+        self.zobristKeyLog.append(key)
+        self.repetitionCounts[key] = self.repetitionCounts.get(key, 0) + 1
+
+    def resetEvaluation(self):
+        # Score the position from scratch (after setting up a position by hand)
+        self.mgScore, self.egScore, self.phase = self.computeEvaluation()
+        self.evaluationLog = [(self.mgScore, self.egScore, self.phase)]
+
+    def computeEvaluation(self):
+        mgScore = egScore = phase = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    mgScore += MG_SQUARE_SCORES[piece][r * 8 + c]
+                    egScore += EG_SQUARE_SCORES[piece][r * 8 + c]
+                    phase += PHASE_WEIGHTS[piece[1]]
+        return mgScore, egScore, phase
+
+    def updateEvaluation(self, move):
+        # Called at the end of makeMove like updateZobristKey: only the squares the move touched change the score
+        startSq = move.startRow * 8 + move.startCol
+        endSq = move.endRow * 8 + move.endCol
+        arrived = self.board[move.endRow][move.endCol]  # the promoted piece for promotions
+        mgScore = self.mgScore - MG_SQUARE_SCORES[move.pieceMoved][startSq] + MG_SQUARE_SCORES[arrived][endSq]
+        egScore = self.egScore - EG_SQUARE_SCORES[move.pieceMoved][startSq] + EG_SQUARE_SCORES[arrived][endSq]
+        phase = self.phase
+        if move.isPawnPromotion:
+            phase += PHASE_WEIGHTS[move.promotionChoice]
+        if move.pieceCaptured != "--":
+            capturedSq = move.startRow * 8 + move.endCol if move.isEnpassantMove else endSq
+            mgScore -= MG_SQUARE_SCORES[move.pieceCaptured][capturedSq]
+            egScore -= EG_SQUARE_SCORES[move.pieceCaptured][capturedSq]
+            phase -= PHASE_WEIGHTS[move.pieceCaptured[1]]
+        if move.isCastleMove:
+            rook = move.pieceMoved[0] + 'R'
+            row = move.endRow * 8
+            if move.endCol - move.startCol == 2:
+                rookFrom, rookTo = row + 7, row + 5
+            else:
+                rookFrom, rookTo = row, row + 3
+            mgScore += MG_SQUARE_SCORES[rook][rookTo] - MG_SQUARE_SCORES[rook][rookFrom]
+            egScore += EG_SQUARE_SCORES[rook][rookTo] - EG_SQUARE_SCORES[rook][rookFrom]
+        self.mgScore, self.egScore, self.phase = mgScore, egScore, phase
+        self.evaluationLog.append((mgScore, egScore, phase))
+
+    def evaluate(self):
+        # Tapered material + piece-square score in centipawns, positive when white is better
+        return taperedScore(self.mgScore, self.egScore, self.phase)
+
     def updateCastleRights(self, move):
-        # Save current state of castling rights to log
-        currentRights = (self.whiteCastleKingside, self.whiteCastleQueenside,
-                         self.blackCastleKingside, self.blackCastleQueenside)
-        self.castleRightsLog.append(currentRights)
-        
         # Check if king moved
         if move.pieceMoved == "wK":
             self.whiteCastleKingside = False
@@ -173,37 +706,69 @@ class GameState():
                 elif move.endCol == 7:  # Black kingside rook captured
                     self.blackCastleKingside = False
 
+        # Log the rights after this move, undoMove pops it and goes back to the previous entry
+        self.castleRightsLog.append((self.whiteCastleKingside, self.whiteCastleQueenside,
+                                     self.blackCastleKingside, self.blackCastleQueenside))
+
     def getValidMoves(self):
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = (self.whiteCastleKingside, self.whiteCastleQueenside,
-                           self.blackCastleKingside, self.blackCastleQueenside)
-        
-        # Get all possible moves
-        moves = self.getAllPossibleMoves()
-        movesToRemove = []
-        
-        # For each move, make the move and see if it puts/leaves the king in check
-        for i in range(len(moves) - 1, -1, -1):  # Remove moves that put king in check
-            self.makeMove(moves[i], checkForGameEnd=False)  # Don't check for game end during validation
-            self.whiteToMove = not self.whiteToMove  # Switch to opponent's turn
-            inCheck = self.inCheck()
-            if inCheck:  # If the move puts/leaves the king in check, mark for removal
-                movesToRemove.append(moves[i])
-            self.whiteToMove = not self.whiteToMove  # Switch back
-            self.undoMove()
-            
-        # Remove invalid moves
-        for move in movesToRemove:
-            if move in moves:
-                moves.remove(move)
-            
-        # Restore original en passant and castling rights
-        self.enpassantPossible = tempEnpassantPossible
-        self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, self.blackCastleQueenside = tempCastleRights
-        
+        # Legal moves of the current position. Generated on the first call after a move and then reused, so
+        # callers may reorder the list but must not add or remove moves
+        if self.validMovesCache is None:
+            self.validMovesCache = self.generateValidMoves()
+            self.gameEndStatus = (self.checkmate, self.stalemate)
+        else:
+            self.checkmate, self.stalemate = self.gameEndStatus
+        return self.validMovesCache
+
+    def generateValidMoves(self):
+        # Find checks and pins once, then only generate moves that respect them
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+            enemyColor = 'b'
+        else:
+            kingRow, kingCol = self.blackKingLocation
+            enemyColor = 'w'
+        inCheck, self.pins, checks = self.checkForPinsAndChecks()
+
+        if len(checks) > 1:  # Double check, only the king can move
+            moves = []
+            self.getKingMoves(kingRow, kingCol, moves)
+        else:
+            moves = self.getAllPossibleMoves()
+        self.pins = {}
+
+        # Single check: other pieces must capture the checker or block the line to the king
+        validSquares = None
+        if len(checks) == 1:
+            checkRow, checkCol, dr, dc = checks[0]
+            if self.board[checkRow][checkCol][1] in ('N', 'P'):
+                validSquares = {(checkRow, checkCol)}
+            else:
+                validSquares = set()
+                for i in range(1, 8):
+                    square = (kingRow + dr * i, kingCol + dc * i)
+                    validSquares.add(square)
+                    if square == (checkRow, checkCol):
+                        break
+
+        legalMoves = []
+        enemyAttacks = None
+        for move in moves:
+            if move.pieceMoved[1] == 'K':
+                if enemyAttacks is None:  # the king sees through itself in the map, so it can't step back along a check
+                    enemyAttacks = self.attackMap(enemyColor)
+                if move.isCastleMove or not enemyAttacks >> (move.endRow * 8 + move.endCol) & 1:
+                    legalMoves.append(move)
+            elif move.isEnpassantMove:
+                if self.isLegalEnpassant(move, kingRow, kingCol, enemyColor):
+                    legalMoves.append(move)
+            elif validSquares is None or (move.endRow, move.endCol) in validSquares:
+                legalMoves.append(move)
+        moves = legalMoves
+
         # Check for checkmate or stalemate
         if len(moves) == 0:
-            if self.inCheck():
+            if inCheck:
                 self.checkmate = True
             else:
                 self.stalemate = True
@@ -213,6 +778,63 @@ class GameState():
             
         return moves
 
+    def isLegalEnpassant(self, move, kingRow, kingCol, enemyColor):
+        # En passant removes two pawns from one rank, which can uncover a check no pin scan sees.
+        # It's rare enough to just try it on the board
+        capturedPawn = self.board[move.startRow][move.endCol]
+        self.board[move.startRow][move.startCol] = "--"
+        self.board[move.startRow][move.endCol] = "--"
+        self.board[move.endRow][move.endCol] = move.pieceMoved
+        inCheck = self.squareAttackedBy(kingRow, kingCol, enemyColor)
+        self.board[move.endRow][move.endCol] = "--"
+        self.board[move.startRow][move.endCol] = capturedPawn
+        self.board[move.startRow][move.startCol] = move.pieceMoved
+        return not inCheck
+
+    def checkForPinsAndChecks(self):
+        pins = {}  # (row, col) of pinned piece -> direction from the king
+        checks = []  # (row, col, direction row, direction col) of each checking piece
+        inCheck = False
+        if self.whiteToMove:
+            enemyColor, allyColor = 'b', 'w'
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            enemyColor, allyColor = 'w', 'b'
+            kingRow, kingCol = self.blackKingLocation
+        # Walk out from the king: first 4 directions are orthogonal, last 4 diagonal
+        rays = RAYS[kingRow * 8 + kingCol]
+        for j in range(8):
+            d = DIRECTIONS[j]
+            possiblePin = ()
+            for i, (endRow, endCol) in enumerate(rays[j], 1):
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--":
+                    continue
+                if endPiece[0] == allyColor:
+                    if possiblePin == ():  # First ally piece on the line could be pinned
+                        possiblePin = (endRow, endCol)
+                    else:  # Second ally piece, no pin or check possible this way
+                        break
+                else:
+                    pieceType = endPiece[1]
+                    # Enemy pawns only attack diagonally towards us from one square away
+                    if (j <= 3 and pieceType == 'R') or (j >= 4 and pieceType == 'B') or pieceType == 'Q' or \
+                            (i == 1 and pieceType == 'K') or \
+                            (i == 1 and pieceType == 'P' and ((enemyColor == 'w' and j >= 6) or (enemyColor == 'b' and 4 <= j <= 5))):
+                        if possiblePin == ():
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
+                        else:
+                            pins[possiblePin] = d
+                    break
+        # Knight checks
+        enemyKnight = enemyColor + 'N'
+        for endRow, endCol in KNIGHT_TARGETS[kingRow * 8 + kingCol]:
+            if self.board[endRow][endCol] == enemyKnight:
+                inCheck = True
+                checks.append((endRow, endCol, endRow - kingRow, endCol - kingCol))
+        return inCheck, pins, checks
+
     def getAllPossibleMoves(self):
         moves = [] #empty list of moves
         for r in range(len(self.board)): ##number of rows
@@ -225,116 +847,114 @@ class GameState():
 
 
     def getPawnMoves(self, r, c, moves):
+        pinDirection = self.pins.get((r, c))  # A pinned pawn may only move along the pin line
+        forwardOk = pinDirection is None or pinDirection[1] == 0
         if self.whiteToMove:
             # Normal forward move
-            if self.board[r-1][c] == "--": # move white pawn up the board one if it is empty
-                moves.append(Move((r, c), (r-1, c), self.board)) #empty list that we are adding moves to
+            if forwardOk and self.board[r-1][c] == "--": # move white pawn up the board one if it is empty
+                self.addPawnMove(r, c, r-1, c, moves) #empty list that we are adding moves to
                 # Two square move from starting position
                 if r == 6 and self.board[r-2][c] == "--": #check pawn is in start row and can move 2 ahead
-                    moves.append(Move((r, c), (r-2, c), self.board))
+                    moves.append(Move.build(r, c, r-2, c, "wP", "--"))
             
             # Captures to the left
-            if c-1 >= 0:
+            if c-1 >= 0 and pinDirection in (None, (-1, -1), (1, 1)):
                 if self.board[r-1][c-1][0] =='b': #enemy piece to capture
-                    moves.append(Move((r, c), (r-1, c-1), self.board))
+                    self.addPawnMove(r, c, r-1, c-1, moves)
                 # En passant capture to the left
                 elif (r-1, c-1) == self.enpassantPossible:
                     moves.append(Move((r, c), (r-1, c-1), self.board, isEnpassantMove=True))
                     
             # Captures to the right
-            if c+1 <= 7: 
+            if c+1 <= 7 and pinDirection in (None, (-1, 1), (1, -1)):
                 if self.board[r-1][c+1][0] =='b': #enemy piece to capture
-                    moves.append(Move((r, c), (r-1, c+1), self.board))
+                    self.addPawnMove(r, c, r-1, c+1, moves)
                 # En passant capture to the right
                 elif (r-1, c+1) == self.enpassantPossible:
                     moves.append(Move((r, c), (r-1, c+1), self.board, isEnpassantMove=True))
 
         else: #black pawn moves
             # Normal forward move
-            if self.board[r+1][c] == "--": # move black pawn down the board one if it is empty
-                moves.append(Move((r, c), (r+1, c), self.board)) #empty list that we are adding moves to
+            if forwardOk and self.board[r+1][c] == "--": # move black pawn down the board one if it is empty
+                self.addPawnMove(r, c, r+1, c, moves) #empty list that we are adding moves to
                 # Two square move from starting position
                 if r == 1 and self.board[r+2][c] == "--": #check pawn is in start row and can move 2 ahead
-                    moves.append(Move((r, c), (r+2, c), self.board))
+                    moves.append(Move.build(r, c, r+2, c, "bP", "--"))
             
             # Captures to the left
-            if c-1 >= 0:
+            if c-1 >= 0 and pinDirection in (None, (1, -1), (-1, 1)):
                 if self.board[r+1][c-1][0] =='w': #enemy piece to capture
-                    moves.append(Move((r, c), (r+1, c-1), self.board))
+                    self.addPawnMove(r, c, r+1, c-1, moves)
                 # En passant capture to the left
                 elif (r+1, c-1) == self.enpassantPossible:
                     moves.append(Move((r, c), (r+1, c-1), self.board, isEnpassantMove=True))
                     
             # Captures to the right
-            if c+1 <= 7: 
+            if c+1 <= 7 and pinDirection in (None, (1, 1), (-1, -1)):
                 if self.board[r+1][c+1][0] =='w': #enemy piece to capture
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
+                    self.addPawnMove(r, c, r+1, c+1, moves)
                 # En passant capture to the right
                 elif (r+1, c+1) == self.enpassantPossible:
                     moves.append(Move((r, c), (r+1, c+1), self.board, isEnpassantMove=True))
 
-    def getRookMoves(self,r ,c, moves):
-        directions = ((-1,0), (0,1), (1,0), (0,-1)) #up / left / down / right
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1,8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--": #check for empy
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor: #check enemy piece (first in list)
-                        moves.append(Move((r,c), (endRow, endCol), self.board))
-                        break #breaks loop and checks another direction
-                    else:
-                        break #can't capture friendly piece pr jump a piece
-                else:
-                    break #not on the board
+    def addPawnMove(self, r, c, endRow, endCol, moves):
+        pawn = self.board[r][c]
+        captured = self.board[endRow][endCol]
+        if endRow == 0 or endRow == 7:  # Reaching the last rank, one move per piece it can promote to
+            for piece in PROMOTION_PIECES:
+                moves.append(Move.build(r, c, endRow, endCol, pawn, captured, True, piece))
+        else:
+            moves.append(Move.build(r, c, endRow, endCol, pawn, captured))
 
+    def getRookMoves(self, r, c, moves):
+        self.getSlidingMoves(r, c, ROOK_DIRECTIONS, moves)
 
-    def getKnightMoves(self,r ,c, moves):
-        knightMoves = ((-2,-1), (-2, 1), (-1, -2), (-1, 2), (1,-2), (1,2), (2,-1),(2,1)) #only concern is this list. no iterate or running into piece
+    def getKnightMoves(self, r, c, moves):
         allyColor = "w" if self.whiteToMove else "b"
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow <8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece [0] != allyColor:
-                    moves.append(Move((r,c), (endRow,endCol),self.board))
+        if (r, c) in self.pins:
+            return #a pinned knight can never move
+        board = self.board
+        knight = board[r][c]
+        for endRow, endCol in KNIGHT_TARGETS[r * 8 + c]: #only the squares on the board
+            endPiece = board[endRow][endCol]
+            if endPiece[0] != allyColor:
+                moves.append(Move.build(r, c, endRow, endCol, knight, endPiece))
+
+    def getBishopMoves(self, r, c, moves):
+        self.getSlidingMoves(r, c, BISHOP_DIRECTIONS, moves)
+
+    def getQueenMoves(self, r, c, moves):
+        self.getSlidingMoves(r, c, QUEEN_DIRECTIONS, moves)
 
-    def getBishopMoves(self,r ,c, moves):
-        directions = ((-1,-1), (-1, 1), (1,-1), (1,1)) #1:1 movement = diagonal. Top Left / Top Right / Bottom Left / Bottom Right
+    def getSlidingMoves(self, r, c, directions, moves):
+        # Walk each ray from the table until it hits a piece, capturing it if it is an enemy
+        board = self.board
         enemyColor = "b" if self.whiteToMove else "w"
+        piece = board[r][c]
+        pinDirection = self.pins.get((r, c))
+        rays = RAYS[r * 8 + c]
         for d in directions:
-            for i in range(1, 8): #max of 7 squares
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow  < 8 and 0 <= endCol < 8: #on board?
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--":
-                        moves.append(Move((r,c), (endRow,endCol), self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((r,c), (endRow, endCol), self.board))
-                        break
-                    else:
-                        break #friendly piece
+            if pinDirection is not None:
+                dr, dc = DIRECTIONS[d]
+                if pinDirection != (dr, dc) and pinDirection != (-dr, -dc):
+                    continue #pinned, can only slide along the pin line
+            for endRow, endCol in rays[d]:
+                endPiece = board[endRow][endCol]
+                if endPiece == "--":
+                    moves.append(Move.build(r, c, endRow, endCol, piece, endPiece))
                 else:
-                    break #off board
-    def getQueenMoves(self,r ,c, moves):
-        self.getRookMoves(r, c, moves)
-        self.getBishopMoves(r, c , moves)
+                    if endPiece[0] == enemyColor:
+                        moves.append(Move.build(r, c, endRow, endCol, piece, endPiece))
+                    break #can't move past a piece
+
     def getKingMoves(self, r, c, moves):
-        kingMoves = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0,1), (1, -1), (1,0), (1,1))
         allyColor = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            endRow = r + kingMoves[i][0]
-            endCol = c + kingMoves[i][1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    moves.append(Move((r,c), (endRow,endCol), self.board))
+        king = allyColor + "K"
+        board = self.board
+        for endRow, endCol in KING_TARGETS[r * 8 + c]:
+            endPiece = board[endRow][endCol]
+            if endPiece[0] != allyColor:
+                moves.append(Move.build(r, c, endRow, endCol, king, endPiece))
                     
         # Castling moves
         self.getCastleMoves(r, c, moves, allyColor)
@@ -356,175 +976,136 @@ class GameState():
         # Check if squares between king and rook are empty
         if self.board[r][c+1] == "--" and self.board[r][c+2] == "--":
             # Check if king passes through or ends up on an attacked square
-            if not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c+2):
+            enemyAttacks = self.attackMap('b' if allyColor == 'w' else 'w')
+            if not enemyAttacks >> (r * 8 + c + 1) & 3:  # both squares right of the king
                 moves.append(Move((r, c), (r, c+2), self.board, isCastleMove=True))
                 
     def getQueensideCastleMoves(self, r, c, moves, allyColor):
         # Check if squares between king and rook are empty
         if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--":
             # Check if king passes through or ends up on an attacked square
-            if not self.squareUnderAttack(r, c-1) and not self.squareUnderAttack(r, c-2):
+            enemyAttacks = self.attackMap('b' if allyColor == 'w' else 'w')
+            if not enemyAttacks >> (r * 8 + c - 2) & 3:  # both squares left of the king
                 moves.append(Move((r, c), (r, c-2), self.board, isCastleMove=True))
                 
     def isCheckmate(self):
-        if not self.inCheck():
-            return False
-            
-        # Get valid moves but don't recursively check for checkmate/stalemate
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = (self.whiteCastleKingside, self.whiteCastleQueenside,
-                           self.blackCastleKingside, self.blackCastleQueenside)
-        
-        moves = self.getAllPossibleMoves()
-        movesToRemove = []
-        
-        for move in moves:
-            self.makeMove(move, checkForGameEnd=False)
-            self.whiteToMove = not self.whiteToMove
-            inCheck = self.inCheck()
-            if inCheck:
-                movesToRemove.append(move)
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
-            
-        for move in movesToRemove:
-            if move in moves:
-                moves.remove(move)
-                
-        # Restore original en passant and castling rights
-        self.enpassantPossible = tempEnpassantPossible
-        self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, self.blackCastleQueenside = tempCastleRights
-        
-        return len(moves) == 0
+        self.getValidMoves()  # sets the flags, from the cached result if this position was already generated
+        return self.gameEndStatus[0]
         
     def isStalemate(self):
-        if self.inCheck():
-            return False
-            
-        # Get valid moves but don't recursively check for checkmate/stalemate
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = (self.whiteCastleKingside, self.whiteCastleQueenside,
-                           self.blackCastleKingside, self.blackCastleQueenside)
-        
-        moves = self.getAllPossibleMoves()
-        movesToRemove = []
-        
-        for move in moves:
-            self.makeMove(move, checkForGameEnd=False)
-            self.whiteToMove = not self.whiteToMove
-            inCheck = self.inCheck()
-            if inCheck:
-                movesToRemove.append(move)
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
-            
-        for move in movesToRemove:
-            if move in moves:
-                moves.remove(move)
-                
-        # Restore original en passant and castling rights
-        self.enpassantPossible = tempEnpassantPossible
-        self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, self.blackCastleQueenside = tempCastleRights
-        
-        return len(moves) == 0
+        self.getValidMoves()
+        return self.gameEndStatus[1]
         
     def isDraw(self):
         # Check for 50 move rule and threefold repetition
         return self.isStalemate() or self.isFiftyMove() or self.isThreefoldRepetition()
         
     def isFiftyMove(self):
-        # TODO: Implement 50 move rule
-        return False
+        # Fifty moves by each side without a capture or pawn move
+        return self.halfmoveClock >= 100
         
     def isThreefoldRepetition(self):
-        # TODO: Implement threefold repetition
-        return False
+        # Same position (pieces, side to move, castling, en passant) for the third time
+        return self.repetitionCounts[self.zobristKey] >= 3
         
     def inCheck(self):
         if self.whiteToMove:
-            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
+            kingRow, kingCol = self.whiteKingLocation
+            return bool(self.attackMap('b') >> (kingRow * 8 + kingCol) & 1)
         else:
-            return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
+            kingRow, kingCol = self.blackKingLocation
+            return bool(self.attackMap('w') >> (kingRow * 8 + kingCol) & 1)
+
+    def attackMap(self, color):
+        # Every square color attacks, as a bitmask (bit row * 8 + col). Worked out in one pass over the board the
+        # first time it is asked for in a position and kept until the next move, so check, castling and king move
+        # tests (and the UI) all read the same map instead of scanning outwards from one square at a time
+        attacks = self.attackMaps.get(color)
+        if attacks is None:
+            attacks = self.attackMaps[color] = self.computeAttackMap(color)
+        return attacks
+
+    def computeAttackMap(self, color, seeThroughKing=True):
+        # One pass collects occupancy and the sliders, then each slider ray is cut off behind its nearest blocker.
+        # Sliders see through the other side's king: a square behind it on the line stays attacked once it moves.
+        # seeThroughKing=False blocks them at the king like any other piece (what is attacked right now)
+        seeThrough = ('b' if color == 'w' else 'w') + 'K' if seeThroughKing else None
+        pawnCaptures = PAWN_CAPTURE_MASKS[0 if color == 'w' else 1]
+        attacks = 0
+        occupied = 0
+        sliders = []
+        sq = 0
+        for row in self.board:
+            for piece in row:
+                if piece != "--":
+                    if piece[0] == color:
+                        kind = piece[1]
+                        if kind == 'P':
+                            attacks |= pawnCaptures[sq]
+                        elif kind == 'N':
+                            attacks |= KNIGHT_MASKS[sq]
+                        elif kind == 'K':
+                            attacks |= KING_MASKS[sq]
+                        else:
+                            sliders.append((sq, ROOK_DIRECTIONS if kind == 'R' else BISHOP_DIRECTIONS if kind == 'B' else QUEEN_DIRECTIONS))
+                    if piece != seeThrough:
+                        occupied |= 1 << sq
+                sq += 1
+        for sq, directions in sliders:
+            for d in directions:
+                ray = RAY_MASKS[d][sq]
+                blockers = ray & occupied
+                if blockers:
+                    if POSITIVE_DIRECTIONS[d]:
+                        blocker = (blockers & -blockers).bit_length() - 1
+                    else:
+                        blocker = blockers.bit_length() - 1
+                    ray ^= RAY_MASKS[d][blocker]
+                attacks |= ray
+        return attacks
             
     def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove  # switch to opponent's turn
-        
-        # Check for attacks by pawns
-        if self.whiteToMove:  # Looking for white pawn attacks
-            if 0 <= r+1 < 8 and 0 <= c-1 < 8 and self.board[r+1][c-1] == 'wP':
-                self.whiteToMove = not self.whiteToMove
-                return True
-            if 0 <= r+1 < 8 and 0 <= c+1 < 8 and self.board[r+1][c+1] == 'wP':
-                self.whiteToMove = not self.whiteToMove
-                return True
-        else:  # Looking for black pawn attacks
-            if 0 <= r-1 < 8 and 0 <= c-1 < 8 and self.board[r-1][c-1] == 'bP':
-                self.whiteToMove = not self.whiteToMove
-                return True
-            if 0 <= r-1 < 8 and 0 <= c+1 < 8 and self.board[r-1][c+1] == 'bP':
-                self.whiteToMove = not self.whiteToMove
+        # Attacked by the opponent of the side to move
+        return self.squareAttackedBy(r, c, 'b' if self.whiteToMove else 'w')
+
+    def squareAttackedBy(self, r, c, enemyColor):
+        board = self.board
+        sq = r * 8 + c
+        pawn, knight, bishop, rook, queen, king = COLOR_PIECES[enemyColor]
+        # Pawns: an enemy pawn attacks this square from where one of our pawns here would capture
+        for endRow, endCol in PAWN_CAPTURES[1 if enemyColor == 'w' else 0][sq]:
+            if board[endRow][endCol] == pawn:
                 return True
                 
         # Check for knight attacks
-        knightMoves = ((-2,-1), (-2, 1), (-1, -2), (-1, 2), (1,-2), (1,2), (2,-1),(2,1))
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == ('w' if self.whiteToMove else 'b') and endPiece[1] == 'N':
-                    self.whiteToMove = not self.whiteToMove
-                    return True
+        for endRow, endCol in KNIGHT_TARGETS[sq]:
+            if board[endRow][endCol] == knight:
+                return True
                     
-        # Check for rook/queen attacks in straight lines
-        directions = ((-1,0), (0,1), (1,0), (0,-1))  # up, right, down, left
-        enemyColor = 'w' if self.whiteToMove else 'b'
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':  # Empty square, keep checking
-                        continue
-                    if endPiece[0] == enemyColor and (endPiece[1] == 'R' or endPiece[1] == 'Q'):
-                        self.whiteToMove = not self.whiteToMove
+        # Check for rook/queen attacks in straight lines and bishop/queen attacks on diagonals
+        rays = RAYS[sq]
+        for d in ROOK_DIRECTIONS:
+            for endRow, endCol in rays[d]:
+                endPiece = board[endRow][endCol]
+                if endPiece != "--":
+                    if endPiece == rook or endPiece == queen:
                         return True
                     break  # Blocked by a piece that can't attack in this direction
-                else:
-                    break  # Off the board
-                    
-        # Check for bishop/queen attacks in diagonal lines
-        directions = ((-1,-1), (-1,1), (1,-1), (1,1))  # diagonals
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':  # Empty square, keep checking
-                        continue
-                    if endPiece[0] == enemyColor and (endPiece[1] == 'B' or endPiece[1] == 'Q'):
-                        self.whiteToMove = not self.whiteToMove
+        for d in BISHOP_DIRECTIONS:
+            for endRow, endCol in rays[d]:
+                endPiece = board[endRow][endCol]
+                if endPiece != "--":
+                    if endPiece == bishop or endPiece == queen:
                         return True
-                    break  # Blocked by a piece that can't attack in this direction
-                else:
-                    break  # Off the board
+                    break
                     
         # Check for king attacks (adjacent squares)
-        kingMoves = ((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1))
-        for m in kingMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'K':
-                    self.whiteToMove = not self.whiteToMove
-                    return True
+        for endRow, endCol in KING_TARGETS[sq]:
+            if board[endRow][endCol] == king:
+                return True
                     
-        self.whiteToMove = not self.whiteToMove  # switch turns back
         return False
-
+        
 
 class Move():
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,#Dictionaries to map rank and file
@@ -533,32 +1114,78 @@ class Move():
     filesToCols = {"a": 0, "b":1, "c": 2, "d": 3,
                    "e":4, "f": 5, "g": 6, "h": 7}
     colsToFiles = { v: k for k, v in filesToCols.items()}
+    # No per-move __dict__: one is built for every generated move
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+                 'promotionChoice', 'isEnpassantMove', 'isCastleMove', 'code')
     
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol] #Tracks all the details about a move for the log
-        
+    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False, promotionChoice='Q'):
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        pieceMoved = board[startRow][startCol]
+        pieceCaptured = board[endRow][endCol] #Tracks all the details about a move for the log
+        if isEnpassantMove:
+            pieceCaptured = 'wP' if pieceMoved[0] == 'b' else 'bP'
         # Pawn promotion
-        self.isPawnPromotion = (self.pieceMoved[1] == 'P' and 
-                               ((self.endRow == 0 and self.pieceMoved[0] == 'w') or 
-                                (self.endRow == 7 and self.pieceMoved[0] == 'b')))
-                                
-        # En passant
+        isPawnPromotion = (pieceMoved[1] == 'P' and
+                           ((endRow == 0 and pieceMoved[0] == 'w') or
+                            (endRow == 7 and pieceMoved[0] == 'b')))
+        self.setFields(startRow, startCol, endRow, endCol, pieceMoved, pieceCaptured,
+                       isPawnPromotion, promotionChoice, isEnpassantMove, isCastleMove)
+
+    @classmethod
+    def build(cls, startRow, startCol, endRow, endCol, pieceMoved, pieceCaptured,
+              isPawnPromotion=False, promotionChoice='Q'):
+        # Move generators already know both pieces, so skip the square tuples and board lookups of __init__
+        # (fields set inline rather than through setFields, this is the hot path)
+        move = cls.__new__(cls)
+        move.startRow = startRow
+        move.startCol = startCol
+        move.endRow = endRow
+        move.endCol = endCol
+        move.pieceMoved = pieceMoved
+        move.pieceCaptured = pieceCaptured
+        move.isPawnPromotion = isPawnPromotion
+        move.promotionChoice = promotionChoice
+        move.isEnpassantMove = False
+        move.isCastleMove = False
+        code = startRow * 8 + startCol | (endRow * 8 + endCol) << 6
+        if isPawnPromotion:
+            code |= PROMOTION_CODES[promotionChoice] << 12 | PROMOTION_FLAG
+        move.code = code
+        return move
+
+    def setFields(self, startRow, startCol, endRow, endCol, pieceMoved, pieceCaptured,
+                  isPawnPromotion, promotionChoice, isEnpassantMove, isCastleMove):
+        self.startRow = startRow
+        self.startCol = startCol
+        self.endRow = endRow
+        self.endCol = endCol
+        self.pieceMoved = pieceMoved
+        self.pieceCaptured = pieceCaptured
+        self.isPawnPromotion = isPawnPromotion
+        self.promotionChoice = promotionChoice  # Piece letter the pawn turns into
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = 'wP' if self.pieceMoved[0] == 'b' else 'bP'
-            
-        # Castle move
         self.isCastleMove = isCastleMove
-        
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        
+        # Packed identity of the move, see encodeMove()
+        code = startRow * 8 + startCol | (endRow * 8 + endCol) << 6
+        if isPawnPromotion:
+            code |= PROMOTION_CODES[promotionChoice] << 12 | PROMOTION_FLAG
+        self.code = code
+
+    @property
+    def moveID(self):
+        return self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+
+    @property
+    def startSquare(self):
+        return self.code & 63  # row * 8 + col
+
+    @property
+    def endSquare(self):
+        return (self.code >> 6) & 63
+
     def getChessNotation(self):
-        # Get basic move notation
+        # Get basic move notation (without the position there is no disambiguation or check mark, see GameState.getSAN)
         if self.isCastleMove:
             if self.endCol - self.startCol == 2:  # Kingside castle
                 return "O-O"
@@ -578,14 +1205,25 @@ class Move():
         
         # Add promotion piece
         if self.isPawnPromotion:
-            moveNotation += "=Q"  # Default to queen promotion
+            moveNotation += "=" + self.promotionChoice
             
         return moveNotation
         
+    def getLongNotation(self):
+        # Start and end square, e.g. e2e4 or e7e8q
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionChoice.lower()
+        return notation
+
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
         
     def __eq__(self, other):
+        # Same squares and, for promotions, the same piece. Castling and en passant follow from the squares
         if isinstance(other, Move):
-            return self.moveID == other.moveID
+            return self.code == other.code
         return False
+
+    def __hash__(self):
+        return self.code
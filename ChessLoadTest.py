@@ -0,0 +1,181 @@
+#Load test for ChessServer.py: plays many games at once over localhost and reports moves/sec and move latency.
+#Every game has two connections, one per player; a move's latency is the time from sending it to the server's
+#"moved" answer. The games are random legal games generated before the clock starts (or taken from a PGN file),
+#so the client spends almost no time deciding what to play. --idle opens extra games that never get a move.
+#Run: python ChessLoadTest.py --spawn --games 500 --idle 10000
+#     python ChessLoadTest.py --host 10.0.0.5 --port 5000 --games 200
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+import ChessEngine
+import ChessPGN
+import ChessServer
+
+SEQUENCES = 64 #distinct games to replay, shared round robin between the simulated games
+
+
+def randomGames(count, plies, seed):
+    #Move lists in long notation of random legal games, each ending at plies or at the end of the game
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        gs = ChessEngine.GameState()
+        moves = []
+        while len(moves) < plies:
+            legal = gs.getValidMoves()
+            if not legal or gs.isDraw():
+                break
+            move = rng.choice(legal)
+            moves.append(move.getLongNotation())
+            gs.makeMove(move)
+        games.append(moves)
+    return games
+
+def pgnGames(path, count):
+    games = []
+    for game in ChessPGN.readGames(path):
+        if "FEN" in game.tags:
+            continue
+        try:
+            gs = game.play()
+        except ValueError:
+            continue
+        games.append([move.getLongNotation() for move in gs.moveLog])
+        if len(games) == count:
+            break
+    return games
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+
+class Player():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def send(self, message):
+        self.writer.write((json.dumps(message, separators=(',', ':')) + "\n").encode())
+
+    async def receive(self, op):
+        #Next message with the given op; anything else (an "opponent" notice ...) is skipped, errors raise
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError("server closed the connection")
+            message = json.loads(line)
+            if message["op"] == op:
+                return message
+            if message["op"] == "error":
+                raise ValueError(message["message"])
+
+    def close(self):
+        self.writer.close()
+
+async def connect(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    return Player(reader, writer)
+
+
+async def setUpGame(host, port):
+    white = await connect(host, port)
+    black = await connect(host, port)
+    white.send({"op": "create"})
+    gameId = (await white.receive("created"))["game"]
+    black.send({"op": "join", "game": gameId})
+    await black.receive("joined")
+    return white, black, gameId
+
+async def playGame(white, black, gameId, moves, latencies):
+    try:
+        players = (white, black)
+        for ply, text in enumerate(moves):
+            mover, other = players[ply % 2], players[1 - ply % 2]
+            sent = time.perf_counter()
+            mover.send({"op": "move", "game": gameId, "move": text})
+            await mover.receive("moved")
+            latencies.append(time.perf_counter() - sent)
+            await other.receive("moved")
+        return len(moves)
+    finally:
+        white.close()
+        black.close()
+
+async def openIdleGames(host, port, count):
+    #One connection creates all of them, pipelined; it stays open so the games stay on the server
+    owner = await connect(host, port)
+    for start in range(0, count, 1000):
+        batch = min(1000, count - start)
+        for _ in range(batch):
+            owner.send({"op": "create"})
+        for _ in range(batch):
+            await owner.receive("created")
+    return owner
+
+async def serverStats(host, port):
+    client = await connect(host, port)
+    client.send({"op": "stats"})
+    stats = await client.receive("stats")
+    client.close()
+    return stats
+
+async def runLoadTest(host, port, games, sequences, idle):
+    idleOwner = await openIdleGames(host, port, idle) if idle else None
+    setups = await asyncio.gather(*(setUpGame(host, port) for _ in range(games))) #all paired up before timing
+    latencies = []
+    start = time.perf_counter()
+    results = await asyncio.gather(*(playGame(white, black, gameId, sequences[i % len(sequences)], latencies)
+                                     for i, (white, black, gameId) in enumerate(setups)), return_exceptions=True)
+    seconds = time.perf_counter() - start
+    stats = await serverStats(host, port)
+    if idleOwner is not None:
+        idleOwner.close()
+    errors = [result for result in results if isinstance(result, BaseException)]
+    return latencies, seconds, errors, stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for ChessServer.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=ChessServer.DEFAULT_PORT)
+    parser.add_argument("--spawn", action="store_true", help="start ChessServer.py on --port for the test")
+    parser.add_argument("--games", type=int, default=200, help="games played at the same time (default 200)")
+    parser.add_argument("--plies", type=int, default=80, help="longest random game (default 80)")
+    parser.add_argument("--idle", type=int, default=0, help="extra games that are created but never played")
+    parser.add_argument("--pgn", help="replay games from this PGN file instead of random ones")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    sequences = pgnGames(args.pgn, SEQUENCES) if args.pgn else randomGames(SEQUENCES, args.plies, args.seed)
+    if not sequences:
+        parser.error("no games to play")
+    server = None
+    if args.spawn:
+        server = subprocess.Popen([sys.executable, ChessServer.__file__, "--host", args.host, "--port", str(args.port)],
+                                  stdout=subprocess.PIPE, text=True)
+        server.stdout.readline() #"Serving on ..." once it listens
+    try:
+        latencies, seconds, errors, stats = asyncio.run(runLoadTest(args.host, args.port, args.games, sequences, args.idle))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    print("%d games, %d moves in %.2fs: %.0f moves/s" % (args.games, len(latencies), seconds,
+                                                       len(latencies) / seconds if seconds > 0 else 0.0))
+    print("latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f" % tuple(
+        1000 * percentile(latencies, fraction) for fraction in (0.5, 0.9, 0.99, 1.0)))
+    print("server: %d games, %d live, %d KB max RSS" % (stats["games"], stats["live"], stats["maxRssKB"]))
+    for error in errors[:5]:
+        print("error: %r" % error)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,25 @@
 #User Input and validation
 import pygame as p
 import ChessEngine
+import ChessProfile
+import ChessSearch
+import argparse
+import queue
 import sys
+import threading
 
 WIDTH = 562 #max of res (512 + 50 for evaluation bar)
 HEIGHT = 512
 DIMENSION = 8 #Dimensions of chess board
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15 #animations
+MAX_FPS = 15 #frame rate while nothing moves
+ANIMATION_FPS = 60
 EVAL_BAR_WIDTH = 50
+PROFILE_WIDTH = 300 #engine profile overlay (p key) in the top left corner
+PROFILE_LINE_HEIGHT = 15
 IMAGES = {}
+FONTS = {}
+TEXTS = {}
 
 # Colors
 WHITE = p.Color("white")
@@ -28,36 +38,66 @@ def loadImages():
         IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
 
 #Main Loop of Game
-def main():
+#playerOne / playerTwo: True if a human plays white / black, False if the computer does.
+#The loop never waits for the engine: legal moves, game end and computer moves come from an EngineWorker
+#thread and are picked up once per frame, and a move animation advances one step per frame
+#bookPath: Polyglot opening book the computer plays from while the position is in it
+def main(playerOne=True, playerTwo=True, thinkTime=2.0, bookPath=None):
     p.init()
     p.display.set_caption("Chess with Evaluation")
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(WHITE)
     gs = ChessEngine.GameState()
-    validMoves = gs.getValidMoves()
-    moveMade = False
-    animate = False  # Flag for when to animate a move
+    book = None
+    if bookPath is not None:
+        import ChessBook
+        book = ChessBook.PolyglotBook(bookPath)
+    worker = EngineWorker(ChessSearch.Searcher(), book)  # the searcher keeps its transposition table from move to move
+    worker.submit("refresh", gs)
+    validMoves = []  # legal moves of the current position, empty until the worker has sent them
+    animation = None  # MoveAnimation of the last move while it is still sliding
     gameOver = False  # Flag for when game is over
+    endText = None
     
     # For pawn promotion
     promotionPieces = ['Q', 'R', 'B', 'N']
-    promotionChoice = 0  # Default to queen
+    pendingPromotion = None  # Promotion move waiting for the player to pick a piece
 
     loadImages()  # Load once, move images around
+    renderer = BoardRenderer(screen)
     running = True
     sqSelected = ()  # Initial selection is empty, tracks last click of user (row, col)
     playerClicks = []  # list with 2 tuples: [(6, 5), (4, 4)] pawn move tracked
     movePlayed = []  # To track the last move played for highlighting
+    profileShown = False  # engine profile overlay, toggled with p
+    threatsShown = False  # shade the side to move's pieces the opponent attacks, toggled with t
+    threatened = frozenset()  # those squares, from the worker with the legal moves
+    profileBefore = None  # ChessProfile snapshot at the start of the frame
+    recentEngineTimes = []  # engine seconds of the last second of frames
+    
+    def isHumanTurn():
+        return (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
+    
+    def playMove(move, note=""):
+        # Make the move on the board now, the worker works out the new legal moves and the move's SAN
+        nonlocal validMoves, threatened, animation, movePlayed
+        gs.makeMove(move, checkForGameEnd=False)
+        movePlayed = [move.startRow, move.startCol, move.endRow, move.endCol]
+        animation = MoveAnimation(move, gs.board[move.endRow][move.endCol])
+        validMoves = []
+        threatened = frozenset()
+        worker.submit("refresh", gs, announce=note)
     
     while running:
+        humanTurn = isHumanTurn()
         for e in p.event.get():
             if e.type == p.QUIT:  # exit strategy
                 running = False
                 
             # Mouse functions
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not gameOver:  # Ignore clicks if game is over
+                if not gameOver and humanTurn and validMoves:  # Ignore clicks if game is over or the computer is thinking
                     location = p.mouse.get_pos()  # Where is the mouse
                     col = location[0] // SQ_SIZE
                     row = location[1] // SQ_SIZE
@@ -67,9 +107,15 @@ def main():
                         if WIDTH // 2 - SQ_SIZE <= location[0] <= WIDTH // 2 + SQ_SIZE:
                             for i, piece in enumerate(promotionPieces):
                                 if HEIGHT // 2 - 2 * SQ_SIZE + i * SQ_SIZE <= location[1] <= HEIGHT // 2 - 2 * SQ_SIZE + (i + 1) * SQ_SIZE:
-                                    gs.promotionChoice = piece
+                                    move = ChessEngine.Move((pendingPromotion.startRow, pendingPromotion.startCol),
+                                                            (pendingPromotion.endRow, pendingPromotion.endCol),
+                                                            gs.board, promotionChoice=piece)
                                     gs.pawnPromotion = False
-                                    moveMade = True
+                                    pendingPromotion = None
+                                    for validMove in validMoves:
+                                        if move == validMove:
+                                            playMove(validMove)
+                                            break
                         continue  # Skip regular move logic when in promotion mode
                     
                     if sqSelected == (row, col):  # this clears the selection after a 2nd click on a square
@@ -94,19 +140,15 @@ def main():
                         move_is_valid = False
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
-                                gs.makeMove(validMoves[i])
-                                movePlayed = [move.startRow, move.startCol, move.endRow, move.endCol]
-                                print(move.getChessNotation())
-                                
-                                # Check for pawn promotion
+                                # Check for pawn promotion, the move is made once a piece is picked
                                 if validMoves[i].isPawnPromotion:
                                     gs.pawnPromotion = True
+                                    pendingPromotion = validMoves[i]
                                     sqSelected = ()
                                     playerClicks = []
                                     break
                                 
-                                moveMade = True
-                                animate = True
+                                playMove(validMoves[i])
                                 sqSelected = ()  # reset the click count
                                 playerClicks = []
                                 move_is_valid = True
@@ -115,184 +157,400 @@ def main():
                         if not move_is_valid and not gs.pawnPromotion:  # Only reset clicks if not in promotion mode
                             playerClicks = [sqSelected]
             
+            elif e.type == p.VIDEOEXPOSE:  # the window was covered, its contents may be gone
+                renderer.invalidate()
+                
             # Key handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # undo when keyboard z is pressed
+                    worker.cancel()  # a search for the position being taken back is of no use any more
                     gs.undoMove()
-                    moveMade = True
-                    animate = False
+                    while gs.moveLog and not isHumanTurn():  # Against the computer take back its reply as well
+                        gs.undoMove()
+                    gs.pawnPromotion = False
+                    pendingPromotion = None
+                    animation = None
+                    validMoves = []
+                    threatened = frozenset()
                     gameOver = False
+                    endText = None
+                    worker.submit("refresh", gs)
                     
                 if e.key == p.K_r:  # reset the game when r is pressed
+                    worker.cancel()
                     gs = ChessEngine.GameState()
-                    validMoves = gs.getValidMoves()
+                    validMoves = []
+                    threatened = frozenset()
                     sqSelected = ()
                     playerClicks = []
-                    moveMade = False
-                    animate = False
+                    animation = None
                     gameOver = False
+                    endText = None
                     movePlayed = []
+                    pendingPromotion = None
+                    worker.submit("refresh", gs)
                     
                 if e.key == p.K_q:  # quit game when q is pressed
                     running = False
                     
-        # Update game state
-        if moveMade:
-            if animate:
-                animateMove(screen, gs.board, clock, movePlayed, gs)
-                animate = False
-            validMoves = gs.getValidMoves()
-            moveMade = False
-            
-        # Draw the game state
-        drawGameState(screen, gs, validMoves, sqSelected, movePlayed)
-        
-        # Check for end of game
-        if gs.checkmate:
-            gameOver = True
-            drawEndGameText(screen, "Checkmate! " + ("Black" if gs.whiteToMove else "White") + " wins!")
-        elif gs.stalemate:
-            gameOver = True
-            drawEndGameText(screen, "Stalemate! Draw!")
-            
-        # Draw promotion selection if active
-        if gs.pawnPromotion:
-            drawPromotionOptions(screen, gs.whiteToMove)
+                if e.key == p.K_p:  # engine profile overlay; the engine is only instrumented while it is shown
+                    profileShown = not profileShown
+                    if profileShown:
+                        ChessProfile.reset()
+                        ChessProfile.enable()
+                        profileBefore = ChessProfile.snapshot()
+                        recentEngineTimes = []
+                    else:
+                        ChessProfile.disable()
+
+                if e.key == p.K_t:  # show which of the side to move's pieces are attacked
+                    threatsShown = not threatsShown
+                    
+        # Results from the worker: legal moves and game end of a new position, or the computer's move
+        for kind, result in worker.poll():
+            if kind == "refresh":
+                validMoves, checkmate, stalemate, san, threatened = result
+                if san is not None:
+                    print(san)
+                # Check for end of game
+                if checkmate:
+                    gameOver = True
+                    endText = "Checkmate! " + ("Black" if gs.whiteToMove else "White") + " wins!"
+                elif stalemate:
+                    gameOver = True
+                    endText = "Stalemate! Draw!"
+                elif not isHumanTurn():
+                    worker.submit("search", gs, thinkTime=thinkTime)  # Computer move
+            elif kind == "search":
+                move, info = result
+                if move is not None:
+                    playMove(move, "  (" + info + ")")
             
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
-# Animate the move
-def animateMove(screen, board, clock, move, gs):
-    global colors
-    startRow, startCol, endRow, endCol = move
-    dR = endRow - startRow
-    dC = endCol - startCol
+        # Draw what changed, with the moving piece and the end of game text or the promotion selection on top
+        sprite = None
+        if animation is not None:
+            sprite = animation.sprite()
+            if animation.advance():
+                animation = None
+        profileLines = None
+        if profileShown:  # engine calls since the last frame, on this thread and the worker's
+            profileAfter = ChessProfile.snapshot()
+            frame = ChessProfile.difference(profileAfter, profileBefore)
+            profileBefore = profileAfter
+            recentEngineTimes = (recentEngineTimes + [ChessProfile.totalSeconds(frame)])[-ANIMATION_FPS:]
+            profileLines = profileOverlayLines(frame, max(recentEngineTimes))
+        renderer.draw(gs, validMoves, sqSelected, movePlayed, endText, gs.pawnPromotion,
+                      hiddenSquare=animation.end if animation is not None else None, sprite=sprite,
+                      profileLines=profileLines, threatened=threatened if threatsShown else ())
+        clock.tick(ANIMATION_FPS if animation is not None else MAX_FPS)
+    worker.close()
+    ChessProfile.disable()
+    if book is not None:
+        book.close()
+
+# Engine work on a background thread. Each job gets its own GameState, rebuilt from a toBytes() snapshot of the
+# game, so the UI's board is never touched from two threads. Jobs submitted before the latest cancel()/submit()
+# are stale: they are skipped if they haven't started and their results are dropped. Every job carries its own
+# stop token, which the search checks, so a stale job also stops searching even if it only starts after the cancel
+class EngineWorker():
+    def __init__(self, searcher, book=None):
+        self.searcher = searcher
+        self.book = book
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.stopToken = threading.Event()  # of the latest job
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, gs, **options):
+        # "refresh": legal moves, (checkmate, stalemate), with announce the SAN of the last move (+ announce), and
+        # the squares of the side to move's pieces that the opponent attacks
+        # "search": the computer's move (from the book if there is one for the position, otherwise searched
+        # for thinkTime seconds) and its info line
+        self.stopToken.set()
+        self.stopToken = threading.Event()
+        self.generation += 1
+        self.jobs.put((self.generation, self.stopToken, kind, type(gs), gs.toBytes(), options))
+
+    def cancel(self):
+        self.generation += 1
+        self.stopToken.set()
+
+    def close(self):
+        self.cancel()
+        self.jobs.put(None)
+        self.thread.join()
+
+    def poll(self):
+        # (kind, result) of finished jobs that are still current, never blocks
+        finished = []
+        while True:
+            try:
+                generation, kind, result = self.results.get_nowait()
+            except queue.Empty:
+                return finished
+            if generation == self.generation:
+                finished.append((kind, result))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            generation, stopToken, kind, stateClass, snapshot, options = job
+            if generation != self.generation or stopToken.is_set():
+                continue
+            gs = stateClass.fromBytes(snapshot)
+            if kind == "refresh":
+                moves = gs.getValidMoves()
+                checkmate, stalemate = gs.isCheckmate(), gs.isStalemate()
+                threatened = threatenedSquares(gs)
+                san = None
+                if "announce" in options and gs.moveLog:
+                    lastMove = gs.moveLog[-1]
+                    gs.undoMove()
+                    san = gs.getSAN(lastMove) + options["announce"]
+                result = (moves, checkmate, stalemate, san, threatened)
+            else:
+                move = self.book.chooseMove(gs) if self.book is not None else None
+                if move is not None:
+                    result = (move, "book")
+                else:
+                    search = self.searcher.search(gs, ChessSearch.SearchLimits(movetime=options["thinkTime"],
+                                                                                 stop=stopToken))
+                    result = (search.bestMove, search.getInfoString())
+            self.results.put((generation, kind, result))
+
+# (row, col) of every piece of the side to move that the opponent attacks. The cached attack map lets sliders
+# see through our king (for king moves), so it is worked out again with the king blocking like any other piece
+def threatenedSquares(gs):
+    own, enemy = ('w', 'b') if gs.whiteToMove else ('b', 'w')
+    attacks = gs.computeAttackMap(enemy, seeThroughKing=False)
+    return frozenset((r, c) for r in range(DIMENSION) for c in range(DIMENSION)
+                     if gs.board[r][c][0] == own and attacks >> (r * DIMENSION + c) & 1)
+
+# A move sliding from its start to its end square, one step per frame
+class MoveAnimation():
     framesPerSquare = 5  # frames to move one square
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
-        r, c = (startRow + dR * frame / frameCount,
-                startCol + dC * frame / frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # Erase the piece moved from its ending square
-        color = WHITE if (endRow + endCol) % 2 == 0 else GRAY
-        endSquare = p.Rect(endCol * SQ_SIZE, endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-        # Draw the moving piece
-        if board[endRow][endCol] != '--':
-            screen.blit(IMAGES[board[endRow][endCol]], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
+
+    def __init__(self, move, piece):
+        self.start = (move.startRow, move.startCol)
+        self.end = (move.endRow, move.endCol)
+        self.piece = piece
+        self.frameCount = (abs(move.endRow - move.startRow) + abs(move.endCol - move.startCol)) * self.framesPerSquare
+        self.frame = 0
+
+    def sprite(self):
+        # (image, rect) of the piece in the current frame
+        dR = self.end[0] - self.start[0]
+        dC = self.end[1] - self.start[1]
+        r, c = (self.start[0] + dR * self.frame / self.frameCount,
+                self.start[1] + dC * self.frame / self.frameCount)
+        return IMAGES[self.piece], p.Rect(int(c * SQ_SIZE), int(r * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+
+    def advance(self):
+        # True once the last frame has been shown
+        self.frame += 1
+        return self.frame > self.frameCount
 
 # Draw promotion options
 def drawPromotionOptions(screen, whiteToMove):
     color = "w" if whiteToMove else "b"
+    area = p.Rect(WIDTH//2 - SQ_SIZE, HEIGHT//2 - 2*SQ_SIZE, 2*SQ_SIZE, 4*SQ_SIZE)
     
     # Draw background
-    p.draw.rect(screen, BLACK, p.Rect(WIDTH//2 - SQ_SIZE, HEIGHT//2 - 2*SQ_SIZE, 2*SQ_SIZE, 4*SQ_SIZE))
+    p.draw.rect(screen, BLACK, area)
     
     # Draw each promotion option
     promotionPieces = ['Q', 'R', 'B', 'N']
     for i, piece in enumerate(promotionPieces):
         screen.blit(IMAGES[color + piece], p.Rect(WIDTH//2 - SQ_SIZE//2, HEIGHT//2 - 2*SQ_SIZE + i*SQ_SIZE, SQ_SIZE, SQ_SIZE))
         p.draw.rect(screen, WHITE, p.Rect(WIDTH//2 - SQ_SIZE, HEIGHT//2 - 2*SQ_SIZE + i*SQ_SIZE, 2*SQ_SIZE, SQ_SIZE), 2)
+    return area
 
 # Draw end game text
 def drawEndGameText(screen, text):
-    font = p.font.SysFont("Arial", 32, True, False)
-    textObject = font.render(text, False, RED)
+    textObject = renderText(text, 32, RED, antialias=False)
     textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH//2 - textObject.get_width()//2, HEIGHT//2 - textObject.get_height()//2)
-    screen.blit(textObject, textLocation)
-
-# Creates graphics on the Board
-def drawGameState(screen, gs, validMoves, sqSelected, movePlayed):
-    drawBoard(screen)  # squares on the board
-    highlightSquares(screen, gs, validMoves, sqSelected, movePlayed)
-    drawPieces(screen, gs.board)  # pieces on top of the board
-    drawEvaluationBar(screen, gs)  # evaluation bar on the side
-
-def drawBoard(screen):
-    colors = [WHITE, GRAY]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r+c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-def highlightSquares(screen, gs, validMoves, sqSelected, movePlayed):
-    # Highlight last move
-    if len(movePlayed) == 4:
-        startRow, startCol, endRow, endCol = movePlayed
-        s = p.Surface((SQ_SIZE, SQ_SIZE))
-        s.set_alpha(100)  # transparency value (0-255)
-        s.fill(YELLOW)
-        screen.blit(s, (startCol * SQ_SIZE, startRow * SQ_SIZE))
-        screen.blit(s, (endCol * SQ_SIZE, endRow * SQ_SIZE))
-    
-    # Highlight selected square
-    if sqSelected != ():
-        r, c = sqSelected
+    return screen.blit(textObject, textLocation)
+
+# Text of the engine profile overlay: the frame's engine time, the worst frame of the last second and the
+# calls of each instrumented method in this frame with their time
+def profileOverlayLines(frame, worstSeconds):
+    lines = ["engine %.1f ms this frame, worst %.1f ms" % (ChessProfile.totalSeconds(frame) * 1000, worstSeconds * 1000)]
+    for name in ChessProfile.INSTRUMENTED:
+        lines.append("%-19s %5d %7.2f ms" % (name, frame[name]["calls"], frame[name]["seconds"] * 1000))
+    return tuple(lines)
+
+def drawProfileOverlay(screen, lines):
+    area = p.Rect(0, 0, PROFILE_WIDTH, PROFILE_LINE_HEIGHT * len(lines) + 4)
+    p.draw.rect(screen, BLACK, area)
+    for i, line in enumerate(lines):
+        # the numbers change every frame, so these strings are not worth keeping
+        screen.blit(renderText(line, 12, GREEN, cached=False, fontName="Courier"), (4, 2 + i * PROFILE_LINE_HEIGHT))
+    return area
+
+# Fonts and rendered strings are kept: SysFont searches the installed fonts every time it is called
+def renderText(text, size, color, antialias=True, cached=True, fontName="Arial"):
+    fontKey = (fontName, size, True, False)
+    font = FONTS.get(fontKey)
+    if font is None:
+        font = FONTS[fontKey] = p.font.SysFont(*fontKey)
+    if not cached:
+        return font.render(text, antialias, color)
+    textKey = (fontKey, text, tuple(color), antialias)
+    surface = TEXTS.get(textKey)
+    if surface is None:
+        surface = TEXTS[textKey] = font.render(text, antialias, color)
+    return surface
+
+# Draws only what changed since the last frame and hands just those rectangles to the display.
+# Every square remembers what it shows (piece, highlights, move marker); the evaluation bar and the
+# end of game / promotion overlays are compared the same way. A frame where nothing changed draws nothing
+class BoardRenderer():
+    def __init__(self, screen):
+        self.screen = screen
+        # The empty board never changes, squares are copied from it instead of filled one by one
+        self.background = p.Surface((HEIGHT, HEIGHT))
+        colors = [WHITE, GRAY]
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                p.draw.rect(self.background, colors[((r+c) % 2)], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        self.lastMoveShade = p.Surface((SQ_SIZE, SQ_SIZE))
+        self.lastMoveShade.set_alpha(100)  # transparency value (0-255)
+        self.lastMoveShade.fill(YELLOW)
+        self.selectedShade = p.Surface((SQ_SIZE, SQ_SIZE))
+        self.selectedShade.set_alpha(100)
+        self.selectedShade.fill(BLUE)
+        self.threatShade = p.Surface((SQ_SIZE, SQ_SIZE))
+        self.threatShade.set_alpha(100)
+        self.threatShade.fill(RED)
+        self.invalidate()
+
+    def invalidate(self):
+        # Forget what is on screen, the next draw repaints everything (new window, exposed window ...)
+        self.squares = [None] * (DIMENSION * DIMENSION)
+        self.spriteRect = None
+        self.evalBar = None
+        self.overlay = None
+        self.profileRect = None
+        self.profileLines = None
+
+    def forgetSquares(self, rect):
+        # The squares under rect are repainted by the next draw
+        for r in range(rect.top // SQ_SIZE, min(DIMENSION, (rect.bottom - 1) // SQ_SIZE + 1)):
+            for c in range(rect.left // SQ_SIZE, min(DIMENSION, (rect.right - 1) // SQ_SIZE + 1)):
+                self.squares[r * DIMENSION + c] = None
+
+    def draw(self, gs, validMoves, sqSelected, movePlayed, endText=None, promotion=False, hiddenSquare=None, sprite=None,
+             profileLines=None, threatened=()):
+        # sprite: (image, rect) drawn over the squares, e.g. a piece in the middle of its move animation
+        # profileLines: text of the engine profile overlay, None to hide it
+        # threatened: squares shaded as attacked (threatenedSquares)
+        overlay = ("end", endText) if endText else ("promotion", gs.whiteToMove) if promotion else None
+        if self.overlay is not None and overlay != self.overlay:
+            self.invalidate()  # whatever the old overlay covered has to come back
+        if self.spriteRect is not None:  # squares under last frame's sprite are repainted
+            self.forgetSquares(self.spriteRect)
+            self.spriteRect = None
+        if self.profileRect is not None and profileLines != self.profileLines:  # as are those under an old profile
+            self.forgetSquares(self.profileRect)
+            self.profileRect = None
+        rects = []
+        for sq, state in enumerate(self.squareStates(gs, validMoves, sqSelected, movePlayed, hiddenSquare,
+                                                                threatened)):
+            if state != self.squares[sq]:
+                rects.append(self.drawSquare(sq, state))
+                self.squares[sq] = state
+        if sprite is not None:
+            image, self.spriteRect = sprite
+            rects.append(self.screen.blit(image, self.spriteRect))
+        evalBar = evaluationBarState(gs)
+        if evalBar != self.evalBar:
+            rects.append(drawEvaluationBar(self.screen, evalBar))
+            self.evalBar = evalBar
+        if profileLines is not None and (self.profileRect is None or any(self.profileRect.colliderect(rect) for rect in rects)):
+            self.profileRect = drawProfileOverlay(self.screen, profileLines)
+            rects.append(self.profileRect)
+        self.profileLines = profileLines
+        if overlay is not None and (rects or overlay != self.overlay):  # redrawn squares may have covered part of it
+            if overlay[0] == "end":
+                rects.append(drawEndGameText(self.screen, endText))
+            else:
+                rects.append(drawPromotionOptions(self.screen, gs.whiteToMove))
+        self.overlay = overlay
+        if rects:
+            p.display.update(rects)
+        return rects
+
+    def squareStates(self, gs, validMoves, sqSelected, movePlayed, hiddenSquare, threatened=()):
+        # (piece, last move, selected, marker, threatened) for every square, marker being None, "dot" or "ring"
+        lastMove = ()
+        if len(movePlayed) == 4:
+            lastMove = ((movePlayed[0], movePlayed[1]), (movePlayed[2], movePlayed[3]))
+        markers = {}
         # Highlight only if it's the player's piece
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(BLUE)
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-            
-            # Highlight valid moves from this square
+        if sqSelected != () and gs.board[sqSelected[0]][sqSelected[1]][0] == ('w' if gs.whiteToMove else 'b'):
             for move in validMoves:
-                if move.startRow == r and move.startCol == c:
+                if (move.startRow, move.startCol) == sqSelected:
                     # Different highlight for captures versus moves
-                    if gs.board[move.endRow][move.endCol] == '--':
-                        p.draw.circle(screen, GREEN, 
-                                     (move.endCol * SQ_SIZE + SQ_SIZE//2, move.endRow * SQ_SIZE + SQ_SIZE//2), 
-                                     SQ_SIZE//8)
-                    else:
-                        p.draw.circle(screen, RED, 
-                                     (move.endCol * SQ_SIZE + SQ_SIZE//2, move.endRow * SQ_SIZE + SQ_SIZE//2), 
-                                     SQ_SIZE//2, 4)
-
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":  # Check if square is empty
-                screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-# Material values for simple evaluation
+                    markers[(move.endRow, move.endCol)] = "dot" if gs.board[move.endRow][move.endCol] == '--' else "ring"
+        else:
+            sqSelected = ()
+        states = []
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                piece = '--' if (r, c) == hiddenSquare else gs.board[r][c]
+                states.append((piece, (r, c) in lastMove, (r, c) == sqSelected, markers.get((r, c)),
+                               (r, c) in threatened))
+        return states
+
+    def drawSquare(self, sq, state):
+        piece, lastMove, selected, marker, threatened = state
+        r, c = divmod(sq, DIMENSION)
+        rect = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.background, rect, rect)
+        if lastMove:
+            self.screen.blit(self.lastMoveShade, rect)
+        if threatened:
+            self.screen.blit(self.threatShade, rect)
+        if selected:
+            self.screen.blit(self.selectedShade, rect)
+        if marker == "dot":
+            p.draw.circle(self.screen, GREEN, rect.center, SQ_SIZE//8)
+        elif marker == "ring":
+            p.draw.circle(self.screen, RED, rect.center, SQ_SIZE//2, 4)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+# Evaluation for the bar, read from the score the engine keeps up to date on every move
 def evaluateBoard(gs):
-    # Piece values: pawn = 1, knight/bishop = 3, rook = 5, queen = 9
-    piece_values = {
-        'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 0,  # King has no material value
-        'p': -1, 'n': -3, 'b': -3, 'r': -5, 'q': -9, 'k': 0  # Negative for black pieces
-    }
-    
     # Normalize to a value between -1 and 1 for drawing
-    total = 0
-    max_value = 39  # Maximum possible advantage (all pieces minus one king)
-    
-    for row in gs.board:
-        for piece in row:
-            if piece != "--":
-                # Convert piece code to value (e.g., 'wP' -> 'P', 'bQ' -> 'q')
-                piece_type = piece[1] if piece[0] == 'w' else piece[1].lower()
-                total += piece_values.get(piece_type, 0)
-    
+    max_value = 39  # Maximum possible advantage in pawns (all pieces minus one king)
+    total = gs.evaluate() / 100  # centipawns -> pawns
+
     # Normalize to range between -1 and 1
     return max(min(total / max_value, 1.0), -1.0)
 
-def drawEvaluationBar(screen, gs):
-    # Evaluation bar on the right side
-    p.draw.rect(screen, GRAY, p.Rect(HEIGHT, 0, EVAL_BAR_WIDTH, HEIGHT))
-    
-    # Calculate evaluation score from -1 to 1 (where positive is white advantage)
+def evaluationBarState(gs):
+    # (height of white's part, advantage text or None): all the bar shows, so equal states look the same
     score = evaluateBoard(gs)
-    
-    # Calculate how to draw the bar
-    bar_height = HEIGHT // 2
+    white_height = int(HEIGHT // 2 - score * (HEIGHT // 2))
+    # Draw evaluation text if significant advantage
+    if abs(score) > 0.05:
+        advantage = abs(round(score * 10, 1))  # Format as float with 1 decimal place
+        return white_height, f"+{advantage}", score < 0
+    return white_height, None, False
+
+def drawEvaluationBar(screen, state):
+    # Evaluation bar on the right side
+    white_height, text, blackAhead = state
+    area = p.Rect(HEIGHT, 0, EVAL_BAR_WIDTH, HEIGHT)
+    p.draw.rect(screen, GRAY, area)
     
     # Draw white's portion (top half if white is winning)
-    white_height = int(HEIGHT // 2 - score * (HEIGHT // 2))
     p.draw.rect(screen, WHITE, p.Rect(HEIGHT, 0, EVAL_BAR_WIDTH, white_height))
     
     # Draw black's portion (bottom half is black is winning)
@@ -302,17 +560,21 @@ def drawEvaluationBar(screen, gs):
     # Draw center line
     p.draw.line(screen, GRAY, (HEIGHT, HEIGHT // 2), (WIDTH, HEIGHT // 2), 1)
     
-    # Draw evaluation text if significant advantage
-    if abs(score) > 0.05:
-        advantage = abs(round(score * 10, 1))  # Format as float with 1 decimal place
-        color = WHITE if score < 0 else BLACK  # Text color opposite of background
-        bg_color = BLACK if score < 0 else WHITE
-        font = p.font.SysFont("Arial", 14, True, False)
-        text = f"+{advantage}"
-        text_obj = font.render(text, True, color)
+    if text is not None:
+        color = WHITE if blackAhead else BLACK  # Text color opposite of background
+        bg_color = BLACK if blackAhead else WHITE
+        text_obj = renderText(text, 14, color)
         text_pos = (HEIGHT + (EVAL_BAR_WIDTH - text_obj.get_width()) // 2, HEIGHT // 2 - 10)
         p.draw.rect(screen, bg_color, (text_pos[0]-2, text_pos[1], text_obj.get_width()+4, text_obj.get_height()))
         screen.blit(text_obj, text_pos)
+    return area
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Chess with Evaluation")
+    parser.add_argument("--computer", choices=["none", "white", "black", "both"], default="none",
+                        help="side(s) played by the computer")
+    parser.add_argument("--think", type=float, default=2.0, help="computer thinking time per move in seconds")
+    parser.add_argument("--book", help="Polyglot opening book (.bin) for the computer")
+    args = parser.parse_args()
+    main(playerOne=args.computer not in ("white", "both"), playerTwo=args.computer not in ("black", "both"),
+         thinkTime=args.think, bookPath=args.book)
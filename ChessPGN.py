@@ -0,0 +1,169 @@
+#PGN reading and writing. readGames() is a generator that parses one game at a time from a file of any size;
+#writeGame() turns a GameState's moveLog back into PGN text.
+#  for game in ChessPGN.readGames("archive.pgn.gz"): gs = game.play()
+import gzip
+import re
+
+import ChessEngine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+#Movetext tokens: comments, variation brackets, NAGs, results, move numbers and everything else (SAN)
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s{};()$]+')
+
+
+class PGNGame():
+    def __init__(self):
+        self.tags = {} #in file order
+        self.moves = [] #SAN strings of the main line
+        self.result = "*"
+
+    def play(self, stateClass=ChessEngine.GameState):
+        #GameState after the moves, from the FEN tag if there is one. ValueError on an illegal move
+        gs = stateClass.fromFEN(self.tags["FEN"]) if "FEN" in self.tags else stateClass()
+        for san in self.moves:
+            gs.makeMove(gs.parseSAN(san), checkForGameEnd=False)
+        return gs
+
+
+def openSource(source):
+    #A path (plain or .gz) is opened here, anything else is taken to be an iterable of lines
+    if isinstance(source, str):
+        if source.endswith(".gz"):
+            return gzip.open(source, "rt", encoding="utf-8", errors="replace")
+        return open(source, "r", encoding="utf-8", errors="replace")
+    return None
+
+def readGames(source):
+    #Generator of PGNGame. Only the current game is held in memory; variations, comments and NAGs are skipped
+    handle = openSource(source)
+    lines = handle if handle is not None else source
+    game = None
+    movetext = []
+    inComment = False #a { comment } can span lines and contain [ or a result
+    try:
+        for line in lines:
+            if line.startswith('%'):
+                continue #escape line
+            stripped = line.strip()
+            if stripped.startswith('[') and not inComment:
+                if movetext:
+                    yield _finishGame(game, movetext)
+                    game = None
+                    movetext = []
+                match = TAG_PATTERN.match(stripped)
+                if match:
+                    if game is None:
+                        game = PGNGame()
+                    game.tags[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                continue
+            if stripped:
+                if game is None:
+                    game = PGNGame()
+                movetext.append(line)
+                inComment = _commentOpenAfter(line, inComment)
+                if not inComment and stripped.endswith(RESULTS):
+                    yield _finishGame(game, movetext)
+                    game = None
+                    movetext = []
+        if game is not None:
+            yield _finishGame(game, movetext)
+    finally:
+        if handle is not None:
+            handle.close()
+
+def _commentOpenAfter(line, inComment):
+    position = 0
+    while True:
+        if inComment:
+            position = line.find('}', position)
+            if position < 0:
+                return True
+            inComment = False
+        else:
+            brace = line.find('{', position)
+            semicolon = line.find(';', position)
+            if brace < 0 or (0 <= semicolon < brace):
+                return False #no brace, or the rest of the line is a ; comment
+            inComment = True
+            position = brace
+        position += 1
+
+def _finishGame(game, movetext):
+    depth = 0 #variation nesting
+    for token in TOKEN_PATTERN.findall(''.join(movetext)):
+        first = token[0]
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(0, depth - 1)
+        elif depth or first in '{;$' or (first.isdigit() and token.endswith('.')):
+            continue
+        elif token in RESULTS:
+            game.result = token
+        else:
+            game.moves.append(token)
+    if game.result == "*" and game.tags.get("Result") in RESULTS:
+        game.result = game.tags["Result"]
+    return game
+
+
+def gameResult(gs):
+    if gs.isCheckmate():
+        return "0-1" if gs.whiteToMove else "1-0"
+    if gs.isDraw():
+        return "1/2-1/2"
+    return "*"
+
+def writeGame(gs, tags=None, result=None):
+    #PGN text for the game in gs.moveLog. Missing seven tag roster entries get the usual "?" placeholders,
+    #and a FEN tag is added when the game didn't start from the initial position
+    moves = list(gs.moveLog)
+    for _ in moves:
+        gs.undoMove()
+    startFEN = gs.toFEN()
+    firstNumber, blackFirst = gs.fullmoveNumber, not gs.whiteToMove
+    sans = []
+    for move in moves: #replay to get each move's SAN in its own position, leaving gs as it was
+        sans.append(gs.getSAN(move))
+        gs.makeMove(move, checkForGameEnd=False)
+    gs.getValidMoves() #restores the checkmate / stalemate flags of the final position
+    if result is None:
+        result = gameResult(gs)
+
+    allTags = {"Event": "?", "Site": "?", "Date": "????.??.??", "Round": "?", "White": "?", "Black": "?"}
+    allTags.update(tags or {})
+    allTags["Result"] = result
+    if startFEN != STARTING_FEN:
+        allTags["SetUp"] = "1"
+        allTags["FEN"] = startFEN
+    lines = []
+    for name in SEVEN_TAG_ROSTER + tuple(name for name in allTags if name not in SEVEN_TAG_ROSTER):
+        value = str(allTags[name]).replace('\\', '\\\\').replace('"', '\\"')
+        lines.append('[%s "%s"]' % (name, value))
+    lines.append("")
+
+    tokens = []
+    number = firstNumber
+    for i, san in enumerate(sans):
+        whiteMove = (i % 2 == 0) != blackFirst
+        if whiteMove:
+            tokens.append("%d." % number)
+        elif i == 0:
+            tokens.append("%d..." % number)
+        tokens.append(san)
+        if not whiteMove:
+            number += 1
+    tokens.append(result)
+    line = ""
+    for token in tokens: #export format keeps lines under 80 characters
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
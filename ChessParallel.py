@@ -0,0 +1,172 @@
+#Spread perft and search over several processes by splitting at the root: every root move's subtree is one task.
+#Positions go to the workers as a small packed tuple (see packPosition), not as a pickled GameState with its logs.
+#Run: python ChessPerft.py --depth 5 --workers 8, or parallelSearch(gs, SearchLimits(depth=6), workers=8)
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessEngine
+import ChessPerft
+import ChessSearch
+
+PIECE_LETTERS = {'--': '.', 'wP': 'P', 'wN': 'N', 'wB': 'B', 'wR': 'R', 'wQ': 'Q', 'wK': 'K',
+                 'bP': 'p', 'bN': 'n', 'bB': 'b', 'bR': 'r', 'bQ': 'q', 'bK': 'k'}
+LETTER_PIECES = {letter: piece for piece, letter in PIECE_LETTERS.items()}
+
+def packPosition(gs):
+    #(64 character board, side to move, castle rights, en passant square, halfmove clock, move number,
+    #Zobrist keys of the game so far). The keys let the worker see repetitions of positions played before the split
+    board = ''.join(PIECE_LETTERS[piece] for row in gs.board for piece in row)
+    return (board, gs.whiteToMove, gs.castleRightsLog[-1], gs.enpassantPossible, gs.halfmoveClock,
+            gs.fullmoveNumber, tuple(gs.zobristKeyLog))
+
+def unpackPosition(packed, stateClass=ChessEngine.GameState):
+    boardText, whiteToMove, castleRights, enpassantPossible, halfmoveClock, fullmoveNumber, keys = packed
+    board = [[LETTER_PIECES[letter] for letter in boardText[r * 8:r * 8 + 8]] for r in range(8)]
+    gs = stateClass()
+    gs.setPosition(board, whiteToMove, castleRights, enpassantPossible, halfmoveClock, fullmoveNumber)
+    gs.zobristKeyLog = list(keys)
+    gs.repetitionCounts = {}
+    for key in keys:
+        gs.repetitionCounts[key] = gs.repetitionCounts.get(key, 0) + 1
+    return gs
+
+def defaultWorkers():
+    return os.cpu_count() or 1
+
+def _playRootMove(packed, moveCode, stateClass):
+    gs = unpackPosition(packed, stateClass)
+    move = next((legal for legal in gs.getValidMoves() if legal.code == moveCode), None)
+    if move is None:
+        raise ValueError("move %d is not legal in the packed position" % moveCode)
+    gs.makeMove(move, checkForGameEnd=False)
+    return gs, move
+
+
+#Perft
+
+def _perftTask(packed, moveCode, depth, stateClass):
+    gs, move = _playRootMove(packed, moveCode, stateClass)
+    return move.getLongNotation(), ChessPerft.perft(gs, depth - 1)
+
+def parallelDivide(gs, depth, workers=None, executor=None):
+    #[(root move, nodes)] in generation order, like ChessPerft.divide
+    moves = gs.getValidMoves()
+    if depth < 1 or not moves:
+        return []
+    packed = packPosition(gs)
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = ProcessPoolExecutor(max_workers=workers or defaultWorkers())
+    try:
+        futures = [executor.submit(_perftTask, packed, move.code, depth, type(gs)) for move in moves]
+        return [future.result() for future in futures]
+    finally:
+        if ownExecutor:
+            executor.shutdown()
+
+def parallelPerft(gs, depth, workers=None, executor=None):
+    if depth < 1:
+        return 1
+    return sum(nodes for _, nodes in parallelDivide(gs, depth, workers, executor))
+
+
+#Search
+
+_workerSearcher = None #one per worker process, so its transposition table carries over between tasks
+
+def _searchTask(packed, moveCode, depth, movetime, nodes, hashMB, stateClass):
+    global _workerSearcher
+    if _workerSearcher is None or _workerSearcher.tt.sizeMB != hashMB:
+        _workerSearcher = ChessSearch.Searcher(hashMB)
+    #(move code, score, completed depth or None if the budget ran out first, nodes, PV codes)
+    gs, move = _playRootMove(packed, moveCode, stateClass)
+    if gs.repetitionCounts[gs.zobristKey] >= 2:
+        return moveCode, 0, depth - 1, 1, [] #the serial search scores a repetition one ply in as a draw too
+    limits = ChessSearch.SearchLimits(depth=depth - 1, movetime=movetime, nodes=nodes)
+    if depth <= 1: #one ply in the serial search goes straight to quiescence after the root move
+        score = _workerSearcher.quiescenceSearch(gs, limits)
+        return moveCode, score, 0 if score is not None else None, _workerSearcher.nodes + 1, [] #+1: gs itself
+    result = _workerSearcher.search(gs, limits)
+    return (moveCode, result.score, result.depth if result.depth > 0 else None, result.nodes,
+            [reply.code for reply in result.pv])
+
+def _fromChild(score):
+    #Negate a score from the side that replied, and count the extra ply for mate distances
+    score = -score
+    if score >= ChessSearch.MATE_BOUND:
+        return score - 1
+    if score <= -ChessSearch.MATE_BOUND:
+        return score + 1
+    return score
+
+def parallelSearch(gs, limits=None, workers=None, executor=None, hashMB=16):
+    #Root split: every root move is searched one ply shallower in its own task and the best reply score wins.
+    #A movetime or node budget is shared out so the whole search stays within it: each task gets
+    #the budget times the number of workers divided by the number of root moves.
+    #Each task searches with a full window and no alpha from its siblings, so scores are exact but nothing is
+    #pruned across root moves. A task that ran out of budget before finishing its first iteration (or its
+    #quiescence search, for a depth 1 search) has no score and is left out; result.depth is one more than the
+    #smallest depth every remaining task completed, the same depth the serial search reports
+    limits = limits or ChessSearch.SearchLimits()
+    start = time.perf_counter()
+    result = ChessSearch.SearchResult()
+    moves = gs.getValidMoves()
+    if not moves:
+        result.score = -ChessSearch.MATE_SCORE if gs.checkmate else 0
+        return result
+    workers = workers or defaultWorkers()
+    rounds = max(1.0, len(moves) / workers)
+    movetime = limits.movetime / rounds if limits.movetime is not None else None
+    nodes = max(1, int(limits.nodes / len(moves))) if limits.nodes is not None else None
+    depth = limits.depth if limits.depth < ChessSearch.MAX_PLY else ChessSearch.MAX_PLY
+    if depth < 1: #no iteration to run, like the serial search
+        result.bestMove = moves[0]
+        return result
+
+    packed = packPosition(gs)
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(_searchTask, packed, move.code, depth, movetime, nodes, hashMB, type(gs))
+                   for move in moves]
+        outcomes = [future.result() for future in futures]
+    finally:
+        if ownExecutor:
+            executor.shutdown()
+
+    byCode = {move.code: move for move in moves}
+    bestScore = -ChessSearch.INFINITY
+    completedDepth = None
+    for moveCode, score, childDepth, childNodes, pvCodes in outcomes:
+        result.nodes += childNodes
+        if childDepth is None:
+            continue
+        score = _fromChild(score)
+        completedDepth = childDepth if completedDepth is None else min(completedDepth, childDepth)
+        if score > bestScore:
+            bestScore = score
+            result.bestMove = byCode[moveCode]
+            result.pv = [result.bestMove] + _pvMoves(gs, result.bestMove, pvCodes)
+    if completedDepth is None: #no task finished an iteration, play something legal like the serial search
+        result.bestMove = moves[0]
+    else:
+        result.score = bestScore
+        result.depth = completedDepth + 1
+    result.seconds = time.perf_counter() - start
+    return result
+
+def _pvMoves(gs, firstMove, codes):
+    #Turn the worker's PV codes back into Move objects by playing them out on gs
+    moves = []
+    gs.makeMove(firstMove, checkForGameEnd=False)
+    for code in codes:
+        move = next((legal for legal in gs.getValidMoves() if legal.code == code), None)
+        if move is None:
+            break
+        moves.append(move)
+        gs.makeMove(move, checkForGameEnd=False)
+    for _ in range(len(moves) + 1):
+        gs.undoMove()
+    return moves
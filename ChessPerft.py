@@ -0,0 +1,137 @@
+#Perft (performance test): count every leaf of the legal move tree and compare against published node counts.
+#Run: python ChessPerft.py --depth 4 [--position kiwipete] [--epd perftsuite.epd] [--divide] [--json] [--bitboard] [--workers 8]
+import argparse
+import itertools
+import json
+import sys
+import time
+
+import ChessEngine
+import ChessEPD
+
+#(name, FEN, node counts for depth 1, 2, 3 ...) from the chessprogramming wiki perft results page
+POSITIONS = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603, 193690690]),
+    ("enpassant", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ("promotion", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("promotion2", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487, 89941194]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594, 164075551]),
+]
+
+def perft(gs, depth):
+    moves = gs.getValidMoves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1 #bulk count the last ply
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move, checkForGameEnd=False)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+def divide(gs, depth):
+    #Node count below each root move, the usual way to find which move a generator bug hides under
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move, checkForGameEnd=False)
+        results.append((move.getLongNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+def runPosition(name, fen, expected, maxDepth, stateClass, showDivide, asJson, out, executor=None):
+    #executor: a ChessParallel process pool to split each depth at the root moves, None to count in this process
+    gs = stateClass.fromFEN(fen)
+    allOk = True
+    if not asJson:
+        out.write("%s  %s  (%s)\n" % (name, fen, stateClass.__name__))
+    for depth in range(1, maxDepth + 1):
+        start = time.perf_counter()
+        if executor is not None:
+            import ChessParallel
+            split = ChessParallel.parallelDivide(gs, depth, executor=executor)
+            nodes = sum(count for _, count in split)
+            if not (showDivide and depth == maxDepth):
+                split = None
+        elif showDivide and depth == maxDepth:
+            split = divide(gs, depth)
+            nodes = sum(count for _, count in split)
+        else:
+            split = None
+            nodes = perft(gs, depth)
+        seconds = time.perf_counter() - start
+        known = expected[depth - 1] if depth <= len(expected) else None
+        ok = known is None or nodes == known
+        allOk = allOk and ok
+        nps = nodes / seconds if seconds > 0 else 0.0
+        if asJson:
+            record = {"position": name, "backend": stateClass.__name__, "depth": depth, "nodes": nodes,
+                      "expected": known, "ok": ok, "seconds": round(seconds, 6), "nps": round(nps)}
+            if split is not None:
+                record["divide"] = dict(split)
+            out.write(json.dumps(record) + "\n")
+        else:
+            if split is not None:
+                for notation, count in sorted(split):
+                    out.write("    %s: %d\n" % (notation, count))
+            status = "ok" if known is not None and ok else ("--" if known is None else "FAIL expected %d" % known)
+            out.write("  depth %d %12d nodes %9.3fs %10.0f nps  %s\n" % (depth, nodes, seconds, nps, status))
+    return allOk
+
+def epdPositions(path):
+    #(name, FEN, expected counts) from a perft suite, streamed line by line
+    for number, (fen, operations) in enumerate(ChessEPD.readEPD(path), 1):
+        expected = []
+        while ("D%d" % (len(expected) + 1)) in operations:
+            expected.append(int(operations["D%d" % (len(expected) + 1)][0]))
+        name = operations["id"][0] if operations.get("id") else "%s:%d" % (path, number)
+        yield name, fen, expected
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft node counts and move generation speed")
+    parser.add_argument("--depth", type=int, default=3, help="maximum depth to search (default 3)")
+    parser.add_argument("--position", action="append",
+                        help="name of a standard position (%s) or a FEN, can be repeated" % ", ".join(p[0] for p in POSITIONS))
+    parser.add_argument("--epd", action="append",
+                        help="EPD file of positions with expected counts as ;D1 20 ;D2 400 operations, can be repeated")
+    parser.add_argument("--divide", action="store_true", help="print node counts per root move at the last depth")
+    parser.add_argument("--json", action="store_true", help="one JSON object per line instead of text")
+    parser.add_argument("--bitboard", action="store_true", help="use the ChessBitboard backend")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="split each count at the root moves over this many processes (default 0: single process)")
+    args = parser.parse_args(argv)
+
+    stateClass = ChessEngine.GameState
+    if args.bitboard:
+        import ChessBitboard
+        stateClass = ChessBitboard.BitboardGameState
+
+    named = {name: (name, fen, expected) for name, fen, expected in POSITIONS}
+    positions = [named[p] if p in named else ("custom", p, []) for p in args.position or []]
+    if args.epd:
+        positions = itertools.chain(positions, *(epdPositions(path) for path in args.epd))
+    elif not args.position:
+        positions = POSITIONS
+
+    executor = None
+    if args.workers > 0:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+    allOk = True
+    try:
+        for name, fen, expected in positions:
+            allOk = runPosition(name, fen, expected, args.depth, stateClass, args.divide, args.json, sys.stdout,
+                                executor) and allOk
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return 0 if allOk else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
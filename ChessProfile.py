@@ -0,0 +1,118 @@
+#Engine instrumentation: call counts and cumulative / worst-case time of the main GameState methods.
+#Nothing is measured until enable(), which swaps timing wrappers in for the methods on the classes; disable() puts
+#the original functions back, so a disabled profiler costs nothing at all. "seconds" is inclusive (getValidMoves
+#contains its generateValidMoves and attackMap calls), "selfSeconds" leaves out the other instrumented calls
+#inside, so the selfSeconds of all methods add up to the time spent in them. A method reached again inside itself,
+#like a subclass override calling the method it overrides, is counted once.
+#Move generation is split differently by the backends: GameState collects pseudo-legal moves in
+#getAllPossibleMoves, BitboardGameState generates everything but the king in generatePieceMoves, so each backend
+#leaves the other one's row at 0. attackMap counts every lookup, computeAttackMap the ones that built a new map.
+#  ChessProfile.enable(); ...; print(ChessProfile.toJSON()); ChessProfile.disable()
+import functools
+import json
+import threading
+import time
+
+import ChessEngine
+
+INSTRUMENTED = ("makeMove", "undoMove", "getValidMoves", "generateValidMoves", "getAllPossibleMoves",
+                "generatePieceMoves", "attackMap", "computeAttackMap", "isCheckmate", "isStalemate")
+
+_stats = {name: [0, 0.0, 0.0, 0.0] for name in INSTRUMENTED} #name -> [calls, seconds, self seconds, slowest call]
+_originals = {} #(class, name) -> the function the wrapper replaced
+_lock = threading.Lock() #the UI and the engine worker thread both make moves
+_active = threading.local() #names being timed on this thread, and "_children": time of the calls inside each of them
+
+def _wrap(name, function):
+    stats = _stats[name]
+    clock = time.perf_counter
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        active = _active.__dict__
+        if active.get(name):
+            return function(*args, **kwargs)
+        active[name] = True
+        children = active.setdefault("_children", [])
+        children.append(0.0)
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            active[name] = False
+            own = elapsed - children.pop()
+            if children:
+                children[-1] += elapsed
+            with _lock:
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] += own
+                if elapsed > stats[3]:
+                    stats[3] = elapsed
+    return timed
+
+def _stateClasses():
+    #GameState and every subclass imported so far (ChessBitboard only once something loaded it)
+    classes = [ChessEngine.GameState]
+    for cls in classes:
+        classes.extend(sub for sub in cls.__subclasses__() if sub not in classes)
+    return classes
+
+def enable(classes=None):
+    #Start measuring the INSTRUMENTED methods of classes (default: GameState and its subclasses)
+    for cls in classes or _stateClasses():
+        for name in INSTRUMENTED:
+            if name in cls.__dict__ and (cls, name) not in _originals:
+                _originals[(cls, name)] = cls.__dict__[name]
+                setattr(cls, name, _wrap(name, cls.__dict__[name]))
+
+def disable():
+    for (cls, name), function in _originals.items():
+        setattr(cls, name, function)
+    _originals.clear()
+
+def isEnabled():
+    return bool(_originals)
+
+def reset():
+    with _lock:
+        for stats in _stats.values():
+            stats[:] = [0, 0.0, 0.0, 0.0]
+
+def snapshot():
+    #{name: {"calls", "seconds", "selfSeconds", "maxSeconds"}}, a copy that later calls don't change
+    with _lock:
+        return {name: {"calls": calls, "seconds": seconds, "selfSeconds": own, "maxSeconds": slowest}
+                for name, (calls, seconds, own, slowest) in _stats.items()}
+
+def difference(after, before):
+    #Calls and seconds between two snapshots; maxSeconds is the worst call since the profiler was reset
+    return {name: {"calls": stats["calls"] - before[name]["calls"], "seconds": stats["seconds"] - before[name]["seconds"],
+                   "selfSeconds": stats["selfSeconds"] - before[name]["selfSeconds"], "maxSeconds": stats["maxSeconds"]}
+            for name, stats in after.items()}
+
+def totalSeconds(stats):
+    #Time spent in the instrumented methods, nested calls counted once
+    return sum(entry["selfSeconds"] for entry in stats.values())
+
+def toJSON(stats=None, indent=None):
+    #JSON of a snapshot (the current one by default), with the enabled flag
+    return json.dumps({"enabled": isEnabled(), "methods": stats if stats is not None else snapshot()}, indent=indent)
+
+def dump(path, stats=None):
+    with open(path, "w") as f:
+        f.write(toJSON(stats, indent=2) + "\n")
+
+def formatTable(stats=None):
+    #Text lines: name, calls, total and self ms, microseconds per call, slowest call in ms
+    stats = stats if stats is not None else snapshot()
+    lines = ["%-20s %9s %10s %9s %9s %9s" % ("method", "calls", "total ms", "self ms", "us/call", "max ms")]
+    for name in INSTRUMENTED:
+        entry = stats[name]
+        calls, seconds = entry["calls"], entry["seconds"]
+        lines.append("%-20s %9d %10.1f %9.1f %9.1f %9.2f" % (name, calls, seconds * 1000, entry["selfSeconds"] * 1000,
+                                                            seconds / calls * 1e6 if calls else 0.0,
+                                                            entry["maxSeconds"] * 1000))
+    lines.append("%-20s %9s %10s %9.1f" % ("all", "", "", totalSeconds(stats) * 1000))
+    return lines
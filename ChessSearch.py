@@ -0,0 +1,299 @@
+#Pick moves: negamax alpha-beta with iterative deepening, quiescence search and killer/history move ordering.
+#bestMove(gs, SearchLimits(movetime=2.0)) returns the move, search() also returns depth, nodes, nps and the PV.
+#With endgame tablebases (ChessTablebase.Tablebases) positions they cover are scored exactly instead of searched.
+import threading
+import time
+
+import ChessTransposition
+from ChessTransposition import EXACT, LOWER, UPPER
+
+MATE_SCORE = 100000
+MAX_PLY = 64
+INFINITY = MATE_SCORE + 1
+#Scores at least this far from 0 are mates. Wider than MAX_PLY: tablebase mates add their distance to mate
+#(up to a few hundred plies) to the ply they were probed at
+MATE_BOUND = MATE_SCORE - 1000
+TABLEBASE_PHASE = 8 #no ending in the tables has more than two queens, so positions above this phase aren't probed
+
+PIECE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+#Attacker/victim ranks for MVV-LVA: take the most valuable victim with the least valuable attacker first
+ORDER_RANK = {'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+
+def evaluate(gs):
+    #The engine's incrementally updated material + piece-square score, from the side to move's point of view
+    score = gs.evaluate()
+    return score if gs.whiteToMove else -score
+
+
+class SearchLimits():
+    def __init__(self, depth=None, movetime=None, nodes=None, stop=None):
+        self.depth = depth if depth is not None else MAX_PLY #iterations to complete
+        self.movetime = movetime #seconds of wall clock, None for no limit
+        self.nodes = nodes #node budget, None for no limit
+        #threading.Event owned by the caller: the search stops once it is set, even if it was set before the
+        #search started. None gives the search its own, set by Searcher.stop()
+        self.stop = stop
+
+
+class SearchResult():
+    def __init__(self):
+        self.bestMove = None
+        self.score = 0 #centipawns for the side to move, +/- MATE_SCORE - plies for mates
+        self.depth = 0 #last fully searched depth
+        self.nodes = 0
+        self.seconds = 0.0
+        self.pv = []
+        self.hashfull = 0.0 #transposition table fill rate
+        self.tbHits = 0 #positions scored from the tablebases
+
+    def nps(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def getInfoString(self):
+        return "depth %d score %d nodes %d nps %d time %.2fs hashfull %d pv %s" % (
+            self.depth, self.score, self.nodes, self.nps(), self.seconds, int(self.hashfull * 1000),
+            " ".join(move.getLongNotation() for move in self.pv))
+
+
+class SearchAborted(Exception):
+    pass
+
+
+def scoreToTable(score, ply):
+    #Mate scores are stored as distance from this node, not from the root, so they stay right wherever the node is reached
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Searcher():
+    def __init__(self, hashMB=16, tablebases=None):
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+        self.stopToken = threading.Event()
+        self.tt = ChessTransposition.TranspositionTable(hashMB) #kept between searches, aged by newSearch()
+        self.tablebases = tablebases
+
+    def stop(self):
+        #Safe to call from another thread, the running search notices at its next node check. A search that has
+        #not started yet won't see it: pass SearchLimits(stop=...) to be able to stop a search before it starts
+        self.stopToken.set()
+
+    def startSearch(self, limits):
+        #Reset the counters, limits and move ordering tables for a new search
+        limits = limits or SearchLimits()
+        self.limits = limits
+        self.nodes = 0
+        self.tbHits = 0
+        self.stopToken = limits.stop if limits.stop is not None else threading.Event()
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + limits.movetime if limits.movetime is not None else None
+        self.nodeLimit = limits.nodes if limits.nodes is not None else float('inf')
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+        self.pvTable = [[] for _ in range(MAX_PLY + 2)]
+        self.tt.newSearch()
+        return limits
+
+    def quiescenceSearch(self, gs, limits=None):
+        #Score of gs from the quiescence search alone (a depth 0 search), None if the limits stopped it first.
+        #ChessParallel scores root moves with it when the whole search is only one ply deep
+        self.startSearch(limits)
+        rootLength = len(gs.moveLog)
+        rootFlags = (gs.checkmate, gs.stalemate)
+        try:
+            score = self.quiescence(gs, -INFINITY, INFINITY, 0)
+        except SearchAborted:
+            while len(gs.moveLog) > rootLength:
+                gs.undoMove()
+            score = None
+        gs.checkmate, gs.stalemate = rootFlags
+        return score
+
+    def search(self, gs, limits=None, report=None):
+        limits = self.startSearch(limits)
+        rootLength = len(gs.moveLog)
+        rootFlags = (gs.checkmate, gs.stalemate)
+
+        result = SearchResult()
+        rootMoves = gs.getValidMoves()
+        if rootMoves:
+            result.bestMove = rootMoves[0] #something to play even if the first iteration can't finish
+        previousPv = []
+        for depth in range(1, limits.depth + 1):
+            if self.stopToken.is_set(): #small iterations may never reach a node check
+                break
+            try:
+                score = self.negamax(gs, depth, -INFINITY, INFINITY, 0, previousPv)
+            except SearchAborted:
+                while len(gs.moveLog) > rootLength: #unwind the moves the aborted iteration left on the board
+                    gs.undoMove()
+                break
+            previousPv = self.pvTable[0][:]
+            result.depth = depth
+            result.score = score
+            result.pv = previousPv
+            if previousPv:
+                result.bestMove = previousPv[0]
+            result.nodes = self.nodes
+            result.tbHits = self.tbHits
+            result.seconds = time.perf_counter() - self.startTime
+            result.hashfull = self.tt.fillRate()
+            if report is not None:
+                report(result)
+            if abs(score) >= MATE_BOUND or len(rootMoves) <= 1:
+                break #a forced mate or a forced move won't change with more depth
+            if self.deadline is not None and time.perf_counter() > self.startTime + (self.deadline - self.startTime) / 2:
+                break #the next iteration would most likely not finish
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - self.startTime
+        gs.checkmate, gs.stalemate = rootFlags
+        return result
+
+    def checkLimits(self):
+        #Node budget is checked on every node, the clock and stop flag every 256 nodes
+        if self.nodes >= self.nodeLimit:
+            raise SearchAborted()
+        if self.nodes & 255 == 0:
+            if self.stopToken.is_set() or (self.deadline is not None and time.perf_counter() >= self.deadline):
+                raise SearchAborted()
+
+    def negamax(self, gs, depth, alpha, beta, ply, previousPv):
+        self.nodes += 1
+        self.checkLimits()
+        self.pvTable[ply] = []
+        if ply > 0 and gs.repetitionCounts[gs.zobristKey] >= 2:
+            return 0 #repeating a position is a draw as far as the search cares
+        if ply > 0 and self.tablebases is not None and gs.phase <= TABLEBASE_PHASE:
+            probed = self.tablebases.probe(gs)
+            if probed is not None:
+                self.tbHits += 1
+                wdl, plies = probed
+                return wdl * (MATE_SCORE - ply - plies) #a mate score like the search's own, 0 for draws
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        key = gs.zobristKey
+        entry = self.tt.probe(key)
+        hashMoveCode = 0
+        if entry is not None:
+            hashMoveCode, entryDepth, bound, entryScore = entry
+            if ply > 0 and entryDepth >= depth:
+                entryScore = scoreFromTable(entryScore, ply)
+                if bound == EXACT or (bound == LOWER and entryScore >= beta) or (bound == UPPER and entryScore <= alpha):
+                    return entryScore
+
+        moves = gs.getValidMoves()
+        if not moves:
+            return -(MATE_SCORE - ply) if gs.checkmate else 0
+        pvMove = previousPv[ply] if ply < len(previousPv) else None
+        self.orderMoves(moves, ply, pvMove, ChessTransposition.findMove(moves, hashMoveCode))
+
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = None
+        for move in moves:
+            gs.makeMove(move, checkForGameEnd=False)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1, previousPv if move == pvMove else [])
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
+                    bestMove = move
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                    if alpha >= beta:
+                        if move.pieceCaptured == "--":
+                            self.storeKiller(move, ply)
+                            historyKey = (move.pieceMoved, move.endRow, move.endCol)
+                            self.history[historyKey] = self.history.get(historyKey, 0) + depth * depth
+                        break
+
+        if bestScore <= originalAlpha:
+            bound = UPPER
+        elif bestScore >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, bound, scoreToTable(bestScore, ply),
+                      bestMove.code if bestMove is not None else 0)
+        return bestScore
+
+    def quiescence(self, gs, alpha, beta, ply):
+        #Only captures and promotions, so the static evaluation is never taken in the middle of an exchange.
+        #In check there is no standing pat: every evasion is searched, and having none is mate. Out of check a side
+        #without legal moves is stalemated; that is only looked for once standing pat hasn't already failed high
+        #(a stalemated side is rarely the one ahead), which spares the move generation at most quiescence nodes
+        if gs.inCheck():
+            moves = list(gs.getValidMoves())
+            if not moves:
+                return -(MATE_SCORE - ply)
+            if ply >= MAX_PLY:
+                return evaluate(gs)
+        else:
+            standPat = evaluate(gs)
+            if standPat >= beta:
+                return standPat
+            legalMoves = gs.getValidMoves()
+            if not legalMoves:
+                return 0
+            if standPat > alpha:
+                alpha = standPat
+            if ply >= MAX_PLY:
+                return standPat
+            moves = [move for move in legalMoves if move.pieceCaptured != "--" or move.isPawnPromotion]
+        self.orderMoves(moves, ply, None, None)
+        for move in moves:
+            self.nodes += 1
+            self.checkLimits()
+            gs.makeMove(move, checkForGameEnd=False)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def orderMoves(self, moves, ply, pvMove, hashMove):
+        killers = self.killers[ply]
+        history = self.history
+
+        def moveScore(move):
+            if pvMove is not None and move == pvMove:
+                return 10000000
+            if hashMove is not None and move == hashMove:
+                return 9000000
+            if move.pieceCaptured != "--":
+                return 1000000 + 10 * ORDER_RANK[move.pieceCaptured[1]] - ORDER_RANK[move.pieceMoved[1]]
+            if move.isPawnPromotion:
+                return 900000 + PIECE_VALUES[move.promotionChoice]
+            if move == killers[0]:
+                return 800000
+            if move == killers[1]:
+                return 700000
+            return history.get((move.pieceMoved, move.endRow, move.endCol), 0)
+
+        moves.sort(key=moveScore, reverse=True)
+
+    def storeKiller(self, move, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+
+def search(gs, limits=None, report=None):
+    return Searcher().search(gs, limits, report)
+
+def bestMove(gs, limits=None, report=None):
+    return search(gs, limits, report).bestMove
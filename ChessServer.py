@@ -0,0 +1,288 @@
+#Asyncio multiplayer server. Clients connect over TCP and exchange one JSON object per line:
+#  {"op": "create"}                         -> {"op": "created", "game": 7, "color": "w"}
+#  {"op": "join", "game": 7}                -> {"op": "joined", "game": 7, "color": "b" (or "spectator" if both seats are taken), "moves": [...]}
+#  {"op": "spectate", "game": 7}            -> {"op": "joined", "game": 7, "color": "spectator", "moves": [...]}
+#  {"op": "move", "game": 7, "move": "e2e4"} -> {"op": "moved", "game": 7, "move": "e2e4", "ply": 1[, "result": "1-0", "reason": "checkmate"]} to everyone in the game
+#  {"op": "resign", "game": 7}, {"op": "state", "game": 7} (FEN and moves), {"op": "list"} (games waiting for a player), {"op": "stats"}
+#Mistakes are answered with {"op": "error", "message": ...}. Moves are in long notation and checked against the legal moves on the server.
+#Only the most recently played games keep a GameState; the others are held as a packed position and a move code array
+#Run: python ChessServer.py [--host 0.0.0.0] [--port 5000] [--live 256]
+import argparse
+import asyncio
+import itertools
+import json
+import resource
+import sys
+from array import array
+from collections import OrderedDict
+
+import ChessEngine
+import ChessPGN
+from ChessParallel import packPosition, unpackPosition
+
+DEFAULT_PORT = 5000
+LIVE_GAMES = 256 #GameStates kept in memory (a few hundred KB each once their logs fill up), least recently moved ones are packed away first
+MAX_LISTED = 100
+FILES = "abcdefgh"
+
+
+class GameRecord():
+    #Everything the server keeps for a game between moves: a few references and two compact arrays
+    __slots__ = ("gameId", "white", "black", "spectators", "moves", "packed", "result")
+
+    def __init__(self, gameId, white):
+        self.gameId = gameId
+        self.white = white
+        self.black = None
+        self.spectators = None #set of connections, created for the first spectator
+        self.moves = array('H') #Move.code of every move played
+        self.packed = None #packPosition() of the current position while no GameState is live, None for the start position
+        self.result = None
+
+    def connections(self):
+        players = [player for player in (self.white, self.black) if player is not None]
+        return players + list(self.spectators) if self.spectators else players
+
+
+class Connection():
+    __slots__ = ("writer", "games")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.games = set()
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+def codeToNotation(code):
+    startSq, endSq, promotionChoice = ChessEngine.decodeMove(code)
+    notation = FILES[startSq & 7] + str(8 - (startSq >> 3)) + FILES[endSq & 7] + str(8 - (endSq >> 3))
+    return notation + promotionChoice.lower() if promotionChoice else notation
+
+def notationToCode(text):
+    if not ChessEngine.LONG_NOTATION_PATTERN.match(text):
+        raise ValueError("moves are sent in long notation like e2e4 or e7e8q, not %r" % text)
+    startSq = (8 - int(text[1])) * 8 + FILES.index(text[0])
+    endSq = (8 - int(text[3])) * 8 + FILES.index(text[2])
+    return ChessEngine.encodeMove(startSq, endSq, text[4].upper() if len(text) == 5 else None)
+
+def encodeMessage(message):
+    return (json.dumps(message, separators=(',', ':')) + "\n").encode()
+
+
+class ChessServer():
+    def __init__(self, liveGames=LIVE_GAMES, stateClass=ChessEngine.GameState):
+        self.liveGames = liveGames
+        self.stateClass = stateClass
+        self.games = {}
+        self.live = OrderedDict() #gameId -> GameState, most recently moved last
+        self.gameIds = itertools.count(1)
+        self.connectionCount = 0
+        self.movesPlayed = 0
+        self.handlers = {"create": self.create, "join": self.join, "spectate": self.spectate, "move": self.move,
+                         "resign": self.resign, "state": self.state, "list": self.listGames, "stats": self.stats}
+
+    async def handleConnection(self, reader, writer):
+        connection = Connection(writer)
+        self.connectionCount += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.handleLine(connection, line)
+                await writer.drain()
+        except (ConnectionError, ValueError): #ValueError: a line over the stream limit
+            pass
+        finally:
+            self.connectionCount -= 1
+            self.disconnect(connection)
+            writer.close()
+
+    def handleLine(self, connection, line):
+        try:
+            message = json.loads(line)
+            if not isinstance(message, dict):
+                raise ValueError("messages are JSON objects")
+            op = message.get("op")
+            handler = self.handlers.get(op) if isinstance(op, str) else None
+            if handler is None:
+                raise ValueError("unknown op %r" % (op,))
+            handler(connection, message)
+        except ValueError as e: #json.JSONDecodeError is a ValueError as well
+            connection.send(encodeMessage({"op": "error", "message": str(e)}))
+
+    def findGame(self, message):
+        gameId = message.get("game")
+        #Game ids are ints; anything else (a list, an object ...) is not even a valid dict key
+        record = self.games.get(gameId) if isinstance(gameId, int) and not isinstance(gameId, bool) else None
+        if record is None:
+            raise ValueError("no game %r" % (gameId,))
+        return record
+
+    def gameState(self, record):
+        #The live GameState of a game, unpacked again if it was packed away
+        gs = self.live.get(record.gameId)
+        if gs is not None:
+            self.live.move_to_end(record.gameId)
+            return gs
+        gs = unpackPosition(record.packed, self.stateClass) if record.packed is not None else self.stateClass()
+        record.packed = None
+        self.live[record.gameId] = gs
+        if len(self.live) > self.liveGames:
+            oldId, oldState = self.live.popitem(last=False)
+            self.games[oldId].packed = self.pack(oldState)
+        return gs
+
+    def pack(self, gs):
+        #Repetitions can only go back to the last capture or pawn move, so older position keys are dropped
+        packed = packPosition(gs)
+        return packed[:-1] + (array('Q', packed[-1][-(gs.halfmoveClock + 1):]),)
+
+    def retire(self, record):
+        #Finished games don't need a GameState any more
+        gs = self.live.pop(record.gameId, None)
+        if gs is not None:
+            record.packed = self.pack(gs)
+
+    def broadcast(self, record, message):
+        data = encodeMessage(message)
+        for connection in record.connections():
+            connection.send(data)
+
+    def joinedMessage(self, record, color):
+        return {"op": "joined", "game": record.gameId, "color": color,
+                "moves": [codeToNotation(code) for code in record.moves], "result": record.result}
+
+    #Requests
+
+    def create(self, connection, message):
+        record = GameRecord(next(self.gameIds), connection)
+        self.games[record.gameId] = record
+        connection.games.add(record.gameId)
+        connection.send(encodeMessage({"op": "created", "game": record.gameId, "color": "w"}))
+
+    def join(self, connection, message):
+        record = self.findGame(message)
+        if record.black is not None or record.white is connection or record.result is not None:
+            self.spectate(connection, message)
+            return
+        record.black = connection
+        connection.games.add(record.gameId)
+        connection.send(encodeMessage(self.joinedMessage(record, "b")))
+        record.white.send(encodeMessage({"op": "opponent", "game": record.gameId}))
+
+    def spectate(self, connection, message):
+        record = self.findGame(message)
+        if record.spectators is None:
+            record.spectators = set()
+        record.spectators.add(connection)
+        connection.games.add(record.gameId)
+        connection.send(encodeMessage(self.joinedMessage(record, "spectator")))
+
+    def move(self, connection, message):
+        record = self.findGame(message)
+        if record.result is not None:
+            raise ValueError("game %d is over" % record.gameId)
+        if record.black is None:
+            raise ValueError("game %d has no opponent yet" % record.gameId)
+        gs = self.gameState(record)
+        if connection is not (record.white if gs.whiteToMove else record.black):
+            raise ValueError("not your move in game %d" % record.gameId)
+        text = str(message.get("move", ""))
+        code = notationToCode(text)
+        move = next((legal for legal in gs.getValidMoves() if legal.code == code), None)
+        if move is None:
+            raise ValueError("illegal move %r in game %d" % (text, record.gameId))
+        gs.makeMove(move) #also generates the reply moves, which the next move request finds cached
+        record.moves.append(code)
+        self.movesPlayed += 1
+        reply = {"op": "moved", "game": record.gameId, "move": text, "ply": len(record.moves)}
+        result = ChessPGN.gameResult(gs)
+        if result != "*":
+            record.result = reply["result"] = result
+            reply["reason"] = ("checkmate" if gs.checkmate else "stalemate" if gs.stalemate else
+                               "fifty moves" if gs.isFiftyMove() else "repetition")
+            self.retire(record)
+        self.broadcast(record, reply)
+
+    def resign(self, connection, message):
+        record = self.findGame(message)
+        if connection not in (record.white, record.black) or record.result is not None:
+            raise ValueError("nothing to resign in game %d" % record.gameId)
+        record.result = "0-1" if connection is record.white else "1-0"
+        self.retire(record)
+        self.broadcast(record, {"op": "result", "game": record.gameId, "result": record.result, "reason": "resignation"})
+
+    def state(self, connection, message):
+        record = self.findGame(message)
+        if record.gameId in self.live or record.packed is None:
+            fen = self.gameState(record).toFEN()
+        else:
+            fen = unpackPosition(record.packed, self.stateClass).toFEN() #don't make a finished or idle game live
+        connection.send(encodeMessage({"op": "state", "game": record.gameId, "fen": fen, "result": record.result,
+                                       "moves": [codeToNotation(code) for code in record.moves]}))
+
+    def listGames(self, connection, message):
+        waiting = [gameId for gameId, record in self.games.items() if record.black is None and record.result is None]
+        connection.send(encodeMessage({"op": "games", "waiting": waiting[:MAX_LISTED]}))
+
+    def stats(self, connection, message):
+        connection.send(encodeMessage({"op": "stats", "games": len(self.games), "live": len(self.live),
+                                       "connections": self.connectionCount, "moves": self.movesPlayed,
+                                       "maxRssKB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+    def disconnect(self, connection):
+        #A player who leaves a running game loses it; a game is dropped once nobody is left in it
+        for gameId in connection.games:
+            record = self.games.get(gameId)
+            if record is None:
+                continue
+            if connection is record.white or connection is record.black:
+                if record.result is None and record.black is not None:
+                    record.result = "0-1" if connection is record.white else "1-0"
+                    self.broadcast(record, {"op": "result", "game": gameId, "result": record.result,
+                                            "reason": "disconnect"})
+                if connection is record.white:
+                    record.white = None
+                else:
+                    record.black = None
+                if record.result is None:
+                    record.result = "*" #abandoned before anyone joined
+            elif record.spectators:
+                record.spectators.discard(connection)
+            if not record.connections():
+                del self.games[gameId]
+                self.live.pop(gameId, None)
+        connection.games.clear()
+
+
+async def serve(host, port, liveGames, stateClass):
+    server = ChessServer(liveGames, stateClass)
+    listener = await asyncio.start_server(server.handleConnection, host, port)
+    print("Serving on %s" % ", ".join("%s:%d" % socket.getsockname()[:2] for socket in listener.sockets))
+    sys.stdout.flush()
+    async with listener:
+        await listener.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multiplayer chess server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--live", type=int, default=LIVE_GAMES, help="games kept as a full GameState (default %d)" % LIVE_GAMES)
+    parser.add_argument("--bitboard", action="store_true", help="use the ChessBitboard backend")
+    args = parser.parse_args(argv)
+    stateClass = ChessEngine.GameState
+    if args.bitboard:
+        import ChessBitboard
+        stateClass = ChessBitboard.BitboardGameState
+    try:
+        asyncio.run(serve(args.host, args.port, args.live, stateClass))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
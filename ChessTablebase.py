@@ -0,0 +1,726 @@
+#Endgame tablebases: win/draw/loss and distance to mate for every position of a small ending (KQvK, KRvK, KPvK,
+#KQvKR, KBNvK ... up to four pieces), built by retrograde analysis: start from the mates and the positions that
+#leave the ending by a capture or promotion (looked up in the smaller tables, built first), then walk the moves
+#backwards one ply at a time. A table is one byte per position in a flat file; the prober memory-maps it and
+#turns a position into its offset with a little arithmetic, so a lookup is O(1) and costs no memory of its own.
+#Tables are stored with the stronger side as white; symmetry (mirroring, and rotating for pawnless endings) puts
+#the white king on 10 squares (32 with pawns). The 50 move rule is ignored, as in other DTM tables, and endings
+#with pawns on both sides are not supported (they would need en passant).
+#Run: python ChessTablebase.py generate KQvK KRvK KPvK KQvKR --dir tables --workers 4
+#     python ChessTablebase.py verify KRvK --dir tables --samples 200
+#     python ChessTablebase.py probe "8/8/8/4k3/8/8/8/4K2R w - - 0 1" --dir tables
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+
+import ChessEngine
+from ChessTables import KNIGHT_TARGETS, KING_TARGETS, PAWN_CAPTURES, RAYS, \
+    ROOK_DIRECTIONS, BISHOP_DIRECTIONS, QUEEN_DIRECTIONS
+
+MAX_PIECES = 4
+EXTENSION = ".ctb"
+HEADER = struct.Struct("<4s16sI") #magic, ending name, number of positions
+MAGIC = b"CTB\x01"
+#Position bytes: DRAW, INVALID (illegal, or not the chosen one of a set of mirrored positions), otherwise
+#plies to mate + 1: odd plies for the side to move winning, even plies (0 = checkmated) for it losing
+DRAW = 0
+INVALID = 255
+MAX_PLIES = 253
+NO_LOSS = 255 #generator mark for positions that can escape a loss by leaving the ending
+INIT_CHUNK = 1 << 16 #positions per initialisation task
+UNMOVE_CHUNK = 1 << 14 #positions per predecessor task
+PIECE_ORDER = "KQRBNP"
+PIECE_WEIGHTS = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+WHITE, BLACK = 0, 1
+
+KNIGHT_SQUARES = tuple(frozenset(r * 8 + c for r, c in targets) for targets in KNIGHT_TARGETS)
+KING_SQUARES = tuple(frozenset(r * 8 + c for r, c in targets) for targets in KING_TARGETS)
+PAWN_CAPTURE_SQUARES = tuple(tuple(tuple(r * 8 + c for r, c in targets) for targets in side) for side in PAWN_CAPTURES)
+PAWN_ATTACK_SQUARES = tuple(tuple(frozenset(targets) for targets in side) for side in PAWN_CAPTURE_SQUARES)
+RAY_SQUARES = tuple(tuple(tuple(r * 8 + c for r, c in ray) for ray in rays) for rays in RAYS)
+SLIDER_DIRECTIONS = {'R': ROOK_DIRECTIONS, 'B': BISHOP_DIRECTIONS, 'Q': QUEEN_DIRECTIONS}
+
+def _lines():
+    #LINE_KIND[a * 64 + b]: 'R' if a and b share a rank or file, 'B' for a diagonal, None otherwise;
+    #BETWEEN[a * 64 + b]: the squares strictly between them on that line
+    kinds, between = [None] * 4096, [()] * 4096
+    for a in range(64):
+        for d, ray in enumerate(RAY_SQUARES[a]):
+            for i, b in enumerate(ray):
+                kinds[a * 64 + b] = 'R' if d in ROOK_DIRECTIONS else 'B'
+                between[a * 64 + b] = ray[:i]
+    return tuple(kinds), tuple(between)
+
+LINE_KIND, BETWEEN = _lines()
+
+def _transform(flipRows, flipCols, swap):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        if swap:
+            r, c = c, r
+        table.append((7 - r if flipRows else r) * 8 + (7 - c if flipCols else c))
+    return tuple(table)
+
+#Pawnless endings look the same mirrored or rotated (8 ways), pawn endings only mirrored left to right
+ALL_TRANSFORMS = tuple(_transform(rows, cols, swap) for swap in (False, True) for rows in (False, True) for cols in (False, True))
+PAWN_TRANSFORMS = (_transform(False, False, False), _transform(False, True, False))
+#White king squares after the transform: a8-d8-d5 triangle without pawns, the a-d files with them
+PAWNLESS_KING_REGION = tuple(r * 8 + c for r in range(4) for c in range(r, 4))
+PAWN_KING_REGION = tuple(r * 8 + c for r in range(8) for c in range(4))
+
+
+#Material names
+
+def splitMaterial(name):
+    #"KQvKR" -> ("KQ", "KR"), checked and with each side in KQRBNP order
+    sides = name.upper().split("V")
+    if len(sides) != 2 or not all(side.startswith("K") and side.count("K") == 1 and
+                                  all(letter in PIECE_ORDER for letter in side) for side in sides):
+        raise ValueError("endings are named like KQvKR, not %r" % name)
+    white, black = (''.join(sorted(side, key=PIECE_ORDER.index)) for side in sides)
+    if len(white) + len(black) > MAX_PIECES:
+        raise ValueError("%s has more than %d pieces" % (name, MAX_PIECES))
+    if 'P' in white and 'P' in black:
+        raise ValueError("%s has pawns on both sides, which is not supported" % name)
+    return white, black
+
+def _strength(side):
+    return sum(PIECE_WEIGHTS[letter] for letter in side), tuple(-PIECE_ORDER.index(letter) for letter in side)
+
+def canonicalMaterial(name):
+    #(name the table is stored under, whether the colors are swapped in it)
+    white, black = splitMaterial(name)
+    if _strength(black) > _strength(white):
+        return black + "v" + white, True
+    return white + "v" + black, False
+
+def placementMaterial(placement):
+    #Ending name of a list of (piece, square)
+    white = ''.join(sorted((piece[1] for piece, _ in placement if piece[0] == 'w'), key=PIECE_ORDER.index))
+    black = ''.join(sorted((piece[1] for piece, _ in placement if piece[0] == 'b'), key=PIECE_ORDER.index))
+    return white + "v" + black
+
+def subEndings(name):
+    #Endings a capture or a promotion leads to, bare kings excluded
+    white, black = splitMaterial(name)
+    results = set()
+    for side, other, isWhite in ((white, black, True), (black, white, False)):
+        for i, letter in enumerate(side):
+            if letter == 'K':
+                continue
+            rest = side[:i] + side[i + 1:]
+            changed = [rest] + ([rest + promoted for promoted in "QRBN"] if letter == 'P' else [])
+            for newSide in changed:
+                if newSide == "K" and other == "K":
+                    continue
+                try:
+                    results.add(canonicalMaterial(newSide + "v" + other if isWhite else other + "v" + newSide)[0])
+                except ValueError:
+                    pass #promoting in KPvKP style endings is out of scope anyway
+    return sorted(results)
+
+def dependencyOrder(names):
+    #The endings and everything they lead to, smallest first
+    order = []
+    def visit(name):
+        if name not in order:
+            for sub in subEndings(name):
+                visit(sub)
+            order.append(name)
+    for name in names:
+        visit(canonicalMaterial(name)[0])
+    return order
+
+
+class TableLayout():
+    #How the positions of one ending map to offsets: side to move, white king region square, then 64 squares
+    #for every other piece in the order wK, bK, white pieces, black pieces
+    def __init__(self, name):
+        white, black = splitMaterial(name)
+        self.name = white + "v" + black
+        self.pieces = ("wK", "bK") + tuple("w" + letter for letter in white[1:]) + tuple("b" + letter for letter in black[1:])
+        self.kinds = tuple(piece[1] for piece in self.pieces)
+        self.colors = tuple(WHITE if piece[0] == 'w' else BLACK for piece in self.pieces)
+        self.hasPawns = 'P' in self.kinds
+        region = PAWN_KING_REGION if self.hasPawns else PAWNLESS_KING_REGION
+        self.regionSize = len(region)
+        self.regionIndex = [-1] * 64
+        for i, sq in enumerate(region):
+            self.regionIndex[sq] = i
+        transforms = PAWN_TRANSFORMS if self.hasPawns else ALL_TRANSFORMS
+        #the transforms that move a white king on this square into the region
+        self.kingTransforms = tuple(tuple(t for t in transforms if self.regionIndex[t[sq]] >= 0) for sq in range(64))
+        #runs of identical pieces (KBBvK), kept in ascending square order so each position has one offset
+        runs = []
+        i = 2
+        while i < len(self.pieces):
+            j = i
+            while j < len(self.pieces) and self.pieces[j] == self.pieces[i]:
+                j += 1
+            if j - i > 1:
+                runs.append((i, j))
+            i = j
+        self.sameRuns = tuple(runs)
+        self.size = 2 * self.regionSize * 64 ** (len(self.pieces) - 1)
+
+    def decode(self, index):
+        #(side to move, squares in piece order) of an offset
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        stm, regionSquare = divmod(index, self.regionSize)
+        squares.append(PAWN_KING_REGION[regionSquare] if self.hasPawns else PAWNLESS_KING_REGION[regionSquare])
+        squares.reverse()
+        return stm, squares
+
+    def index(self, stm, squares):
+        #Offset of a position: the smallest over the symmetric copies with the white king in the region
+        best = None
+        for t in self.kingTransforms[squares[0]]:
+            mapped = [t[sq] for sq in squares]
+            for i, j in self.sameRuns:
+                mapped[i:j] = sorted(mapped[i:j])
+            index = stm * self.regionSize + self.regionIndex[mapped[0]]
+            for sq in mapped[1:]:
+                index = index * 64 + sq
+            if best is None or index < best:
+                best = index
+        return best
+
+    def placementIndex(self, placement, whiteToMove):
+        #Offset of a list of (piece, square) in the colors the table is stored in
+        squares = []
+        for piece in dict.fromkeys(self.pieces): #each kind once, identical pieces are next to each other
+            squares.extend(sq for p, sq in placement if p == piece)
+        return self.index(WHITE if whiteToMove else BLACK, squares)
+
+    def isValid(self, stm, squares):
+        #Distinct squares, pawns off the back ranks and the side that just moved not in check
+        if len(set(squares)) != len(squares):
+            return False
+        if self.hasPawns and any(kind == 'P' and not 8 <= sq < 56 for kind, sq in zip(self.kinds, squares)):
+            return False
+        return not self.attacked(squares, squares[1 - stm], stm)
+
+    def attacked(self, squares, target, byColor):
+        #Is target attacked by a piece of byColor? Captured pieces are None in squares
+        occupied = None
+        for kind, color, sq in zip(self.kinds, self.colors, squares):
+            if color != byColor or sq is None:
+                continue
+            if kind == 'N':
+                if target in KNIGHT_SQUARES[sq]:
+                    return True
+            elif kind == 'K':
+                if target in KING_SQUARES[sq]:
+                    return True
+            elif kind == 'P':
+                if target in PAWN_ATTACK_SQUARES[color][sq]:
+                    return True
+            else:
+                line = LINE_KIND[sq * 64 + target]
+                if line is not None and (kind == 'Q' or kind == line):
+                    if occupied is None:
+                        occupied = set(squares)
+                    if not any(between in occupied for between in BETWEEN[sq * 64 + target]):
+                        return True
+        return False
+
+    def moves(self, stm, squares):
+        #Legal moves as (squares after the move, moved piece index, captured piece index or -1, promotion letter or None)
+        kinds, colors = self.kinds, self.colors
+        occupant = {sq: i for i, sq in enumerate(squares) if sq is not None}
+        pseudo = []
+        for i, sq in enumerate(squares):
+            if colors[i] != stm or sq is None:
+                continue
+            kind = kinds[i]
+            if kind == 'P':
+                forward = -8 if stm == WHITE else 8
+                to = sq + forward
+                promotions = "QRBN" if to < 8 or to >= 56 else (None,)
+                if to not in occupant:
+                    pseudo.extend((i, to, -1, promotion) for promotion in promotions)
+                    if sq // 8 == (6 if stm == WHITE else 1) and to + forward not in occupant:
+                        pseudo.append((i, to + forward, -1, None))
+                for to in PAWN_CAPTURE_SQUARES[stm][sq]:
+                    j = occupant.get(to)
+                    if j is not None and colors[j] != stm:
+                        pseudo.extend((i, to, j, promotion) for promotion in promotions)
+            elif kind == 'N' or kind == 'K':
+                for to in (KNIGHT_SQUARES if kind == 'N' else KING_SQUARES)[sq]:
+                    j = occupant.get(to)
+                    if j is None or colors[j] != stm:
+                        pseudo.append((i, to, -1 if j is None else j, None))
+            else:
+                for d in SLIDER_DIRECTIONS[kind]:
+                    for to in RAY_SQUARES[sq][d]:
+                        j = occupant.get(to)
+                        if j is None:
+                            pseudo.append((i, to, -1, None))
+                        else:
+                            if colors[j] != stm:
+                                pseudo.append((i, to, j, None))
+                            break
+        moves = []
+        for i, to, j, promotion in pseudo:
+            after = list(squares)
+            after[i] = to
+            if j >= 0:
+                after[j] = None
+            if not self.attacked(after, after[stm], 1 - stm): #after[0] is the white king, after[1] the black one
+                moves.append((after, i, j, promotion))
+        return moves
+
+    def unmoves(self, stm, squares):
+        #Offsets of the positions one ply back, moves without a capture or promotion by the other side, deduplicated
+        mover = 1 - stm
+        kinds, colors = self.kinds, self.colors
+        occupied = set(squares)
+        parents = set()
+        for i, sq in enumerate(squares):
+            if colors[i] != mover:
+                continue
+            kind = kinds[i]
+            if kind == 'P':
+                back = 8 if mover == WHITE else -8
+                origins = []
+                if 8 <= sq + back < 56 and sq + back not in occupied:
+                    origins.append(sq + back)
+                    if sq // 8 == (4 if mover == WHITE else 3) and sq + 2 * back not in occupied:
+                        origins.append(sq + 2 * back)
+            elif kind == 'N' or kind == 'K':
+                origins = [origin for origin in (KNIGHT_SQUARES if kind == 'N' else KING_SQUARES)[sq] if origin not in occupied]
+            else:
+                origins = []
+                for d in SLIDER_DIRECTIONS[kind]:
+                    for origin in RAY_SQUARES[sq][d]:
+                        if origin in occupied:
+                            break
+                        origins.append(origin)
+            for origin in origins:
+                before = list(squares)
+                before[i] = origin
+                if not self.attacked(before, before[stm], mover): #the side to move now can't have been left in check
+                    parents.add(self.index(mover, before))
+        return parents
+
+
+_layouts = {}
+
+def layoutFor(name):
+    layout = _layouts.get(name)
+    if layout is None:
+        layout = _layouts[name] = TableLayout(name)
+    return layout
+
+def decodeValue(value):
+    #(wdl, plies to mate) of a position byte: wdl 1 win, 0 draw, -1 loss for the side to move
+    if value == DRAW:
+        return 0, 0
+    plies = value - 1
+    return (1 if plies & 1 else -1), plies
+
+
+class Tablebases():
+    #The tables in a directory, each memory-mapped the first time a position of its ending is probed
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {} #name -> (layout, mmap)
+        self.endings = {} #sorted piece names -> (layout, mmap, colors swapped) or None, so a probe skips the name handling
+        names = [entry[:-len(EXTENSION)] for entry in os.listdir(directory) if entry.endswith(EXTENSION)] \
+            if os.path.isdir(directory) else []
+        self.maxPieces = max((len(name) - 1 for name in names), default=0)
+
+    def close(self):
+        for _, data in self.tables.values():
+            data.close()
+        self.tables = {}
+        self.endings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def table(self, name):
+        #(layout, data) of a stored ending name, None if there is no file for it
+        table = self.tables.get(name)
+        if table is None:
+            path = os.path.join(self.directory, name + EXTENSION)
+            if not os.path.exists(path):
+                return None
+            layout = layoutFor(name)
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, storedName, size = HEADER.unpack_from(data)
+            if magic != MAGIC or storedName.rstrip(b"\0").decode() != name or size != layout.size or \
+                    len(data) != HEADER.size + size:
+                data.close()
+                raise ValueError("%s is not a tablebase file for %s" % (path, name))
+            table = self.tables[name] = (layout, data)
+            self.maxPieces = max(self.maxPieces, len(layout.pieces))
+        return table
+
+    def lookup(self, placement, whiteToMove):
+        #(wdl, plies) for a list of (piece, square) with no castling, None if the ending has no table
+        if len(placement) == 2:
+            return 0, 0 #bare kings
+        material = tuple(sorted(piece for piece, _ in placement))
+        ending = self.endings.get(material, False)
+        if ending is False:
+            ending = self.endings[material] = self.findEnding(placement)
+        if ending is None:
+            return None
+        layout, data, flipped = ending
+        if flipped:
+            placement = [(('b' if piece[0] == 'w' else 'w') + piece[1], sq ^ 56) for piece, sq in placement]
+            whiteToMove = not whiteToMove
+        value = data[HEADER.size + layout.placementIndex(placement, whiteToMove)]
+        return None if value == INVALID else decodeValue(value)
+
+    def findEnding(self, placement):
+        try:
+            name, flipped = canonicalMaterial(placementMaterial(placement))
+        except ValueError:
+            return None #an ending the tables can't cover, like pawns on both sides
+        table = self.table(name)
+        return None if table is None else table + (flipped,)
+
+    def probe(self, gs):
+        #(wdl, plies to mate) of the position for the side to move, None if it is not in the tables
+        if gs.whiteCastleKingside or gs.whiteCastleQueenside or gs.blackCastleKingside or gs.blackCastleQueenside:
+            return None
+        placement = []
+        for r, row in enumerate(gs.board):
+            for c, piece in enumerate(row):
+                if piece != "--":
+                    placement.append((piece, r * 8 + c))
+                    if len(placement) > self.maxPieces:
+                        return None
+        return self.lookup(placement, gs.whiteToMove)
+
+    def bestMove(self, gs):
+        #The move that keeps the result and mates fastest (or holds out longest), None if the position isn't covered
+        if self.probe(gs) is None:
+            return None
+        best, bestRank = None, None
+        for move in gs.getValidMoves():
+            gs.makeMove(move, checkForGameEnd=False)
+            result = self.probe(gs)
+            gs.undoMove()
+            if result is None:
+                continue
+            wdl, plies = result
+            rank = (wdl, plies if wdl < 0 else -plies) #the opponent lost quickest, then drawn, then lost slowest
+            if bestRank is None or rank < bestRank:
+                best, bestRank = move, rank
+        return best
+
+
+#Generation
+
+_workerTables = {} #directory -> Tablebases, one per process
+
+def _tablesIn(directory):
+    tables = _workerTables.get(directory)
+    if tables is None:
+        tables = _workerTables[directory] = Tablebases(directory)
+    return tables
+
+def _initChunk(name, directory, start, stop):
+    #First pass over positions start..stop: invalid ones, mates, and what leaving the ending is worth.
+    #Returns the chunk's values, same-ending move counts and losing-exit plies, and the win/loss events by ply
+    layout = layoutFor(name)
+    tables = _tablesIn(directory)
+    count = stop - start
+    values = bytearray([INVALID]) * count
+    counters = bytearray(count)
+    exitLoss = bytearray(count)
+    events = [] #(plies, index, won)
+    for index in range(start, stop):
+        stm, squares = layout.decode(index)
+        if not layout.isValid(stm, squares) or layout.index(stm, squares) != index:
+            continue
+        offset = index - start
+        values[offset] = DRAW
+        moves = layout.moves(stm, squares)
+        if not moves:
+            if layout.attacked(squares, squares[stm], 1 - stm):
+                events.append((0, index, False))
+            continue
+        children = set()
+        bestWin = None
+        worstLoss = 0
+        escapes = False
+        for after, moved, captured, promotion in moves:
+            if captured < 0 and promotion is None:
+                children.add(layout.index(1 - stm, after))
+                continue
+            placement = [(layout.pieces[i], sq) for i, sq in enumerate(after) if sq is not None]
+            if promotion is not None:
+                placement = [(piece[0] + promotion if sq == after[moved] else piece, sq) for piece, sq in placement]
+            result = tables.lookup(placement, stm == BLACK)
+            if result is None:
+                raise ValueError("%s needs the %s table first" % (name, canonicalMaterial(placementMaterial(placement))[0]))
+            wdl, plies = result
+            if wdl < 0:
+                bestWin = plies + 1 if bestWin is None else min(bestWin, plies + 1)
+            elif wdl > 0:
+                worstLoss = max(worstLoss, plies + 1)
+            else:
+                escapes = True
+        counters[offset] = len(children)
+        if bestWin is not None:
+            events.append((bestWin, index, True))
+        if bestWin is not None or escapes:
+            exitLoss[offset] = NO_LOSS
+        else:
+            exitLoss[offset] = worstLoss
+            if not children:
+                events.append((worstLoss, index, False)) #every move leaves the ending into a loss
+    return start, values, counters, exitLoss, events
+
+def _unmoveChunk(name, lost, won):
+    #Positions one ply before the just lost and just won ones
+    layout = layoutFor(name)
+    lostParents, wonParents = array('I'), array('I')
+    for indexes, parents in ((lost, lostParents), (won, wonParents)):
+        for index in indexes:
+            stm, squares = layout.decode(index)
+            parents.extend(layout.unmoves(stm, squares))
+    return lostParents, wonParents
+
+def _runTasks(executor, function, taskArgs):
+    if executor is None:
+        return [function(*args) for args in taskArgs]
+    futures = [executor.submit(function, *args) for args in taskArgs]
+    return [future.result() for future in futures]
+
+def _chunks(values, size):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+def generateTable(name, directory, executor=None, log=None):
+    #Build one ending (its sub-endings must be in directory already) and write it there. Returns the values
+    layout = layoutFor(canonicalMaterial(name)[0])
+    name = layout.name
+    values = bytearray(layout.size)
+    counters = bytearray(layout.size)
+    exitLoss = bytearray(layout.size)
+    pending = {} #plies -> [(index, won)]
+    tasks = [(name, directory, start, min(start + INIT_CHUNK, layout.size)) for start in range(0, layout.size, INIT_CHUNK)]
+    for start, chunkValues, chunkCounters, chunkExitLoss, events in _runTasks(executor, _initChunk, tasks):
+        stop = start + len(chunkValues)
+        values[start:stop] = chunkValues
+        counters[start:stop] = chunkCounters
+        exitLoss[start:stop] = chunkExitLoss
+        for plies, index, won in events:
+            pending.setdefault(plies, []).append((index, won))
+
+    plies = 0
+    while pending:
+        lost, won = array('I'), array('I')
+        for index, isWin in pending.pop(plies, ()):
+            if values[index] == DRAW:
+                if plies > MAX_PLIES:
+                    raise ValueError("%s has mates longer than %d plies" % (name, MAX_PLIES))
+                values[index] = plies + 1
+                (won if isWin else lost).append(index)
+        tasks = [(name, lostChunk, array('I')) for lostChunk in _chunks(lost, UNMOVE_CHUNK)] + \
+                [(name, array('I'), wonChunk) for wonChunk in _chunks(won, UNMOVE_CHUNK)]
+        for lostParents, wonParents in _runTasks(executor, _unmoveChunk, tasks):
+            for parent in lostParents: #a move into a lost position wins
+                if values[parent] == DRAW:
+                    pending.setdefault(plies + 1, []).append((parent, True))
+            for parent in wonParents: #a move into a won position loses, the parent is lost once all of them do
+                if values[parent] == DRAW and exitLoss[parent] != NO_LOSS:
+                    counters[parent] -= 1
+                    if counters[parent] == 0:
+                        pending.setdefault(max(plies + 1, exitLoss[parent]), []).append((parent, False))
+        if log is not None and (lost or won):
+            log("%s: %d plies, %d won, %d lost" % (name, plies, len(won), len(lost)))
+        plies += 1
+
+    path = os.path.join(directory, name + EXTENSION)
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, name.encode(), layout.size))
+        f.write(values)
+    os.replace(path + ".tmp", path)
+    return values
+
+def generate(names, directory, workers=0, force=False, log=None):
+    #Build the endings and the smaller ones they lead to, skipping tables already in directory unless force
+    os.makedirs(directory, exist_ok=True)
+    executor = None
+    if workers > 0:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for name in dependencyOrder(names):
+            if not force and os.path.exists(os.path.join(directory, name + EXTENSION)):
+                continue
+            start = time.perf_counter()
+            values = generateTable(name, directory, executor)
+            if log is not None:
+                log(tableSummary(name, values, time.perf_counter() - start))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def tableSummary(name, values, seconds=None):
+    counts = [0, 0, 0]
+    longest = 0
+    for value in values:
+        if value != INVALID:
+            wdl, plies = decodeValue(value)
+            counts[wdl + 1] += 1
+            longest = max(longest, plies)
+    text = "%s: %d positions, %d won, %d drawn, %d lost, longest mate %d plies" % (
+        name, sum(counts), counts[2], counts[1], counts[0], longest)
+    return text + (" (%.1fs)" % seconds if seconds is not None else "")
+
+
+#Checking
+
+def randomPosition(name, rng, stateClass=ChessEngine.GameState):
+    #A random legal GameState of an ending, either color may be the stronger side
+    layout = layoutFor(canonicalMaterial(name)[0])
+    while True:
+        stm, squares = layout.decode(rng.randrange(layout.size))
+        t = rng.choice(PAWN_TRANSFORMS if layout.hasPawns else ALL_TRANSFORMS)
+        squares = [t[sq] for sq in squares]
+        if layout.isValid(stm, squares):
+            break
+    flip = rng.random() < 0.5
+    board = [["--"] * 8 for _ in range(8)]
+    for piece, sq in zip(layout.pieces, squares):
+        if flip:
+            piece, sq = ('b' if piece[0] == 'w' else 'w') + piece[1], sq ^ 56
+        board[sq // 8][sq % 8] = piece
+    gs = stateClass()
+    gs.setPosition(board, (stm == WHITE) != flip, (False, False, False, False))
+    return gs
+
+def bruteForce(gs, depth):
+    #(wdl, plies) if a mate is forced within depth plies (either way), (0, 0) for stalemate, None otherwise
+    moves = gs.getValidMoves()
+    if not moves:
+        return (-1, 0) if gs.checkmate else (0, 0)
+    if depth <= 0:
+        return None
+    bestWin = None
+    worstLoss = 0
+    allLose = True
+    for move in moves:
+        gs.makeMove(move, checkForGameEnd=False)
+        result = bruteForce(gs, depth - 1)
+        gs.undoMove()
+        if result is not None and result[0] < 0:
+            bestWin = result[1] + 1 if bestWin is None else min(bestWin, result[1] + 1)
+        elif result is not None and result[0] > 0:
+            worstLoss = max(worstLoss, result[1] + 1)
+        else:
+            allLose = False
+    if bestWin is not None:
+        return 1, bestWin
+    return (-1, worstLoss) if allLose else None
+
+def verify(tables, name, samples=100, depth=3, seed=1):
+    #Compare the table with ChessEngine on random positions: every value must follow from the values after each
+    #legal move, and mates within depth plies must match a full search. Returns the mismatching FENs
+    rng = random.Random(seed)
+    failures = []
+    for sample in range(samples):
+        gs = randomPosition(name, rng)
+        if sample % 2: #half of the samples are short mates, which the full search can see
+            for _ in range(1000):
+                result = tables.probe(gs)
+                if result is not None and result[0] != 0 and result[1] <= depth:
+                    break
+                gs = randomPosition(name, rng)
+        result = tables.probe(gs)
+        moves = gs.getValidMoves()
+        if not moves:
+            expected = (-1, 0) if gs.checkmate else (0, 0)
+        else:
+            childResults = []
+            for move in moves:
+                gs.makeMove(move, checkForGameEnd=False)
+                childResults.append(tables.probe(gs))
+                gs.undoMove()
+            if None in childResults:
+                failures.append((gs.toFEN(), "a position after a move is not in the tables"))
+                continue
+            wins = [plies + 1 for wdl, plies in childResults if wdl < 0]
+            if wins:
+                expected = (1, min(wins))
+            elif all(wdl > 0 for wdl, _ in childResults):
+                expected = (-1, max(plies + 1 for _, plies in childResults))
+            else:
+                expected = (0, 0)
+        if result != expected:
+            failures.append((gs.toFEN(), "table %r, after each move %r" % (result, expected)))
+            continue
+        searched = bruteForce(gs, depth)
+        if result[0] != 0 and result[1] <= depth:
+            if searched != result:
+                failures.append((gs.toFEN(), "table %r, search %r" % (result, searched)))
+        elif searched not in (None, (0, 0)):
+            failures.append((gs.toFEN(), "table %r, search %r" % (result, searched)))
+    return failures
+
+def formatResult(result):
+    if result is None:
+        return "not in the tables"
+    wdl, plies = result
+    if wdl == 0:
+        return "draw"
+    return "%s, mate in %d plies" % ("win" if wdl > 0 else "loss", plies)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Endgame tablebases: generate, verify and probe")
+    parser.add_argument("command", choices=("generate", "verify", "probe"))
+    parser.add_argument("targets", nargs="+", help="endings like KQvK KRvK KPvK KQvKR, or FENs for probe")
+    parser.add_argument("--dir", default="tablebases", help="directory of the table files (default tablebases)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="generate with this many processes (default 0: single process)")
+    parser.add_argument("--force", action="store_true", help="rebuild tables that already exist")
+    parser.add_argument("--samples", type=int, default=100, help="random positions to verify (default 100)")
+    parser.add_argument("--depth", type=int, default=3, help="plies of full search when verifying (default 3)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        try:
+            generate(args.targets, args.dir, args.workers, args.force, log=print)
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+    with Tablebases(args.dir) as tables:
+        if args.command == "probe":
+            for fen in args.targets:
+                gs = ChessEngine.GameState.fromFEN(fen)
+                move = tables.bestMove(gs)
+                print("%s: %s%s" % (fen, formatResult(tables.probe(gs)),
+                                    ", best %s" % gs.getSAN(move) if move is not None else ""))
+            return 0
+        allOk = True
+        for name in args.targets:
+            start = time.perf_counter()
+            failures = verify(tables, name, args.samples, args.depth, args.seed)
+            print("%s: %d positions, %d mismatches (%.1fs)" % (name, args.samples, len(failures), time.perf_counter() - start))
+            for fen, message in failures[:10]:
+                print("  %s: %s" % (fen, message))
+            allOk = allOk and not failures
+        return 0 if allOk else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+#Per-square move tables, built once at import so move generation and attack tests don't redo coordinate
+#arithmetic and bounds checks. Indexed by square = row * 8 + col (a8 = 0, h1 = 63), entries are (row, col) pairs
+
+SQUARE_COORDS = tuple(divmod(sq, 8) for sq in range(64))
+
+#Ray directions as (row step, col step): 0-3 orthogonal, 4-7 diagonal
+DIRECTIONS = ((-1, 0), (0, 1), (1, 0), (0, -1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+QUEEN_DIRECTIONS = tuple(range(8))
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+def _stepTargets(offsets):
+    return tuple(tuple((r + dr, c + dc) for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8)
+                 for r, c in SQUARE_COORDS)
+
+def _rays():
+    table = []
+    for r, c in SQUARE_COORDS:
+        squareRays = []
+        for dr, dc in DIRECTIONS:
+            ray = []
+            endRow, endCol = r + dr, c + dc
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                ray.append((endRow, endCol))
+                endRow += dr
+                endCol += dc
+            squareRays.append(tuple(ray))
+        table.append(tuple(squareRays))
+    return tuple(table)
+
+KNIGHT_TARGETS = _stepTargets(KNIGHT_OFFSETS)
+KING_TARGETS = _stepTargets(KING_OFFSETS)
+#PAWN_CAPTURES[0][sq] = squares a white pawn on sq captures on, PAWN_CAPTURES[1][sq] the same for black.
+#Read the other way round: a white pawn attacks sq from the squares in PAWN_CAPTURES[1][sq]
+PAWN_CAPTURES = (_stepTargets(((-1, -1), (-1, 1))), _stepTargets(((1, -1), (1, 1))))
+#RAYS[sq][d] = squares from sq outwards in direction d, nearest first
+RAYS = _rays()
+
+#Bitmask versions of the tables (bit row * 8 + col), for the bitboard backend and whole-board attack maps
+def _mask(squares):
+    mask = 0
+    for r, c in squares:
+        mask |= 1 << (r * 8 + c)
+    return mask
+
+KNIGHT_MASKS = tuple(_mask(targets) for targets in KNIGHT_TARGETS)
+KING_MASKS = tuple(_mask(targets) for targets in KING_TARGETS)
+PAWN_CAPTURE_MASKS = tuple(tuple(_mask(targets) for targets in side) for side in PAWN_CAPTURES)
+RAY_MASKS = tuple(tuple(_mask(RAYS[sq][d]) for sq in range(64)) for d in range(8)) #RAY_MASKS[d][sq]
+#Directions that step to higher square indices: the nearest blocker on those rays is the lowest set bit
+POSITIVE_DIRECTIONS = tuple(dr * 8 + dc > 0 for dr, dc in DIRECTIONS)
@@ -0,0 +1,106 @@
+#Transposition table: remembers search results by Zobrist key so positions reached by another move order aren't searched again.
+#Storage is two preallocated arrays of 64-bit ints (key, packed data), grouped in buckets of two slots:
+#slot 0 keeps the deepest result (unless it is from an old search), slot 1 always takes the newest one.
+from array import array
+
+EMPTY, EXACT, LOWER, UPPER = 0, 1, 2, 3 #bound types, EMPTY marks an unused slot
+BUCKET_SLOTS = 2
+ENTRY_BYTES = 16 #8 byte key + 8 byte data
+
+#Data word layout: move 16 bits (ChessEngine Move.code) | bound 2 bits | depth 8 bits | age 8 bits | score 30 bits (offset binary)
+MOVE_BITS, BOUND_SHIFT, DEPTH_SHIFT, AGE_SHIFT, SCORE_SHIFT = 16, 16, 18, 26, 34
+SCORE_OFFSET = 1 << 29
+
+def findMove(moves, code):
+    #The legal move whose Move.code matches a stored code, or None (empty slot, or a key collision left a move from another position)
+    if code:
+        for move in moves:
+            if move.code == code:
+                return move
+    return None
+
+
+class TranspositionTable():
+    def __init__(self, sizeMB=16):
+        self.resize(sizeMB)
+
+    def resize(self, sizeMB):
+        buckets = 1
+        while buckets * 2 * BUCKET_SLOTS * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+            buckets *= 2 #power of two so the index is a mask
+        self.sizeMB = sizeMB
+        self.bucketMask = buckets - 1
+        self.entries = buckets * BUCKET_SLOTS
+        self.keys = array('Q', bytes(8 * self.entries))
+        self.data = array('Q', bytes(8 * self.entries))
+        self.age = 0
+        self.resetStats()
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.entries))
+        self.data = array('Q', bytes(8 * self.entries))
+        self.age = 0
+        self.resetStats()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0 #a stored entry for a different position was replaced
+        self.collisions = 0 #probe found its bucket holding other positions only
+
+    def newSearch(self):
+        #Entries from earlier searches become the first to be replaced
+        self.age = (self.age + 1) & 0xFF
+
+    def probe(self, key):
+        #(move code, depth, bound, score) or None
+        self.probes += 1
+        index = (key & self.bucketMask) * BUCKET_SLOTS
+        keys = self.keys
+        occupied = False
+        for slot in range(index, index + BUCKET_SLOTS):
+            data = self.data[slot]
+            if data:
+                if keys[slot] == key:
+                    self.hits += 1
+                    return (data & 0xFFFF, (data >> DEPTH_SHIFT) & 0xFF, (data >> BOUND_SHIFT) & 3,
+                            (data >> SCORE_SHIFT) - SCORE_OFFSET)
+                occupied = True
+        if occupied:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, bound, score, moveCode):
+        self.stores += 1
+        index = (key & self.bucketMask) * BUCKET_SLOTS
+        keys = self.keys
+        dataArray = self.data
+        data = moveCode | bound << BOUND_SHIFT | min(depth, 255) << DEPTH_SHIFT | self.age << AGE_SHIFT | \
+            (score + SCORE_OFFSET) << SCORE_SHIFT
+        slot = index #depth-preferred slot
+        old = dataArray[slot]
+        if old and keys[slot] != key and ((old >> AGE_SHIFT) & 0xFF) == self.age and ((old >> DEPTH_SHIFT) & 0xFF) > depth:
+            slot = index + 1 #keep the deeper current result, put this one in the always-replace slot
+            old = dataArray[slot]
+        if old and keys[slot] != key:
+            self.overwrites += 1
+        elif old and not moveCode:
+            data |= old & 0xFFFF #same position without a best move this time, keep the old one for ordering
+        keys[slot] = key
+        dataArray[slot] = data
+
+    def fillRate(self):
+        #Fraction of a sample of slots written during the current search (like UCI hashfull / 1000)
+        sample = min(self.entries, 1000)
+        used = 0
+        for slot in range(sample):
+            data = self.data[slot]
+            if data and ((data >> AGE_SHIFT) & 0xFF) == self.age:
+                used += 1
+        return used / sample
+
+    def stats(self):
+        return {"sizeMB": self.sizeMB, "entries": self.entries, "probes": self.probes, "hits": self.hits,
+                "hitRate": self.hits / self.probes if self.probes else 0.0, "stores": self.stores,
+                "overwrites": self.overwrites, "collisions": self.collisions, "fillRate": self.fillRate()}
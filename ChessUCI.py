@@ -0,0 +1,245 @@
+#UCI front-end so GUIs and tournament managers can run the engine:
+#python ChessUCI.py [--bitboard] [--book book.bin] [--tablebases DIR]
+#A manager resends the whole game on every move ("position startpos moves e2e4 e7e5 ..."); when the new list
+#extends (or shares a start with) the game already on the board, only the differing moves are undone and played.
+#"go" searches on a background thread, so "stop" and "isready" are answered while it thinks
+import sys
+import threading
+
+import ChessEngine
+import ChessSearch
+
+ENGINE_NAME = "ChessEngine"
+ENGINE_AUTHOR = "ChessEngine authors"
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+DEFAULT_HASH = 16
+MAX_HASH = 1024
+MOVE_OVERHEAD = 0.05 #seconds kept back from every move for the GUI round trip
+GO_VALUE_NAMES = ("wtime", "btime", "winc", "binc", "movestogo", "depth", "nodes", "movetime", "mate")
+
+
+class UCIEngine():
+    def __init__(self, stateClass=ChessEngine.GameState, out=sys.stdout):
+        self.stateClass = stateClass
+        self.out = out
+        self.outputLock = threading.Lock() #the search thread writes info and bestmove lines too
+        self.hashMB = DEFAULT_HASH
+        self.tablebases = None #ChessTablebase.Tablebases, handed to every new Searcher
+        self.searcher = ChessSearch.Searcher(self.hashMB)
+        self.searchThread = None
+        self.stopRequested = threading.Event()
+        self.startFEN = STARTING_FEN
+        self.gs = stateClass()
+        self.playedMoves = [] #long notation of the moves on the board since startFEN
+        self.book = None #ChessBook.PolyglotBook; book moves are played at once, without a search
+
+    def write(self, text):
+        with self.outputLock:
+            self.out.write(text + "\n")
+            self.out.flush()
+
+    def execute(self, line):
+        #Handle one line of input. False after "quit"
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.write("id name %s" % ENGINE_NAME)
+            self.write("id author %s" % ENGINE_AUTHOR)
+            self.write("option name Hash type spin default %d min 1 max %d" % (DEFAULT_HASH, MAX_HASH))
+            self.write("option name BookFile type string default <empty>")
+            self.write("option name TablebasePath type string default <empty>")
+            self.write("uciok")
+        elif command == "isready":
+            self.write("readyok")
+        elif command == "setoption":
+            self.waitForSearch()
+            self.setOption(args)
+        elif command == "ucinewgame":
+            self.waitForSearch()
+            self.searcher = ChessSearch.Searcher(self.hashMB, self.tablebases)
+            self.setPosition(STARTING_FEN, [])
+        elif command == "position":
+            self.waitForSearch()
+            self.position(args)
+        elif command == "go":
+            self.waitForSearch()
+            self.go(args)
+        elif command == "stop":
+            self.waitForSearch()
+        elif command == "quit":
+            self.waitForSearch()
+            return False
+        elif command not in ("debug", "ponderhit", "register"):
+            self.write("info string unknown command %s" % command)
+        return True
+
+    def setOption(self, args):
+        #setoption name <id> [value <x>]
+        text = " ".join(args)
+        name, _, value = text[len("name "):].partition(" value ") if text.startswith("name ") else ("", "", "")
+        if name.strip().lower() == "hash":
+            try:
+                self.hashMB = max(1, min(MAX_HASH, int(value)))
+            except ValueError:
+                self.write("info string bad Hash value %s" % value)
+                return
+            self.searcher = ChessSearch.Searcher(self.hashMB, self.tablebases)
+        elif name.strip().lower() == "bookfile":
+            self.openBook(value.strip() if value.strip() not in ("", "<empty>") else None)
+        elif name.strip().lower() == "tablebasepath":
+            self.openTablebases(value.strip() if value.strip() not in ("", "<empty>") else None)
+        else:
+            self.write("info string unknown option %s" % name.strip())
+
+    def openBook(self, path):
+        import ChessBook
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if path is not None:
+            try:
+                self.book = ChessBook.PolyglotBook(path)
+            except (OSError, ValueError) as e:
+                self.write("info string no book: %s" % e)
+
+    def openTablebases(self, directory):
+        import ChessTablebase
+        if self.tablebases is not None:
+            self.tablebases.close()
+        self.tablebases = ChessTablebase.Tablebases(directory) if directory is not None else None
+        if self.tablebases is not None and self.tablebases.maxPieces == 0:
+            self.write("info string no tablebases in %s" % directory)
+        self.searcher.tablebases = self.tablebases
+
+    #Position
+
+    def position(self, args):
+        #position startpos [moves ...] | position fen <6 fields> [moves ...]
+        if "moves" in args:
+            split = args.index("moves")
+            setup, moves = args[:split], args[split + 1:]
+        else:
+            setup, moves = args, []
+        if setup[:1] == ["startpos"]:
+            fen = STARTING_FEN
+        elif setup[:1] == ["fen"] and len(setup) > 1:
+            fen = " ".join(setup[1:])
+        else:
+            self.write("info string bad position command")
+            return
+        self.setPosition(fen, moves)
+
+    def setPosition(self, fen, moves):
+        if fen != self.startFEN:
+            try:
+                gs = self.stateClass.fromFEN(fen)
+            except ValueError as e:
+                self.write("info string %s" % e)
+                return
+            self.startFEN, self.gs, self.playedMoves = fen, gs, []
+        common = 0 #moves shared with the game already on the board are kept, only the rest is undone / played
+        limit = min(len(moves), len(self.playedMoves))
+        while common < limit and moves[common] == self.playedMoves[common]:
+            common += 1
+        for _ in range(len(self.playedMoves) - common):
+            self.gs.undoMove()
+        del self.playedMoves[common:]
+        for text in moves[common:]:
+            try:
+                move = self.gs.parseMove(text)
+            except ValueError as e:
+                self.write("info string %s" % e)
+                return
+            self.gs.makeMove(move, checkForGameEnd=False)
+            self.playedMoves.append(text)
+
+    #Search
+
+    def go(self, args):
+        values = {}
+        infinite = False
+        for i, token in enumerate(args):
+            if token == "infinite":
+                infinite = True
+            elif token in GO_VALUE_NAMES and i + 1 < len(args):
+                try:
+                    values[token] = int(args[i + 1])
+                except ValueError:
+                    pass
+        if self.book is not None and not infinite:
+            move = self.book.chooseMove(self.gs)
+            if move is not None:
+                self.write("info string book move")
+                self.write("bestmove %s" % move.getLongNotation())
+                return
+        self.stopRequested.clear()
+        limits = ChessSearch.SearchLimits(depth=values.get("depth"), nodes=values.get("nodes"),
+                                          movetime=self.moveTime(values) if not infinite else None,
+                                          stop=self.stopRequested)
+        self.searchThread = threading.Thread(target=self.think, args=(limits, infinite), daemon=True)
+        self.searchThread.start()
+
+    def moveTime(self, values):
+        #Seconds to spend on this move: movetime as given, otherwise a share of the clock plus most of the increment
+        if "movetime" in values:
+            return max(0.001, values["movetime"] / 1000.0 - MOVE_OVERHEAD)
+        side = "w" if self.gs.whiteToMove else "b"
+        if side + "time" not in values:
+            return None
+        left = values[side + "time"] / 1000.0
+        increment = values.get(side + "inc", 0) / 1000.0
+        budget = left / max(1, values.get("movestogo", 30)) + increment * 0.75
+        return max(0.001, min(budget, left / 2) - MOVE_OVERHEAD)
+
+    def think(self, limits, infinite):
+        result = self.searcher.search(self.gs, limits, self.report)
+        if infinite:
+            self.stopRequested.wait() #"go infinite" may only answer once it is told to stop
+        if result.bestMove is None:
+            self.write("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.write("bestmove %s ponder %s" % (result.bestMove.getLongNotation(), result.pv[1].getLongNotation()))
+        else:
+            self.write("bestmove %s" % result.bestMove.getLongNotation())
+
+    def report(self, result):
+        self.write("info depth %d score %s nodes %d nps %d time %d hashfull %d tbhits %d pv %s" % (
+            result.depth, scoreString(result.score), result.nodes, result.nps(), int(result.seconds * 1000),
+            int(result.hashfull * 1000), result.tbHits, " ".join(move.getLongNotation() for move in result.pv)))
+
+    def waitForSearch(self):
+        #Stop a running search and wait for its bestmove, so the board is free again
+        if self.searchThread is not None:
+            self.stopRequested.set() #also the search's stop token
+            self.searchThread.join()
+            self.searchThread = None
+
+
+def scoreString(score):
+    #"cp 35", or "mate 3" / "mate -2" in moves (not plies) for mate scores
+    if score >= ChessSearch.MATE_BOUND:
+        return "mate %d" % ((ChessSearch.MATE_SCORE - score + 1) // 2)
+    if score <= -ChessSearch.MATE_BOUND:
+        return "mate %d" % -((ChessSearch.MATE_SCORE + score) // 2)
+    return "cp %d" % score
+
+def main():
+    stateClass = ChessEngine.GameState
+    if "--bitboard" in sys.argv[1:]:
+        import ChessBitboard
+        stateClass = ChessBitboard.BitboardGameState
+    engine = UCIEngine(stateClass)
+    if "--book" in sys.argv[1:-1]:
+        engine.openBook(sys.argv[sys.argv.index("--book") + 1])
+    if "--tablebases" in sys.argv[1:-1]:
+        engine.openTablebases(sys.argv[sys.argv.index("--tablebases") + 1])
+    for line in sys.stdin:
+        if not engine.execute(line):
+            break
+    engine.waitForSearch()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+import pytest
+
+import ChessBitboard
+import ChessEngine
+
+BACKENDS = [ChessEngine.GameState, ChessBitboard.BitboardGameState]
+
+def bit(square):
+    return 1 << ((8 - int(square[1])) * 8 + "abcdefgh".index(square[0]))
+
+@pytest.mark.parametrize("stateClass", BACKENDS)
+def test_attack_map_sees_through_king_only_when_asked(stateClass):
+    #Black rook checks along the e-file, the white bishop behind the king is not attacked yet
+    gs = stateClass.fromFEN("4r1k1/8/8/8/8/8/4K3/4B3 w - - 0 1")
+    assert gs.attackMap("b") & bit("e1")
+    assert gs.computeAttackMap("b") == gs.attackMap("b")
+    attacks = gs.computeAttackMap("b", seeThroughKing=False)
+    assert attacks & bit("e2")
+    assert not attacks & bit("e1")
+
+@pytest.mark.parametrize("stateClass", BACKENDS)
+def test_threatened_squares_use_real_occupancy(stateClass):
+    ChessMain = pytest.importorskip("ChessMain")
+    gs = stateClass.fromFEN("4r1k1/8/8/8/8/8/4K3/4B3 w - - 0 1")
+    assert ChessMain.threatenedSquares(gs) == {(6, 4)}
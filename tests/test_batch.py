@@ -0,0 +1,53 @@
+import itertools
+
+import pytest
+
+import ChessBatch
+
+GAMES = ["1. e4 e5 2. Nf3 Nc6 1-0", "1. d4 d5 2. c4 e6 0-1", "1. c4 e5 1/2-1/2", "1. Nf3 d5 2. g3 *",
+         "1. e4 c5 2. Nf3 d6 1-0"]
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / "games.pgn"
+    lines = []
+    for number, movetext in zip(range(1, 11), itertools.cycle(GAMES)):
+        lines.append('[Event "test"]\n[Round "%d"]\n\n%s\n\n' % (number, movetext))
+    path.write_text("".join(lines))
+    return str(path)
+
+def replayFirstChunks(path, chunkSize, count):
+    #State of a run interrupted after its first count chunks
+    stats = ChessBatch.BatchStats()
+    stats.chunkSize = chunkSize
+    for chunkId, firstGame, games in itertools.islice(ChessBatch.gameChunks([path], chunkSize), count):
+        stats.merge(ChessBatch.replayChunk(chunkId, firstGame, games, 4, ChessBatch.ChessEngine.GameState))
+    return stats
+
+def test_resume_counts_every_game_once(archive):
+    stats = ChessBatch.runBatch([archive], workers=1, chunkSize=2, stats=replayFirstChunks(archive, 2, 2))
+    assert stats.games == 10
+    assert stats.plies == ChessBatch.runBatch([archive], workers=1, chunkSize=2).plies
+
+def test_resume_with_another_chunk_size_is_refused(archive, tmp_path):
+    state = str(tmp_path / "state.json")
+    ChessBatch.saveStats(replayFirstChunks(archive, 2, 2), state)
+    with pytest.raises(ValueError):
+        ChessBatch.runBatch([archive], workers=1, chunkSize=5, stats=ChessBatch.loadStats(state))
+    with pytest.raises(SystemExit):
+        ChessBatch.main([archive, "--workers", "1", "--chunk", "5", "--state", state, "--resume"])
+
+def test_merge_with_another_chunk_size_is_refused(archive):
+    stats = replayFirstChunks(archive, 2, 1)
+    with pytest.raises(ValueError):
+        stats.merge(replayFirstChunks(archive, 5, 1))
+
+def test_illegal_ply_is_not_counted(tmp_path):
+    path = tmp_path / "illegal.pgn"
+    path.write_text('[Event "bad"]\n\n1. e4 e5 2. Ke3 Nc6 *\n')
+    stats = ChessBatch.replayChunk(str(path) + ":0", 1, [(None, "*", ["e4", "e5", "Ke3", "Nc6"], "bad")], 4,
+                                   ChessBatch.ChessEngine.GameState)
+    assert stats.illegalGames == 1
+    assert stats.plies == 2
+    assert stats.illegalReports[0]["ply"] == 3
+    assert stats.legalMoves == 20 + 20
@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+import ChessBitboard
+import ChessBook
+import ChessEngine
+import ChessPGN
+import ChessPerft
+
+BACKENDS = [ChessEngine.GameState, ChessBitboard.BitboardGameState]
+FENS = [fen for _, fen, _ in ChessPerft.POSITIONS] + [
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    "8/8/8/8/k7/8/1p6/4K3 b - - 12 70",
+]
+
+#Keys from the Polyglot book format description, moves in long notation from the start position
+POLYGLOT_KEYS = [
+    ("", 0x463b96181691fc9c),
+    ("e2e4", 0x823c9b50fd114196),
+    ("e2e4 d7d5", 0x0756b94461c50fb0),
+    ("e2e4 d7d5 e4e5", 0x662fafb965db29d4),
+    ("e2e4 d7d5 e4e5 f7f5", 0x22a48b5a8e47ff78),
+    ("e2e4 d7d5 e4e5 f7f5 e1e2", 0x652a607ca3f242c1),
+    ("e2e4 d7d5 e4e5 f7f5 e1e2 e8f7", 0x00fdd303c946bdd9),
+    ("a2a4 b7b5 h2h4 b5b4 c2c4", 0x3c8123ea7b067637),
+    ("a2a4 b7b5 h2h4 b5b4 c2c4 b4c3 a1a3", 0x5c3f9b829b279560),
+]
+
+def playRandomGame(gs, plies, seed):
+    rng = random.Random(seed)
+    for _ in range(plies):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+    return gs
+
+def playLongNotation(gs, text):
+    for notation in text.split():
+        gs.makeMove(gs.parseMove(notation))
+    return gs
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize("fen", FENS)
+def test_fen_round_trip(stateClass, fen):
+    gs = stateClass.fromFEN(fen)
+    assert gs.toFEN() == fen
+    assert gs.zobristKey == ChessEngine.GameState.fromFEN(fen).zobristKey
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize("seed", range(4))
+def test_san_round_trip(stateClass, seed):
+    gs = playRandomGame(stateClass.fromFEN(FENS[seed % len(FENS)]), 60, seed)
+    for move in gs.getValidMoves():
+        assert gs.parseSAN(gs.getSAN(move)) == move
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize("seed", range(4))
+def test_pgn_round_trip(stateClass, seed):
+    gs = playRandomGame(stateClass.fromFEN(FENS[seed % len(FENS)]), 80, seed)
+    text = ChessPGN.writeGame(gs, {"Event": "round trip"})
+    game, = ChessPGN.readGames(text.splitlines(True))
+    assert game.tags["Event"] == "round trip"
+    assert [move.code for move in game.play(stateClass).moveLog] == [move.code for move in gs.moveLog]
+    assert game.play(stateClass).toFEN() == gs.toFEN()
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize("seed", range(4))
+def test_bytes_round_trip(stateClass, seed):
+    gs = playRandomGame(stateClass.fromFEN(FENS[seed % len(FENS)]), 50, seed)
+    for withHistory in (True, False):
+        copy = stateClass.fromBytes(gs.toBytes(withHistory))
+        assert copy.toFEN() == gs.toFEN()
+        assert copy.zobristKey == gs.zobristKey
+        assert len(copy.moveLog) == (len(gs.moveLog) if withHistory else 0)
+    copy = stateClass.fromBytes(gs.toBytes())
+    while gs.moveLog: #the replayed history takes back the same way
+        gs.undoMove()
+        copy.undoMove()
+        assert copy.toFEN() == gs.toFEN()
+
+def test_bytes_rejects_tampered_snapshot():
+    data = bytearray(playLongNotation(ChessEngine.GameState(), "e2e4 e7e5 g1f3").toBytes())
+    data[-2] ^= 1
+    with pytest.raises(ValueError):
+        ChessEngine.GameState.fromBytes(bytes(data))
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize("moves, key", POLYGLOT_KEYS)
+def test_polyglot_key(stateClass, moves, key):
+    assert ChessBook.polyglotKey(playLongNotation(stateClass(), moves)) == key
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+def test_polyglot_key_matches_python_chess(stateClass):
+    chess = pytest.importorskip("chess")
+    polyglot = pytest.importorskip("chess.polyglot")
+    for seed, fen in enumerate(FENS):
+        gs = playRandomGame(stateClass.fromFEN(fen), 40, seed)
+        assert ChessBook.polyglotKey(gs) == polyglot.zobrist_hash(chess.Board(gs.toFEN()))
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize("fen", [
+    "4k3/8/8/8/8/8/8/4K2n w K - 0 1", #no rook on h1
+    "4k3/8/8/8/8/8/8/R3K3 w K - 0 1", #rook on the other side
+    "r3k3/8/8/8/8/8/8/4K3 b kq - 0 1",
+    "4k2r/8/8/8/8/8/8/4K2R w KQk - 0 1",
+    "r3k2r/8/8/8/8/8/8/R4K1R w KQkq - 0 1", #king off its square
+    "4k3/8/8/8/8/8/8/p3K3 b - - 0 1",
+    "P3k3/8/8/8/8/8/8/4K3 w - - 0 1",
+    "4k3/8/8/8/8/8/8/3pK3 w - - 0 1",
+])
+def test_fen_rejects_positions_the_generators_cannot_play(stateClass, fen):
+    with pytest.raises(ValueError):
+        stateClass.fromFEN(fen)
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+def test_fen_castling_rights_with_king_and_rook_home(stateClass):
+    gs = stateClass.fromFEN("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    notations = {move.getLongNotation() for move in gs.getValidMoves()}
+    assert {"e1g1", "e1c1"} <= notations
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ChessEngine
+import ChessParallel
+import ChessSearch
+
+@pytest.fixture
+def executor():
+    #Threads run the same task functions as the process pool without the start-up cost
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        yield pool
+
+def test_parallel_search_reports_completed_depth(executor):
+    gs = ChessEngine.GameState()
+    result = ChessParallel.parallelSearch(gs, ChessSearch.SearchLimits(depth=2), workers=1, executor=executor)
+    assert result.depth == 2
+    assert result.bestMove in gs.getValidMoves()
+    assert result.pv[0] is result.bestMove
+
+def test_parallel_search_ignores_unfinished_children(executor):
+    #One node per root move: no task completes an iteration, so no score from them may win
+    gs = ChessEngine.GameState()
+    result = ChessParallel.parallelSearch(gs, ChessSearch.SearchLimits(depth=4, nodes=1), workers=1,
+                                          executor=executor)
+    assert result.depth == 0
+    assert result.score == 0
+    assert result.bestMove is gs.getValidMoves()[0]
+
+def test_parallel_search_finds_mate_in_one(executor):
+    gs = ChessEngine.GameState.fromFEN("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")
+    result = ChessParallel.parallelSearch(gs, ChessSearch.SearchLimits(depth=2), workers=1, executor=executor)
+    assert result.bestMove.getLongNotation() == "a1a8"
+    assert result.score == ChessSearch.MATE_SCORE - 1
+
+@pytest.mark.parametrize("fen", [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r1bqkbnr/pppp1ppp/2n5/4p3/3PP3/5N2/PPP2PPP/RNBQKB1R b KQkq - 0 3",
+    "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1",
+    "4k3/8/8/3q4/8/8/3R4/4K3 w - - 0 1",
+])
+@pytest.mark.parametrize("depth", [1, 2])
+def test_parallel_search_matches_serial_search(executor, fen, depth):
+    gs = ChessEngine.GameState.fromFEN(fen)
+    limits = ChessSearch.SearchLimits(depth=depth)
+    serial = ChessSearch.Searcher().search(gs, limits)
+    parallel = ChessParallel.parallelSearch(gs, limits, workers=1, executor=executor)
+    assert parallel.depth == depth
+    assert parallel.score == serial.score
+    if abs(serial.score) < ChessSearch.MATE_BOUND: #the serial search stops deepening once it has found a mate
+        assert serial.depth == depth
+    if abs(serial.score) >= ChessSearch.MATE_BOUND or fen.startswith("4k3"):
+        assert parallel.bestMove == serial.bestMove
@@ -0,0 +1,25 @@
+import pytest
+
+import ChessBitboard
+import ChessEngine
+import ChessPerft
+
+BACKENDS = [ChessEngine.GameState, ChessBitboard.BitboardGameState]
+MAX_NODES = 100000 #deepest count per position that stays under this, to keep the suite quick
+
+CASES = [(name, fen, depth, counts[depth - 1]) for name, fen, counts in ChessPerft.POSITIONS
+         for depth in [max(d for d in range(1, len(counts) + 1) if counts[d - 1] <= MAX_NODES)]]
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize("name, fen, depth, expected", CASES, ids=[case[0] for case in CASES])
+def test_perft(stateClass, name, fen, depth, expected):
+    gs = stateClass.fromFEN(fen)
+    assert ChessPerft.perft(gs, depth) == expected
+    assert gs.toFEN() == fen #every move was taken back
+
+@pytest.mark.parametrize("stateClass", BACKENDS, ids=lambda cls: cls.__name__)
+def test_divide_adds_up(stateClass):
+    name, fen, counts = ChessPerft.POSITIONS[1]
+    results = ChessPerft.divide(stateClass.fromFEN(fen), 2)
+    assert len(results) == counts[0]
+    assert sum(nodes for _, nodes in results) == counts[1]
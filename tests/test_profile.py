@@ -0,0 +1,28 @@
+import pytest
+
+import ChessBitboard
+import ChessEngine
+import ChessProfile
+
+@pytest.fixture
+def profiler():
+    ChessProfile.reset()
+    ChessProfile.enable()
+    yield ChessProfile
+    ChessProfile.disable()
+    ChessProfile.reset()
+
+@pytest.mark.parametrize("stateClass, generator", [(ChessEngine.GameState, "getAllPossibleMoves"),
+                                                   (ChessBitboard.BitboardGameState, "generatePieceMoves")])
+def test_counters_follow_the_methods_move_generation_calls(profiler, stateClass, generator):
+    gs = stateClass()
+    for text in ("e4", "e5", "Nf3", "Nc6", "Bb5"):
+        gs.makeMove(gs.parseSAN(text))
+        gs.undoMove()
+        gs.makeMove(gs.parseSAN(text))
+    stats = profiler.snapshot()
+    assert stats["makeMove"]["calls"] == 10
+    assert stats["undoMove"]["calls"] == 5
+    for name in ("getValidMoves", "generateValidMoves", generator, "attackMap", "computeAttackMap"):
+        assert stats[name]["calls"] > 0, name
+    assert profiler.totalSeconds(stats) > 0
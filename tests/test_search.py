@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+import ChessEngine
+import ChessSearch
+import ChessTablebase
+import ChessUCI
+
+
+class FixedTablebases():
+    #Every position with at most three pieces is a loss for the side to move, mate in `plies`
+    def __init__(self, plies):
+        self.plies = plies
+
+    def probe(self, gs):
+        pieces = sum(piece != "--" for row in gs.board for piece in row)
+        return (-1, self.plies) if pieces <= 3 else None
+
+
+@pytest.fixture(scope="module")
+def krvk(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("tablebases"))
+    ChessTablebase.generate(["KRvK"], directory)
+    tablebases = ChessTablebase.Tablebases(directory)
+    yield tablebases
+    tablebases.close()
+
+
+def test_tablebase_mate_reported_as_mate(krvk):
+    gs = ChessEngine.GameState.fromFEN("8/8/8/4k3/8/8/8/R3K3 w - - 0 1")
+    result = ChessSearch.Searcher(tablebases=krvk).search(gs, ChessSearch.SearchLimits(depth=3))
+    best = result.bestMove
+    gs.makeMove(best)
+    wdl, plies = krvk.probe(gs)
+    assert wdl == -1
+    assert result.score == ChessSearch.MATE_SCORE - 1 - plies
+    assert ChessUCI.scoreString(result.score) == "mate %d" % ((plies + 2) // 2)
+    assert result.depth == 1  #a mate score ends iterative deepening
+
+
+def test_long_tablebase_mate_stays_in_mate_band():
+    #80 plies, the longest KRvKN mate: past MAX_PLY, still a mate score
+    gs = ChessEngine.GameState.fromFEN("8/8/8/4k3/8/8/8/R3K3 w - - 0 1")
+    searcher = ChessSearch.Searcher(tablebases=FixedTablebases(80))
+    result = searcher.search(gs, ChessSearch.SearchLimits(depth=4))
+    assert result.score == ChessSearch.MATE_SCORE - 81
+    assert result.score >= ChessSearch.MATE_BOUND
+    assert ChessUCI.scoreString(result.score) == "mate 41"
+    assert ChessUCI.scoreString(-result.score) == "mate -40"
+
+
+@pytest.mark.parametrize("ply", [0, 5, 40])
+def test_mate_scores_round_trip_through_table(ply):
+    for score in (ChessSearch.MATE_SCORE - 150, -(ChessSearch.MATE_SCORE - 150), 250):
+        assert ChessSearch.scoreFromTable(ChessSearch.scoreToTable(score, ply), ply) == score
+        if abs(score) > 1000:
+            assert abs(ChessSearch.scoreToTable(score, ply)) >= ChessSearch.MATE_BOUND
+
+
+def test_stop_token_set_before_search_starts():
+    stop = threading.Event()
+    stop.set()
+    start = time.perf_counter()
+    result = ChessSearch.Searcher().search(ChessEngine.GameState(), ChessSearch.SearchLimits(depth=30, stop=stop))
+    assert time.perf_counter() - start < 5
+    assert result.depth <= 1
+    assert result.bestMove is not None
+
+def test_stop_before_search_does_not_stick():
+    searcher = ChessSearch.Searcher()
+    searcher.stop()
+    result = searcher.search(ChessEngine.GameState(), ChessSearch.SearchLimits(depth=2))
+    assert result.depth == 2
+
+def test_engine_worker_cancel_stops_pending_search():
+    ChessMain = pytest.importorskip("ChessMain")
+    worker = ChessMain.EngineWorker(ChessSearch.Searcher())
+    worker.submit("search", ChessEngine.GameState(), thinkTime=60.0)
+    worker.cancel()
+    start = time.perf_counter()
+    worker.close()
+    assert time.perf_counter() - start < 5
+    assert worker.poll() == []
+
+def test_mate_at_the_horizon_is_found():
+    #Depth 1 only plays the move; that black is mated has to be seen by quiescence
+    gs = ChessEngine.GameState.fromFEN("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1")
+    result = ChessSearch.Searcher().search(gs, ChessSearch.SearchLimits(depth=1))
+    assert result.bestMove.getLongNotation() == "a1a8"
+    assert result.score == ChessSearch.MATE_SCORE - 1
+
+def test_quiescence_scores_stalemate_as_draw():
+    gs = ChessEngine.GameState.fromFEN("7k/8/6QK/8/8/8/8/8 b - - 0 1")
+    assert ChessSearch.Searcher().quiescence(gs, -ChessSearch.INFINITY, ChessSearch.INFINITY, 0) == 0
+
+def test_quiescence_searches_quiet_evasions():
+    #Black is in check with only king steps out of it: searched instead of standing pat, and not mate
+    gs = ChessEngine.GameState.fromFEN("R6k/8/8/8/8/8/8/6K1 b - - 0 1")
+    searcher = ChessSearch.Searcher()
+    searcher.search(gs, ChessSearch.SearchLimits(depth=1))
+    searcher.nodes = 0
+    score = searcher.quiescence(gs, -ChessSearch.INFINITY, ChessSearch.INFINITY, 0)
+    assert searcher.nodes == 2 #Kg7 and Kh7
+    assert -ChessSearch.MATE_BOUND < score < 0
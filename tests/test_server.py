@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+import ChessServer
+
+class FakeWriter():
+    def __init__(self):
+        self.data = b""
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.data += data
+
+def exchange(server, connection, message):
+    connection.writer.data = b""
+    server.handleLine(connection, json.dumps(message).encode())
+    return [json.loads(line) for line in connection.writer.data.decode().splitlines()]
+
+@pytest.fixture
+def server():
+    return ChessServer.ChessServer()
+
+def test_create_join_and_move(server):
+    white = ChessServer.Connection(FakeWriter())
+    black = ChessServer.Connection(FakeWriter())
+    created, = exchange(server, white, {"op": "create"})
+    game = created["game"]
+    assert exchange(server, black, {"op": "join", "game": game})[0]["color"] == "b"
+    moved, = exchange(server, white, {"op": "move", "game": game, "move": "e2e4"})
+    assert moved["move"] == "e2e4" and moved["ply"] == 1
+
+@pytest.mark.parametrize("message", [
+    {"op": "join", "game": [1]},
+    {"op": "state", "game": {"id": 1}},
+    {"op": "move", "game": True, "move": "e2e4"},
+    {"op": "join", "game": "1"},
+    {"op": ["join"], "game": 1},
+    {"op": {"join": 1}},
+])
+def test_bad_ids_answer_with_an_error(server, message):
+    connection = ChessServer.Connection(FakeWriter())
+    exchange(server, connection, {"op": "create"})
+    replies = exchange(server, connection, message)
+    assert [reply["op"] for reply in replies] == ["error"]